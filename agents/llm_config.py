@@ -3,18 +3,30 @@
 llm_config.py - 通用的 LLM 配置模块
 
 提供统一的 LLM 客户端配置，包括 BASE_URL、API_KEY、MODEL 和 client 实例。
+client / async_client 在整个进程内共享同一个 HTTP 连接池，复用 keep-alive 连接。
+客户端在第一次访问时才创建，导入本模块不会加载 anthropic/httpx。
 所有 agents 文件夹中的 Python 文件都应该使用此模块来访问 LLM 服务。
 
 使用方法:
     from llm_config import client, MODEL, BASE_URL, API_KEY
+    from llm_config import async_client  # 异步调用场景
+    from llm_config import get_client      # 显式获取（惰性创建）
 
 配置优先级:
-    1. 环境变量 BASE_URL, API_KEY, MODEL
+    1. 环境变量 BASE_URL, API_KEY, MODEL（BASE_URL/API_KEY 在客户端创建时读取）
     2. 默认值 (DashScope Qwen Plus)
+
+连接参数（环境变量）:
+    ANTHROPIC_MAX_CONN      最大连接数，默认 50
+    ANTHROPIC_MAX_RETRIES   失败重试次数（SDK 内置指数退避），默认 3
+    LLM_ENDPOINTS_JSON      多端点配置（JSON 列表），设置后 client 为轮询 + 故障切换的 ClientPool
 """
 
+import itertools
+import json
 import os
-from anthropic import Anthropic
+import threading
+import time
 
 # LLM 配置 - 使用环境变量或默认值
 BASE_URL = os.getenv("BASE_URL", "https://coding.dashscope.aliyuncs.com/apps/anthropic")
@@ -23,5 +35,256 @@ MODEL = os.getenv("MODEL", "qwen3.5-plus")
 #MODEL = os.getenv("MODEL", "MiniMax-M2.5")
 #MODEL = os.getenv("MODEL", "glm-5")
 
-# 初始化 Anthropic 客户端
-client = Anthropic(base_url=BASE_URL, api_key=API_KEY)
+_client = None
+_async_client = None
+_init_lock = threading.Lock()
+
+
+def _http_settings():
+    """在创建客户端时才读取环境变量，允许导入后再修改配置"""
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("ANTHROPIC_MAX_CONN", "50")),
+        max_keepalive_connections=32,
+        keepalive_expiry=30.0,
+    )
+    return limits, httpx.Timeout(60.0, connect=5.0)
+
+
+def _new_client(base_url: str, api_key: str, max_retries: int, auth_token: str = None):
+    import httpx
+    from anthropic import Anthropic
+
+    limits, timeout = _http_settings()
+    return Anthropic(
+        base_url=base_url,
+        api_key=api_key,
+        auth_token=auth_token,
+        max_retries=max_retries,
+        http_client=httpx.Client(limits=limits, timeout=timeout),
+    )
+
+
+def _is_retryable(error: Exception) -> bool:
+    """连接错误、超时、429、5xx 换端点重试；其他错误（4xx、参数错误等）直接抛出"""
+    from anthropic import APIConnectionError, APIStatusError
+
+    if isinstance(error, APIConnectionError):  # 包括 APITimeoutError
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+# ============================================================
+# 多端点客户端池
+# ============================================================
+
+class _Endpoint:
+    """单个 LLM 端点：独立的客户端、并发上限和健康状态"""
+
+    def __init__(self, base_url: str, api_key: str, model: str = None, concurrency_limit: int = 8):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        # 端点内不重试，失败直接交给 ClientPool 切换到下一个端点；
+        # 同时以 Authorization: Bearer 发送本端点自己的 key（网关需要）
+        self.client = _new_client(base_url, api_key, max_retries=0, auth_token=api_key)
+        self.semaphore = threading.BoundedSemaphore(concurrency_limit)
+        self.failures = 0
+        self.down_until = 0.0
+
+
+class _PoolMessages:
+    """兼容 client.messages.create(...) / client.messages.stream(...) 调用方式"""
+
+    def __init__(self, pool: "ClientPool"):
+        self._pool = pool
+
+    def create(self, **kwargs):
+        return self._pool.send(**kwargs)
+
+    def stream(self, **kwargs):
+        return _PoolStream(self._pool, kwargs)
+
+
+class _PoolStream:
+    """
+    client.messages.stream(...) 返回的上下文管理器
+
+    进入时选择端点并占用其并发槽位，直到退出 with 块才释放；建立连接失败时
+    与 create 一样切换端点重试。流开始后无法透明切换端点，中途出错直接抛出。
+    """
+
+    def __init__(self, pool: "ClientPool", kwargs: dict):
+        self._pool = pool
+        self._kwargs = kwargs
+        self._endpoint = None
+        self._manager = None
+
+    def __enter__(self):
+        self._endpoint, self._manager, stream = self._pool.open_stream(**self._kwargs)
+        return stream
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return self._manager.__exit__(exc_type, exc, tb)
+        finally:
+            self._endpoint.semaphore.release()
+
+
+class ClientPool:
+    """
+    多端点轮询客户端池
+
+    通过环境变量 LLM_ENDPOINTS_JSON 配置，例如:
+        [{"base_url": "...", "api_key": "...", "model": "qwen3.5-plus", "concurrency_limit": 8},
+         {"base_url": "...", "api_key": "...", "model": "glm-5"}]
+
+    - 轮询选择端点，跳过处于冷却期的端点
+    - 连接错误、超时、429、5xx 时标记端点失败（冷却时间指数增长），退避后换下一个端点重试
+    - 其他错误（4xx、参数错误等）直接抛出，不做切换
+    - 端点配置了 model 时覆盖调用方传入的 model
+    - create 和 stream 都受端点的 concurrency_limit 限制
+    """
+
+    def __init__(self, endpoints: list):
+        if not endpoints:
+            raise ValueError("LLM_ENDPOINTS_JSON must contain at least one endpoint")
+        self.endpoints = [_Endpoint(**ep) for ep in endpoints]
+        self._counter = itertools.count()
+        # 保护各端点的 failures / down_until，多个线程会同时更新
+        self._state_lock = threading.Lock()
+        self.messages = _PoolMessages(self)
+        # 兼容直接读取 client.api_key 的代码
+        self.api_key = self.endpoints[0].api_key
+
+    @property
+    def auth_token(self):
+        return self.endpoints[0].client.auth_token
+
+    @auth_token.setter
+    def auth_token(self, value):
+        """兼容 client.auth_token = client.api_key：各端点已用自己的 key 作 Bearer，
+        其他取值则统一设置到每个端点的客户端"""
+        if value == self.api_key:
+            return
+        for ep in self.endpoints:
+            ep.client.auth_token = value
+
+    def pick(self) -> _Endpoint:
+        """轮询选择下一个健康端点；全部冷却中时仍按轮询返回"""
+        n = len(self.endpoints)
+        start = next(self._counter)
+        now = time.monotonic()
+        for i in range(n):
+            ep = self.endpoints[(start + i) % n]
+            if ep.down_until <= now:
+                return ep
+        return self.endpoints[start % n]
+
+    def _mark_ok(self, ep: _Endpoint):
+        with self._state_lock:
+            ep.failures = 0
+            ep.down_until = 0.0
+
+    def _mark_failed(self, ep: _Endpoint):
+        with self._state_lock:
+            ep.failures += 1
+            ep.down_until = time.monotonic() + min(2 ** ep.failures, 60)
+
+    def _attempts(self, call):
+        """
+        依次在轮询选出的端点上执行 call(endpoint, params)，可重试的错误换端点再试
+
+        call 在持有端点并发槽位时执行，是否释放槽位由 call 决定（见 send / open_stream）。
+        """
+        last_error = None
+        for attempt in range(len(self.endpoints) + 1):
+            ep = self.pick()
+            try:
+                result = call(ep)
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+                last_error = e
+            else:
+                self._mark_ok(ep)
+                return result
+
+            self._mark_failed(ep)
+            time.sleep(min(0.5 * 2 ** attempt, 8))
+        raise last_error
+
+    @staticmethod
+    def _params(ep: _Endpoint, kwargs: dict) -> dict:
+        return dict(kwargs, model=ep.model) if ep.model else kwargs
+
+    def send(self, **kwargs):
+        def call(ep):
+            with ep.semaphore:
+                return ep.client.messages.create(**self._params(ep, kwargs))
+
+        return self._attempts(call)
+
+    def open_stream(self, **kwargs):
+        """建立流式请求，返回 (端点, SDK 流管理器, 流)；端点槽位由调用方在流结束后释放"""
+        def call(ep):
+            ep.semaphore.acquire()
+            try:
+                manager = ep.client.messages.stream(**self._params(ep, kwargs))
+                return ep, manager, manager.__enter__()
+            except BaseException:
+                ep.semaphore.release()
+                raise
+
+        return self._attempts(call)
+
+
+def get_client():
+    """获取共享的同步 Anthropic 客户端（首次调用时创建）
+
+    设置了 LLM_ENDPOINTS_JSON 时返回 ClientPool，接口与 Anthropic 客户端的
+    messages.create 兼容。
+    """
+    global _client
+    if _client is None:
+        with _init_lock:
+            if _client is None:
+                endpoints = os.getenv("LLM_ENDPOINTS_JSON")
+                if endpoints:
+                    _client = ClientPool(json.loads(endpoints))
+                else:
+                    _client = _new_client(
+                        os.getenv("BASE_URL", BASE_URL),
+                        os.getenv("API_KEY", API_KEY),
+                        int(os.getenv("ANTHROPIC_MAX_RETRIES", "3")),
+                    )
+    return _client
+
+
+def get_async_client():
+    """获取共享的异步 Anthropic 客户端（首次调用时创建）"""
+    global _async_client
+    if _async_client is None:
+        with _init_lock:
+            if _async_client is None:
+                import httpx
+                from anthropic import AsyncAnthropic
+
+                limits, timeout = _http_settings()
+                _async_client = AsyncAnthropic(
+                    base_url=os.getenv("BASE_URL", BASE_URL),
+                    api_key=os.getenv("API_KEY", API_KEY),
+                    max_retries=int(os.getenv("ANTHROPIC_MAX_RETRIES", "3")),
+                    http_client=httpx.AsyncClient(limits=limits, timeout=timeout),
+                )
+    return _async_client
+
+
+def __getattr__(name):
+    # 兼容 `from llm_config import client`：访问时才创建客户端
+    if name == "client":
+        return get_client()
+    if name == "async_client":
+        return get_async_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -10,6 +10,7 @@ from .server import (
     browser_navigate,
     browser_screenshot,
     browser_get_content,
+    browser_get_elements,
     browser_click,
     browser_fill,
     browser_evaluate,
@@ -24,6 +25,7 @@ __all__ = [
     'browser_navigate',
     'browser_screenshot',
     'browser_get_content',
+    'browser_get_elements',
     'browser_click',
     'browser_fill',
     'browser_evaluate',
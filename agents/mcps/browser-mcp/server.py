@@ -10,17 +10,114 @@ MCP Browser Server - 浏览器模拟 MCP 服务器
 - 等待和重试机制
 
 基于 Model Context Protocol (MCP) 规范实现
+
+共享浏览器模式：
+    设置环境变量 BROWSER_CDP_ENDPOINT（例如 http://127.0.0.1:9222）后，
+    服务器通过 CDP 连接到已有的 Chromium，而不是自己启动一个新进程；
+    每个 MCP 进程只创建自己的 BrowserContext。共享的 Chromium 可以用
+    `python server.py --launch-shared` 以 sidecar 方式启动。
+
+    安全提示：远程调试端口没有任何鉴权，能访问该端口的进程可以读取和
+    控制所有 Agent 的上下文（cookie、页面内容等）。只应监听 127.0.0.1，
+    且只在互相信任的 Agent 之间共享。
+
+会话状态持久化：
+    设置 BROWSER_STATE_DIR（例如 ./data/browser_state）后，每个会话关闭时把
+    cookie 和 localStorage 保存为 <session_id>.json，下次创建同名会话时自动
+    恢复，省去重复登录。文件只在会话关闭（browser_close / 服务器退出）时更新；
+    删除对应文件即可让会话从空白状态开始。HTTP 缓存不在持久化范围内。
+
+传输方式：
+    默认使用 stdio，一个 MCP 客户端对应一个服务器进程，请求在同一条管道上
+    串行处理，并发一高延迟和失败率就会急剧上升。设置 MCP_TRANSPORT=http
+    （或 --http）改用 StreamableHTTP，多个 Agent 可以并发访问同一个服务器，
+    配合多会话上下文池共享一个浏览器。HTTP 模式监听 MCP_HOST:MCP_PORT
+    （默认 127.0.0.1:8000），没有鉴权，不要直接暴露到公网。
 """
 
 import asyncio
+import base64
+import hashlib
 import json
+import time
+import re
+import signal
 import sys
 import os
-from typing import Any, Optional
-from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, List, Optional, Union
+from collections import OrderedDict
 
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Image
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+# 未指定 session_id 的调用共享这个默认会话
+DEFAULT_SESSION = "default"
+
+# Chromium 启动参数
+CHROMIUM_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-accelerated-2d-canvas',
+    '--disable-gpu',
+]
+
+# 纯文本抓取时拦截的资源类型；BROWSER_BLOCK_RESOURCES=0 关闭默认拦截
+BLOCKED_RESOURCE_TYPES = frozenset({'image', 'media', 'font', 'stylesheet'})
+BLOCK_RESOURCES_DEFAULT = os.getenv("BROWSER_BLOCK_RESOURCES", "1") == "1"
+
+# domcontentloaded 之后额外等待网络空闲的上限（毫秒）
+NETWORK_IDLE_GRACE_MS = 3000
+
+# get_content 返回的最大字符数
+MAX_CONTENT_CHARS = 50000
+
+# 用 TreeWalker 单次遍历提取页面文本，直接跳过 script/style 子树，
+# 不再克隆整个 DOM。只拼接 [offset, offset + maxLength) 范围内的文本，
+# 同时统计全文长度，调用方可以据此分段读取
+PAGE_TEXT_JS = '''({offset, maxLength}) => {
+    const SKIP = new Set(['SCRIPT', 'STYLE', 'NOSCRIPT', 'TEMPLATE'])
+    const root = document.body || document.documentElement
+    const walker = document.createTreeWalker(root, NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT, {
+        acceptNode: n => n.nodeType === 1
+            ? (SKIP.has(n.tagName) ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_SKIP)
+            : NodeFilter.FILTER_ACCEPT
+    })
+    const end = offset + maxLength
+    const out = []
+    let pos = 0
+    let n
+    while ((n = walker.nextNode())) {
+        const text = n.nodeValue.replace(/\\s+/g, ' ').trim()
+        if (!text) continue
+        const seg = pos === 0 ? text : '\\n' + text
+        if (pos + seg.length > offset && pos < end) {
+            out.push(seg.slice(Math.max(0, offset - pos), end - pos))
+        }
+        pos += seg.length
+    }
+    return {text: out.join(''), title: document.title, total: pos}
+}'''
+
+# 指定元素的文本和页面标题一次取回
+ELEMENT_TEXT_JS = '''(el, {offset, maxLength}) => {
+    const text = el.innerText
+    return {text: text.slice(offset, offset + maxLength), title: document.title, total: text.length}
+}'''
+
+# 一次 evaluate 同时取回 URL 和标题，代替 page.title() 的额外往返
+PAGE_META_JS = '() => ({url: location.href, title: document.title})'
+
+# 一次 evaluate 读取多个选择器的文本（all=True 时返回所有匹配元素）
+ELEMENTS_TEXT_JS = '''({selectors, all, maxLength}) => selectors.map(s => {
+    if (all) {
+        return Array.from(document.querySelectorAll(s), el => el.innerText.slice(0, maxLength))
+    }
+    const el = document.querySelector(s)
+    return el ? el.innerText.slice(0, maxLength) : null
+})'''
 
 # ============================================================
 # MCP Server 配置
@@ -35,6 +132,7 @@ mcp = FastMCP(
     - browser_navigate: 导航到指定 URL
     - browser_screenshot: 截取当前页面截图
     - browser_get_content: 获取页面文本内容
+    - browser_get_elements: 批量获取多个元素的文本
     - browser_click: 点击页面元素
     - browser_fill: 在输入框中填写内容
     - browser_evaluate: 执行 JavaScript 代码
@@ -45,91 +143,224 @@ mcp = FastMCP(
     """,
 )
 
+# ============================================================
+# 结果缓存
+# ============================================================
+
+class TTLCache:
+    """带过期时间的 LRU 缓存"""
+    
+    def __init__(self, maxsize: int = 256, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+    
+    def get(self, key) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def clear(self):
+        self._data.clear()
+
+
+def _cache_key(*parts) -> bytes:
+    return hashlib.blake2s("|".join(str(p) for p in parts).encode()).digest()
+
+
 # ============================================================
 # 浏览器管理器
 # ============================================================
 
 class BrowserManager:
-    """浏览器会话管理器"""
+    """浏览器会话管理器
+
+    一个 Browser 进程 + 多个 BrowserContext：每个 session_id 独占一个
+    context 和 page，并发的工具调用互不干扰。
+    """
     
     def __init__(self):
         self.playwright = None
         self.browser: Optional[Browser] = None
-        self.context: Optional[BrowserContext] = None
-        self.page: Optional[Page] = None
+        self._contexts: dict[str, BrowserContext] = {}
+        self._pages: dict[str, Page] = {}
+        self._lock = asyncio.Lock()
         self.headless = True
-        self.timeout = 30000  # 30 秒超时
+        self.timeout = int(os.getenv("BROWSER_NAV_TIMEOUT", "15000"))  # 默认 15 秒超时
+        self.shared = False  # 是否通过 CDP 连接到共享浏览器
+        self._start_lock = asyncio.Lock()
+        self._ready = False
+        # 页面状态版本号：点击、填写、执行 JS 等操作后递增，使旧缓存失效
+        self._generations: dict[str, int] = {}
+        self._block_resources: dict[str, bool] = {}
+        cache_ttl = float(os.getenv("BROWSER_CACHE_TTL", "60"))
+        self._nav_cache = TTLCache(maxsize=256, ttl=cache_ttl)
+        self._content_cache = TTLCache(maxsize=256, ttl=cache_ttl)
         
     async def start(self, headless: bool = True):
-        """启动浏览器"""
+        """启动浏览器（幂等，并发首次调用只会启动一次）"""
+        if self._ready:
+            return
+        
+        async with self._start_lock:
+            if self._ready:
+                return
+            await self._start(headless)
+            self._ready = True
+    
+    async def _start(self, headless: bool):
         if self.playwright is None:
             self.playwright = await async_playwright().start()
         
         if self.browser is None:
-            # 启动 Chromium 浏览器
-            self.browser = await self.playwright.chromium.launch(
-                headless=headless,
-                args=[
-                    '--no-sandbox',
-                    '--disable-setuid-sandbox',
-                    '--disable-dev-shm-usage',
-                    '--disable-accelerated-2d-canvas',
-                    '--disable-gpu',
-                ]
-            )
-        
-        if self.context is None:
-            # 创建浏览器上下文
-            self.context = await self.browser.new_context(
-                viewport={'width': 1280, 'height': 720},
-                user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                locale='zh-CN',
-                timezone_id='Asia/Shanghai',
-            )
+            endpoint = os.getenv("BROWSER_CDP_ENDPOINT")
+            if endpoint:
+                # 连接到共享的 Chromium，只在其中创建自己的上下文
+                self.browser = await self.playwright.chromium.connect_over_cdp(endpoint)
+                self.shared = True
+            else:
+                # 启动 Chromium 浏览器
+                self.browser = await self.playwright.chromium.launch(
+                    headless=headless,
+                    args=CHROMIUM_ARGS,
+                )
+                self.shared = False
         
         self.headless = headless
+    
+    def _state_path(self, session_id: str) -> Optional[Path]:
+        """会话 storage_state 文件路径（未配置 BROWSER_STATE_DIR 时为 None）"""
+        state_dir = os.getenv("BROWSER_STATE_DIR")
+        if not state_dir:
+            return None
+        safe_id = re.sub(r'[^\w.-]', '_', session_id)
+        return Path(state_dir) / f"{safe_id}.json"
+    
+    async def _new_context(self, session_id: str = DEFAULT_SESSION) -> BrowserContext:
+        """创建浏览器上下文，有保存的 storage_state 时恢复 cookie 和 localStorage"""
+        state_path = self._state_path(session_id)
+        return await self.browser.new_context(
+            viewport={'width': 1280, 'height': 720},
+            user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            locale='zh-CN',
+            timezone_id='Asia/Shanghai',
+            storage_state=str(state_path) if state_path and state_path.exists() else None,
+        )
         
-    async def get_page(self) -> Page:
-        """获取或创建页面"""
-        if self.context is None:
+    async def acquire(self, session_id: str = DEFAULT_SESSION) -> Page:
+        """获取或创建 session 对应的页面"""
+        if not self._ready:
             await self.start()
         
-        if self.page is None or self.page.is_closed():
-            self.page = await self.context.new_page()
-            self.page.set_default_timeout(self.timeout)
-        
-        return self.page
+        async with self._lock:
+            page = self._pages.get(session_id)
+            if page is not None and not page.is_closed():
+                return page
+            
+            context = self._contexts.get(session_id)
+            if context is None:
+                context = await self._new_context(session_id)
+                await context.route("**/*", lambda route: self._route(session_id, route))
+                self._contexts[session_id] = context
+            
+            page = await context.new_page()
+            page.set_default_timeout(self.timeout)
+            self._pages[session_id] = page
+            self._touch(session_id)
+            return page
+    
+    async def _route(self, session_id: str, route):
+        """按会话设置拦截图片、字体、媒体和样式表请求"""
+        block = self._block_resources.get(session_id, BLOCK_RESOURCES_DEFAULT)
+        if block and route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.continue_()
+    
+    def _touch(self, session_id: str):
+        """标记页面状态已改变"""
+        self._generations[session_id] = self._generations.get(session_id, 0) + 1
     
-    async def navigate(self, url: str, wait_until: str = 'networkidle') -> dict:
+    async def navigate(
+        self,
+        url: str,
+        wait_until: str = 'domcontentloaded',
+        session_id: str = DEFAULT_SESSION,
+        cache: bool = True,
+        block_resources: Optional[bool] = None,
+    ) -> dict:
         """导航到指定 URL"""
-        page = await self.get_page()
+        page = await self.acquire(session_id)
+        if block_resources is None:
+            block_resources = BLOCK_RESOURCES_DEFAULT
         
+        # 页面仍停留在上次导航的结果上时，跳过重复导航
+        key = _cache_key(session_id, self._generations.get(session_id), url, wait_until, block_resources)
+        if cache:
+            cached = self._nav_cache.get(key)
+            if cached is not None and cached['url'] == page.url:
+                return dict(cached, cached=True)
+        
+        self._block_resources[session_id] = block_resources
         try:
             response = await page.goto(url, wait_until=wait_until)
-            return {
+            if wait_until in ('domcontentloaded', 'commit'):
+                # 再给异步渲染一个短暂的空闲窗口，超时则直接返回
+                try:
+                    await page.wait_for_load_state('networkidle', timeout=NETWORK_IDLE_GRACE_MS)
+                except PlaywrightTimeoutError:
+                    pass
+            self._touch(session_id)
+            meta = await page.evaluate(PAGE_META_JS)
+            result = {
                 'success': True,
-                'url': page.url,
-                'title': await page.title(),
+                'url': meta['url'],
+                'title': meta['title'],
                 'status': response.status if response else None,
             }
+            key = _cache_key(session_id, self._generations.get(session_id), url, wait_until, block_resources)
+            self._nav_cache.set(key, result)
+            return result
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e),
             }
     
-    async def screenshot(self, full_page: bool = True) -> dict:
-        """截取当前页面截图"""
-        page = await self.get_page()
+    async def screenshot(
+        self,
+        full_page: bool = True,
+        session_id: str = DEFAULT_SESSION,
+        image_type: str = 'png',
+        quality: Optional[int] = None,
+    ) -> dict:
+        """截取当前页面截图（quality 只对 jpeg 生效）"""
+        page = await self.acquire(session_id)
+        # 截图需要图片和样式，之后的请求不再拦截
+        self._block_resources[session_id] = False
         
         try:
-            screenshot = await page.screenshot(full_page=full_page, type='png')
-            # 返回 base64 编码的截图
-            import base64
-            screenshot_b64 = base64.b64encode(screenshot).decode('utf-8')
+            if image_type == 'jpeg':
+                screenshot = await page.screenshot(full_page=full_page, type='jpeg', quality=quality or 80)
+            else:
+                screenshot = await page.screenshot(full_page=full_page, type='png')
+            # 返回原始图片字节，由调用方决定如何编码
             return {
                 'success': True,
-                'image': f'data:image/png;base64,{screenshot_b64}',
+                'image_bytes': screenshot,
+                'format': 'jpeg' if image_type == 'jpeg' else 'png',
                 'width': page.viewport_size['width'] if page.viewport_size else 1280,
                 'height': page.viewport_size['height'] if page.viewport_size else 720,
             }
@@ -139,36 +370,78 @@ class BrowserManager:
                 'error': str(e),
             }
     
-    async def get_content(self, selector: Optional[str] = None) -> dict:
-        """获取页面文本内容"""
-        page = await self.get_page()
+    async def get_content(
+        self,
+        selector: Optional[str] = None,
+        session_id: str = DEFAULT_SESSION,
+        cache: bool = True,
+        offset: int = 0,
+        max_chars: int = MAX_CONTENT_CHARS,
+    ) -> dict:
+        """获取页面文本内容（从 offset 开始最多 max_chars 个字符）"""
+        page = await self.acquire(session_id)
+        offset = max(0, offset)
+        max_chars = max(1, min(max_chars, MAX_CONTENT_CHARS))
+        window = {'offset': offset, 'maxLength': max_chars}
+        
+        key = _cache_key(session_id, self._generations.get(session_id), page.url, selector, offset, max_chars)
+        if cache:
+            cached = self._content_cache.get(key)
+            if cached is not None:
+                return cached
         
         try:
             if selector:
                 # 获取指定元素的内容
                 element = await page.query_selector(selector)
                 if element:
-                    text = await element.inner_text()
+                    data = await element.evaluate(ELEMENT_TEXT_JS, window)
                 else:
                     return {
                         'success': False,
                         'error': f'未找到元素：{selector}',
                     }
             else:
-                # 获取整个页面的文本内容
-                text = await page.evaluate('''() => {
-                    // 移除 script 和 style 标签
-                    const clones = document.cloneNode(true)
-                    const scripts = clones.querySelectorAll('script, style, noscript')
-                    scripts.forEach(s => s.remove())
-                    return clones.body.innerText
-                }''')
+                # 获取整个页面的文本内容（在页面内截断，只传输需要的部分）
+                data = await page.evaluate(PAGE_TEXT_JS, window)
             
+            next_offset = offset + len(data['text'])
+            result = {
+                'success': True,
+                'content': data['text'],
+                'url': page.url,
+                'title': data['title'],
+                'offset': offset,
+                'total_length': data['total'],
+                'next_offset': next_offset if next_offset < data['total'] else None,
+            }
+            self._content_cache.set(key, result)
+            return result
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+            }
+    
+    async def get_elements(
+        self,
+        selectors: List[str],
+        all: bool = False,
+        session_id: str = DEFAULT_SESSION,
+    ) -> dict:
+        """批量读取多个 CSS 选择器对应元素的文本"""
+        page = await self.acquire(session_id)
+        
+        try:
+            texts = await page.evaluate(ELEMENTS_TEXT_JS, {
+                'selectors': selectors,
+                'all': all,
+                'maxLength': MAX_CONTENT_CHARS,
+            })
             return {
                 'success': True,
-                'content': text[:50000],  # 限制返回长度
+                'results': dict(zip(selectors, texts)),
                 'url': page.url,
-                'title': await page.title(),
             }
         except Exception as e:
             return {
@@ -176,9 +449,10 @@ class BrowserManager:
                 'error': str(e),
             }
     
-    async def click(self, selector: str) -> dict:
+    async def click(self, selector: str, session_id: str = DEFAULT_SESSION) -> dict:
         """点击页面元素"""
-        page = await self.get_page()
+        page = await self.acquire(session_id)
+        self._touch(session_id)
         
         try:
             await page.click(selector, timeout=5000)
@@ -188,10 +462,11 @@ class BrowserManager:
             except:
                 pass  # 如果没有导航则忽略
             
+            meta = await page.evaluate(PAGE_META_JS)
             return {
                 'success': True,
-                'url': page.url,
-                'title': await page.title(),
+                'url': meta['url'],
+                'title': meta['title'],
             }
         except Exception as e:
             return {
@@ -199,9 +474,10 @@ class BrowserManager:
                 'error': str(e),
             }
     
-    async def fill(self, selector: str, value: str) -> dict:
+    async def fill(self, selector: str, value: str, session_id: str = DEFAULT_SESSION) -> dict:
         """在输入框中填写内容"""
-        page = await self.get_page()
+        page = await self.acquire(session_id)
+        self._touch(session_id)
         
         try:
             await page.fill(selector, value, timeout=5000)
@@ -216,9 +492,10 @@ class BrowserManager:
                 'error': str(e),
             }
     
-    async def evaluate(self, javascript: str) -> dict:
+    async def evaluate(self, javascript: str, session_id: str = DEFAULT_SESSION) -> dict:
         """执行 JavaScript 代码"""
-        page = await self.get_page()
+        page = await self.acquire(session_id)
+        self._touch(session_id)
         
         try:
             result = await page.evaluate(javascript)
@@ -238,19 +515,35 @@ class BrowserManager:
                 'error': str(e),
             }
     
-    async def wait(self, time_ms: Optional[int] = None, selector: Optional[str] = None) -> dict:
-        """等待指定时间或元素"""
-        page = await self.get_page()
+    async def wait(
+        self,
+        time_ms: Optional[int] = None,
+        selector: Optional[str] = None,
+        session_id: str = DEFAULT_SESSION,
+        state: str = 'visible',
+    ) -> dict:
+        """等待指定时间或元素
+
+        同时给出 time_ms 和 selector 时，time_ms 作为等待元素的上限，
+        元素一出现就立即返回。
+        """
+        page = await self.acquire(session_id)
+        self._touch(session_id)  # 等待期间页面可能继续渲染
         
         try:
-            if time_ms:
-                await asyncio.sleep(time_ms / 1000)
-            elif selector:
-                await page.wait_for_selector(selector, timeout=30000)
+            if selector:
+                timeout = min(time_ms, self.timeout) if time_ms else self.timeout
+                await page.wait_for_selector(selector, state=state, timeout=timeout)
+                waited = f'for selector: {selector} ({state})'
+            elif time_ms:
+                waited = min(time_ms, self.timeout)
+                await asyncio.sleep(waited / 1000)
+            else:
+                waited = 0
             
             return {
                 'success': True,
-                'waited': time_ms or f'for selector: {selector}',
+                'waited': waited,
             }
         except Exception as e:
             return {
@@ -258,43 +551,55 @@ class BrowserManager:
                 'error': str(e),
             }
     
-    async def close(self):
-        """关闭浏览器"""
-        if self.page:
-            try:
-                await self.page.close()
-            except:
-                pass
-            self.page = None
+    async def close(self, session_id: str = DEFAULT_SESSION):
+        """关闭指定 session 的上下文，浏览器进程保持运行"""
+        async with self._lock:
+            self._pages.pop(session_id, None)
+            context = self._contexts.pop(session_id, None)
+            self._generations.pop(session_id, None)
+            self._block_resources.pop(session_id, None)
         
-        if self.context:
+        if context:
+            state_path = self._state_path(session_id)
+            if state_path:
+                try:
+                    state_path.parent.mkdir(parents=True, exist_ok=True)
+                    await context.storage_state(path=str(state_path))
+                except Exception as e:
+                    print(f"Failed to save storage state for {session_id}: {e}", file=sys.stderr)
             try:
-                await self.context.close()
+                await context.close()
             except:
                 pass
-            self.context = None
+    
+    async def shutdown(self):
+        """关闭所有上下文和浏览器"""
+        self._ready = False
+        # 各会话并行关闭（需要先保存 storage_state，共享浏览器也只能关自己的上下文）
+        await asyncio.gather(
+            *(self.close(session_id) for session_id in list(self._contexts)),
+            return_exceptions=True,
+        )
         
-        if self.browser:
-            try:
-                await self.browser.close()
-            except:
-                pass
-            self.browser = None
+        # 共享浏览器属于其他进程，只断开连接，不关闭
+        if self.browser and not self.shared:
+            await asyncio.gather(self.browser.close(), return_exceptions=True)
+        self.browser = None
         
         if self.playwright:
-            try:
-                await self.playwright.stop()
-            except:
-                pass
+            await asyncio.gather(self.playwright.stop(), return_exceptions=True)
             self.playwright = None
     
-    async def get_tabs_info(self) -> dict:
+    async def get_tabs_info(self, session_id: str = DEFAULT_SESSION) -> dict:
         """获取当前标签页信息"""
-        page = await self.get_page()
+        page = await self.acquire(session_id)
+        meta = await page.evaluate(PAGE_META_JS)
         return {
             'success': True,
-            'current_url': page.url,
-            'current_title': await page.title(),
+            'session_id': session_id,
+            'current_url': meta['url'],
+            'current_title': meta['title'],
+            'sessions': list(self._pages),
         }
 
 
@@ -302,22 +607,45 @@ class BrowserManager:
 browser_manager = BrowserManager()
 
 
+async def preload_browser():
+    """预热浏览器，避免第一次工具调用承担冷启动开销"""
+    try:
+        await browser_manager.start(headless=True)
+    except Exception as e:
+        # 预热失败不影响服务启动，第一次工具调用时会重试
+        print(f"Browser preload failed: {e}", file=sys.stderr)
+
+
 # ============================================================
 # MCP Tools
 # ============================================================
 
 @mcp.tool()
-async def browser_navigate(url: str, wait_until: str = 'networkidle') -> dict:
+async def browser_navigate(
+    url: str,
+    wait_until: str = 'domcontentloaded',
+    session_id: str = DEFAULT_SESSION,
+    cache: bool = True,
+    block_resources: Optional[bool] = None,
+) -> dict:
     """
     导航到指定的 URL 并等待页面加载完成
     
+    默认分两段等待：先等 DOMContentLoaded，再最多等 3 秒网络空闲，
+    超时不报错。广告/长连接多的页面不会一直卡到总超时（BROWSER_NAV_TIMEOUT，默认 15 秒）。
+    
     Args:
         url: 要访问的网址，例如 "https://www.zhihu.com"
         wait_until: 等待策略，可选值：
             - "load": 等待 load 事件
-            - "domcontentloaded": 等待 DOMContentLoaded 事件
-            - "networkidle": 等待网络连接空闲（推荐）
-            - "commit": 等待网络响应接收完成
+            - "domcontentloaded": 等待 DOMContentLoaded 事件 + 最多 3 秒网络空闲（默认）
+            - "networkidle": 严格等待网络连接空闲，可能很慢
+            - "commit": 等待网络响应接收完成 + 最多 3 秒网络空闲
+        session_id: 会话 ID，不同会话使用独立的浏览器上下文，默认 "default"
+        cache: 页面仍停留在 BROWSER_CACHE_TTL 秒内导航过的同一 URL 时直接返回
+               上次结果（cached=True），设为 False 强制重新加载
+        block_resources: 是否拦截图片、字体、媒体和样式表以加快纯文本抓取，
+               默认由 BROWSER_BLOCK_RESOURCES 决定（开启）；之后要截图时请传 False
     
     Returns:
         包含导航结果的字典，包括：
@@ -330,60 +658,133 @@ async def browser_navigate(url: str, wait_until: str = 'networkidle') -> dict:
     Example:
         browser_navigate("https://github.com/trending")
     """
-    await browser_manager.start(headless=True)
-    return await browser_manager.navigate(url, wait_until)
+    return await browser_manager.navigate(url, wait_until, session_id, cache, block_resources)
 
 
 @mcp.tool()
-async def browser_screenshot(full_page: bool = True) -> dict:
+async def browser_screenshot(
+    full_page: bool = True,
+    session_id: str = DEFAULT_SESSION,
+    legacy_base64: bool = False,
+    image_type: str = 'png',
+    quality: Optional[int] = None,
+) -> Union[Image, dict]:
     """
     截取当前页面的截图
     
+    截图会关闭该会话的资源拦截；如果页面是在拦截模式下加载的，
+    请先用 browser_navigate(url, block_resources=False) 重新加载。
+    
     Args:
         full_page: 是否截取完整页面（包括滚动区域），默认 True
+        session_id: 会话 ID，不同会话使用独立的浏览器上下文，默认 "default"
+        legacy_base64: 为 True 时返回旧版 JSON 格式（base64 data URL），默认 False
+        image_type: 图片格式，"png"（默认，无损）或 "jpeg"（通常小 5~10 倍）
+        quality: JPEG 质量 0-100，默认 80，仅 image_type="jpeg" 时有效
     
     Returns:
-        包含截图的字典：
+        默认返回 MCP 图片内容（image/png 或 image/jpeg），失败时返回包含 error 的字典。
+        legacy_base64=True 时返回字典：
             - success: 是否成功
-            - image: base64 编码的 PNG 图片
+            - image: base64 编码的图片（data URL）
             - width: 截图宽度
             - height: 截图高度
             - error: 错误信息（如果失败）
     
     Example:
         browser_screenshot(full_page=True)
+        browser_screenshot(image_type="jpeg", quality=60)
     """
-    await browser_manager.start(headless=True)
-    return await browser_manager.screenshot(full_page)
+    result = await browser_manager.screenshot(full_page, session_id, image_type, quality)
+    if not result['success']:
+        return result
+    
+    image_bytes = result.pop('image_bytes')
+    image_format = result.pop('format')
+    if not legacy_base64:
+        return Image(data=image_bytes, format=image_format)
+    
+    # 直接在 bytearray 上拼接前缀和编码结果，只做一次 decode
+    buf = bytearray(f'data:image/{image_format};base64,'.encode('ascii'))
+    buf += base64.b64encode(image_bytes)
+    del image_bytes
+    result['image'] = buf.decode('ascii')
+    return result
 
 
 @mcp.tool()
-async def browser_get_content(selector: Optional[str] = None) -> dict:
+async def browser_get_content(
+    selector: Optional[str] = None,
+    session_id: str = DEFAULT_SESSION,
+    cache: bool = True,
+    offset: int = 0,
+    max_chars: int = MAX_CONTENT_CHARS,
+) -> dict:
     """
     获取当前页面的文本内容
     
+    支持分段读取：先用较小的 max_chars 取开头部分，需要更多内容时
+    用返回的 next_offset 作为 offset 继续读取。
+    
     Args:
         selector: 可选的 CSS 选择器，如果提供则只获取该元素的内容
                  例如："article" 或 ".content" 或 "#main"
+        session_id: 会话 ID，不同会话使用独立的浏览器上下文，默认 "default"
+        cache: 页面未发生点击/填写等操作时复用上次提取的内容，设为 False 强制重新提取
+        offset: 从第几个字符开始读取，默认 0
+        max_chars: 本次最多返回的字符数，默认且最大 50000
     
     Returns:
         包含页面内容的字典：
             - success: 是否成功
-            - content: 页面文本内容（最多 50000 字符）
+            - content: 页面文本内容
             - url: 当前 URL
             - title: 页面标题
+            - offset: 本段起始位置
+            - total_length: 全文长度
+            - next_offset: 下一段的起始位置，已读完时为 None
             - error: 错误信息（如果失败）
     
     Example:
         browser_get_content()  # 获取整个页面内容
         browser_get_content("article h1")  # 获取文章标题
+        browser_get_content(max_chars=2000)  # 只取前 2000 字符
+        browser_get_content(offset=2000, max_chars=2000)  # 继续读取下一段
+    """
+    return await browser_manager.get_content(selector, session_id, cache, offset, max_chars)
+
+
+@mcp.tool()
+async def browser_get_elements(
+    selectors: List[str],
+    all: bool = False,
+    session_id: str = DEFAULT_SESSION,
+) -> dict:
+    """
+    一次性获取多个元素的文本内容（只需一次浏览器往返）
+    
+    Args:
+        selectors: CSS 选择器列表，例如 ["h1", ".author", "time"]
+                   （只支持标准 CSS 选择器，不支持 'text="..."' 等 Playwright 扩展语法）
+        all: 为 True 时返回每个选择器所有匹配元素的文本列表，默认只取第一个
+        session_id: 会话 ID，不同会话使用独立的浏览器上下文，默认 "default"
+    
+    Returns:
+        包含结果的字典：
+            - success: 是否成功
+            - results: {选择器: 文本}，未找到的元素为 null（all=True 时为列表）
+            - url: 当前 URL
+            - error: 错误信息（如果失败）
+    
+    Example:
+        browser_get_elements(["h1", ".author", "time"])
+        browser_get_elements([".comment"], all=True)
     """
-    await browser_manager.start(headless=True)
-    return await browser_manager.get_content(selector)
+    return await browser_manager.get_elements(selectors, all, session_id)
 
 
 @mcp.tool()
-async def browser_click(selector: str) -> dict:
+async def browser_click(selector: str, session_id: str = DEFAULT_SESSION) -> dict:
     """
     点击页面上的元素
     
@@ -393,6 +794,7 @@ async def browser_click(selector: str) -> dict:
             - "a[href='/login']"
             - ".nav-item:nth-child(2)"
             - 'text="登录"'
+        session_id: 会话 ID，不同会话使用独立的浏览器上下文，默认 "default"
     
     Returns:
         包含点击结果的字典：
@@ -405,18 +807,18 @@ async def browser_click(selector: str) -> dict:
         browser_click('button[type="submit"]')
         browser_click('text="下一页"')
     """
-    await browser_manager.start(headless=True)
-    return await browser_manager.click(selector)
+    return await browser_manager.click(selector, session_id)
 
 
 @mcp.tool()
-async def browser_fill(selector: str, value: str) -> dict:
+async def browser_fill(selector: str, value: str, session_id: str = DEFAULT_SESSION) -> dict:
     """
     在输入框中填写内容
     
     Args:
         selector: 输入框的 CSS 选择器
         value: 要填写的值
+        session_id: 会话 ID，不同会话使用独立的浏览器上下文，默认 "default"
     
     Returns:
         包含填写结果的字典：
@@ -429,17 +831,17 @@ async def browser_fill(selector: str, value: str) -> dict:
         browser_fill('input[name="username"]', 'test@example.com')
         browser_fill('#search-box', 'Python MCP')
     """
-    await browser_manager.start(headless=True)
-    return await browser_manager.fill(selector, value)
+    return await browser_manager.fill(selector, value, session_id)
 
 
 @mcp.tool()
-async def browser_evaluate(javascript: str) -> dict:
+async def browser_evaluate(javascript: str, session_id: str = DEFAULT_SESSION) -> dict:
     """
     在页面上下文中执行 JavaScript 代码
     
     Args:
         javascript: 要执行的 JavaScript 代码字符串
+        session_id: 会话 ID，不同会话使用独立的浏览器上下文，默认 "default"
     
     Returns:
         包含执行结果的字典：
@@ -452,18 +854,25 @@ async def browser_evaluate(javascript: str) -> dict:
         browser_evaluate('document.querySelectorAll("a").length')
         browser_evaluate('fetch("/api/data").then(r => r.json())')
     """
-    await browser_manager.start(headless=True)
-    return await browser_manager.evaluate(javascript)
+    return await browser_manager.evaluate(javascript, session_id)
 
 
 @mcp.tool()
-async def browser_wait(time_ms: Optional[int] = None, selector: Optional[str] = None) -> dict:
+async def browser_wait(
+    time_ms: Optional[int] = None,
+    selector: Optional[str] = None,
+    session_id: str = DEFAULT_SESSION,
+    state: str = 'visible',
+) -> dict:
     """
     等待指定时间或等待元素出现
     
     Args:
-        time_ms: 等待的毫秒数，例如 1000 表示等待 1 秒
-        selector: CSS 选择器，等待该元素出现
+        time_ms: 等待的毫秒数，例如 1000 表示等待 1 秒；与 selector 同时给出时
+                 表示等待元素的最长时间，元素出现后立即返回
+        selector: CSS 选择器，等待该元素出现（默认最多等待 BROWSER_NAV_TIMEOUT）
+        session_id: 会话 ID，不同会话使用独立的浏览器上下文，默认 "default"
+        state: 元素状态，可选 "visible"（默认）、"attached"、"hidden"、"detached"
     
     Returns:
         包含等待结果的字典：
@@ -474,58 +883,133 @@ async def browser_wait(time_ms: Optional[int] = None, selector: Optional[str] =
     Example:
         browser_wait(time_ms=2000)  # 等待 2 秒
         browser_wait(selector=".loaded-content")  # 等待元素出现
+        browser_wait(time_ms=3000, selector=".result")  # 最多等 3 秒，出现即返回
     """
-    await browser_manager.start(headless=True)
-    return await browser_manager.wait(time_ms, selector)
+    return await browser_manager.wait(time_ms, selector, session_id, state)
 
 
 @mcp.tool()
-async def browser_get_tabs_info() -> dict:
+async def browser_get_tabs_info(session_id: str = DEFAULT_SESSION) -> dict:
     """
     获取当前浏览器标签页的信息
     
+    Args:
+        session_id: 会话 ID，不同会话使用独立的浏览器上下文，默认 "default"
+    
     Returns:
         包含标签页信息的字典：
             - success: 是否成功
+            - session_id: 会话 ID
             - current_url: 当前 URL
             - current_title: 当前页面标题
+            - sessions: 所有活跃会话 ID 列表
     """
-    await browser_manager.start(headless=True)
-    return await browser_manager.get_tabs_info()
+    return await browser_manager.get_tabs_info(session_id)
 
 
 @mcp.tool()
-async def browser_close() -> dict:
+async def browser_close(session_id: str = DEFAULT_SESSION) -> dict:
     """
-    关闭浏览器并释放资源
+    关闭指定会话的浏览器上下文并释放资源（浏览器进程保持运行）
+    
+    Args:
+        session_id: 会话 ID，默认 "default"
     
     Returns:
         包含关闭结果的字典：
             - success: 是否成功
     """
-    await browser_manager.close()
-    return {'success': True, 'message': '浏览器已关闭'}
+    await browser_manager.close(session_id)
+    return {'success': True, 'message': f'会话 {session_id} 已关闭'}
 
 
 # ============================================================
 # MCP Resources (可选)
 # ============================================================
 
+# 状态资源可能被频繁轮询，短时间内复用同一份结果
+_status_cache = TTLCache(maxsize=1, ttl=2.0)
+
+
 @mcp.resource("browser://status")
 async def browser_status() -> str:
-    """浏览器当前状态信息"""
-    info = await browser_manager.get_tabs_info()
-    return json.dumps(info, indent=2, ensure_ascii=False)
+    """浏览器当前状态信息（缓存 2 秒）"""
+    status = _status_cache.get('status')
+    if status is None:
+        info = await browser_manager.get_tabs_info()
+        status = json.dumps(info, ensure_ascii=False, separators=(',', ':'))
+        _status_cache.set('status', status)
+    return status
 
 
 # ============================================================
 # 主程序入口
 # ============================================================
 
-async def run_server():
-    """运行 MCP 服务器"""
-    # 使用 stdio 传输
-    await mcp.run_stdio_async()
+async def browser_launch_shared(port: int = 9222, headless: bool = True):
+    """启动一个共享 Chromium（sidecar），供其他 MCP 进程通过 CDP 连接"""
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(
+            headless=headless,
+            args=CHROMIUM_ARGS + [
+                f'--remote-debugging-port={port}',
+                '--remote-debugging-address=127.0.0.1',
+            ],
+        )
+        endpoint = f"http://127.0.0.1:{port}"
+        print(f"Shared Chromium ready: BROWSER_CDP_ENDPOINT={endpoint}", file=sys.stderr)
+        print(endpoint, flush=True)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await browser.close()
+
+
+async def run_server(transport: str = "stdio"):
+    """
+    运行 MCP 服务器
+
+    浏览器的预热和关闭放在这里，每个进程只做一次。不用 FastMCP 的 lifespan：
+    HTTP 模式下每个 StreamableHTTP 会话都会进入一次 lifespan，任一客户端断开
+    都会关掉所有客户端共享的浏览器。
+    """
+    await preload_browser()
+    try:
+        if transport == "http":
+            mcp.settings.host = os.getenv("MCP_HOST", "127.0.0.1")
+            mcp.settings.port = int(os.getenv("MCP_PORT", "8000"))
+            await mcp.run_streamable_http_async()
+        else:
+            # 使用 stdio 传输
+            await mcp.run_stdio_async()
+    finally:
+        await browser_manager.shutdown()
+
+
+def run_forever(main):
+    """
+    在自己管理的事件循环中运行 main 协程
+
+    SIGINT/SIGTERM 会取消 main，退出前总是执行 browser_manager.shutdown()，
+    避免留下孤儿 Chromium 进程。
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    task = loop.create_task(main)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, task.cancel)
+        except NotImplementedError:
+            pass  # Windows 不支持，保持默认 KeyboardInterrupt 行为
+    
+    try:
+        loop.run_until_complete(task)
+    except (asyncio.CancelledError, KeyboardInterrupt):
+        pass
+    finally:
+        loop.run_until_complete(browser_manager.shutdown())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
 
 
 if __name__ == "__main__":
@@ -536,5 +1020,9 @@ if __name__ == "__main__":
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
-    print("Starting Browser MCP Server...", file=sys.stderr)
-    asyncio.run(run_server())
+    if "--launch-shared" in sys.argv:
+        run_forever(browser_launch_shared())
+    else:
+        transport = "http" if "--http" in sys.argv else os.getenv("MCP_TRANSPORT", "stdio")
+        print(f"Starting Browser MCP Server ({transport})...", file=sys.stderr)
+        run_forever(run_server(transport))
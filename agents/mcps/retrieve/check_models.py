@@ -3,8 +3,8 @@
 检查模型是否存在，并提供下载指导
 """
 
+import os
 import sys
-from pathlib import Path
 
 # 模型配置
 MODELS = {
@@ -25,17 +25,15 @@ MODELS = {
 
 def check_model(name: str, info: dict) -> bool:
     """检查模型是否存在且完整"""
-    path = Path(info["path"])
-    
-    if not path.exists():
+    # 一次 scandir 列出目录，再做集合查找，避免逐个文件 stat
+    try:
+        with os.scandir(info["path"]) as it:
+            names = {entry.name for entry in it}
+    except (FileNotFoundError, NotADirectoryError):
         return False
     
     # 检查必要文件
-    for file in info["required_files"]:
-        if not (path / file).exists():
-            return False
-    
-    return True
+    return all(file in names for file in info["required_files"])
 
 
 def print_download_command(name: str, info: dict):
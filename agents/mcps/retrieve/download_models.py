@@ -11,16 +11,17 @@ import sys
 from pathlib import Path
 
 
+MODEL_WEIGHT_FILES = {"model.safetensors", "pytorch_model.bin", "model.bin"}
+
+
 def check_model_exists(model_path: str) -> bool:
     """检查模型是否已存在"""
-    path = Path(model_path)
-    if not path.exists():
-        return False
-    config_file = path / "config.json"
-    if not config_file.exists():
+    try:
+        with os.scandir(model_path) as it:
+            names = {entry.name for entry in it}
+    except (FileNotFoundError, NotADirectoryError):
         return False
-    model_files = ["model.safetensors", "pytorch_model.bin", "model.bin"]
-    return any((path / f).exists() for f in model_files)
+    return "config.json" in names and bool(names & MODEL_WEIGHT_FILES)
 
 
 def download_from_hf(model_id: str, save_dir: str) -> bool:
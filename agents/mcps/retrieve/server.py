@@ -8,7 +8,7 @@ Retrieve MCP Server - 基于混合检索的知识库检索系统
 1. BM25 关键词检索 - 基于 jieba 分词
 2. 向量语义检索 - 基于 BGE 嵌入模型
 3. Rerank 重排序 - 基于 BGE Reranker 模型
-4. 混合得分融合 - 0.4 * BM25 + 0.6 * 向量得分
+4. 混合得分融合 - 加权倒数排名融合（RRF），0.4 * BM25 + 0.6 * 向量
 
 MCP 工具：
 - retrieve_knowledge: 混合检索相关知识
@@ -23,10 +23,16 @@ import os
 import json
 import logging
 import hashlib
-from typing import Optional, List, Dict, Any, Tuple
+import heapq
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple, Iterator, Hashable
 from pathlib import Path
 from dataclasses import dataclass, field
 
+import numpy as np
+from scipy.sparse import csr_matrix
 from mcp.server.fastmcp import FastMCP
 import chromadb
 from chromadb.config import Settings
@@ -71,6 +77,9 @@ class RetrieveConfig:
     # 模型配置
     embedding_model: str = "./data/models/bge-small-zh-v1.5"
     reranker_model: str = "./data/models/bge-reranker-base"
+    embedding_device: str = ""  # 为空时自动选择：有 CUDA 用 cuda，否则 cpu
+    embedding_batch_size: int = 256
+    reranker_device: str = ""   # 为空时自动选择，cuda 上以 FP16 推理
     
     # 检索配置
     default_collection: str = "hair_knowledge"
@@ -78,11 +87,20 @@ class RetrieveConfig:
     final_top_k: int = 5     # rerank 后返回数量
     bm25_weight: float = 0.4
     vector_weight: float = 0.6
+    rrf_k: int = 60          # RRF 平滑常数
     rerank_top_k: int = 10   # rerank 候选数量
     
+    # BM25 停用词表（每行一个词，如哈工大停用词表），文件不存在时只过滤空白
+    stopwords_path: str = "./data/stopwords/cn_stopwords.txt"
+    # jieba 并行分词进程数，<= 1 关闭（仅 POSIX 系统支持）
+    bm25_parallel: int = 0
+    
     # 内容限制
     max_content_length: int = 512
     
+    # 单次 upsert 的条目上限
+    chroma_batch_size: int = 200
+    
     # 缓存配置
     use_cache: bool = True
     cache_size: int = 1000
@@ -94,166 +112,454 @@ class RetrieveConfig:
             chroma_persist_dir=os.getenv("CHROMA_PERSIST_DIR", "./chroma_db"),
             embedding_model=os.getenv("EMBEDDING_MODEL", "./data/models/bge-small-zh-v1.5"),
             reranker_model=os.getenv("RERANKER_MODEL", "./data/models/bge-reranker-base"),
+            embedding_device=os.getenv("EMBEDDING_DEVICE", ""),
+            embedding_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "256")),
+            reranker_device=os.getenv("RERANKER_DEVICE", ""),
             default_collection=os.getenv("DEFAULT_COLLECTION", "hair_knowledge"),
             default_top_k=int(os.getenv("DEFAULT_TOP_K", "10")),
             final_top_k=int(os.getenv("FINAL_TOP_K", "5")),
             bm25_weight=float(os.getenv("BM25_WEIGHT", "0.4")),
             vector_weight=float(os.getenv("VECTOR_WEIGHT", "0.6")),
+            rrf_k=int(os.getenv("RRF_K", "60")),
             rerank_top_k=int(os.getenv("RERANK_TOP_K", "10")),
+            stopwords_path=os.getenv("BM25_STOPWORDS", "./data/stopwords/cn_stopwords.txt"),
+            bm25_parallel=int(os.getenv(
+                "BM25_PARALLEL",
+                str(min(8, os.cpu_count() or 1) if (os.cpu_count() or 1) > 2 else 0)
+            )),
             max_content_length=int(os.getenv("MAX_CONTENT_LENGTH", "512")),
+            chroma_batch_size=int(os.getenv("CHROMA_BATCH_SIZE", "200")),
         )
 
 
 config = RetrieveConfig.from_env()
 
+
+def resolve_device(device: Optional[str]) -> str:
+    """未指定设备时自动选择：有 CUDA 用 cuda，否则 cpu"""
+    if device:
+        return device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
 # ==================== 缓存类 ====================
 
 
 class LRUCache:
-    """LRU 缓存，用于缓存查询结果"""
+    """LRU 缓存，用于缓存查询结果（基于 OrderedDict，命中和淘汰均为 O(1)）"""
     
     def __init__(self, capacity: int = 1000):
         self.capacity = capacity
-        self.cache: Dict[str, Any] = {}
-        self.order: List[str] = []
+        self.cache: "OrderedDict[Hashable, Any]" = OrderedDict()
     
-    def get(self, key: str) -> Optional[Any]:
+    def get(self, key: Hashable) -> Optional[Any]:
         if key in self.cache:
-            self.order.remove(key)
-            self.order.append(key)
+            self.cache.move_to_end(key)
             return self.cache[key]
         return None
     
-    def put(self, key: str, value: Any):
+    def put(self, key: Hashable, value: Any):
         if key in self.cache:
-            self.order.remove(key)
+            self.cache.move_to_end(key)
         elif len(self.cache) >= self.capacity:
-            oldest = self.order.pop(0)
-            del self.cache[oldest]
+            self.cache.popitem(last=False)
         self.cache[key] = value
-        self.order.append(key)
 
 
 # ==================== BM25 检索器 ====================
 
+try:
+    import numba
+except ImportError:  # numba 可选，缺失时使用 NumPy 实现
+    numba = None
+
+USE_NUMBA = numba is not None and os.getenv("BM25_USE_NUMBA", "true").lower() == "true"
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _bm25_tf_kernel(data, indices, weights, doc_len, avg_dl, k1, b):
+        """
+        计算查询词倒排表（子矩阵非零元素）上每个位置的加权 BM25 TF 分数
+
+        按倒排位置并行，各位置互不依赖；只遍历命中的非零元素，与文档总数无关。
+        按文档聚合仍由调用方完成（与 NumPy 实现共用）。
+        """
+        out = np.empty(data.shape[0], dtype=np.float64)
+        for p in numba.prange(data.shape[0]):
+            tf = data[p]
+            out[p] = weights[p] * tf * (k1 + 1) / (
+                tf + k1 * (1 - b + b * doc_len[indices[p]] / avg_dl)
+            )
+        return out
+
 
 class BM25Retriever:
-    """BM25 关键词检索器，基于 jieba 分词"""
+    """BM25 关键词检索器，基于 jieba 分词
+
+    索引以稀疏矩阵（词 × 文档，值为词频）保存，查询时一次性取出查询词
+    对应的行做向量化计算，不再逐文档循环。
+
+    save/load 把 CSR 数组落盘，启动时以 mmap 方式加载，冷页交给操作系统
+    页缓存管理；首次增删文档时才从矩阵还原逐文档词频。
+    """
     
-    def __init__(self):
-        import jieba
-        import jieba.analyse
+    # 落盘文件：CSR 三个数组 + 列对应的文档 ID/长度 + 词表
+    INDEX_FILES = ("indptr.npy", "indices.npy", "data.npy", "doc_ids.npy", "doc_len.npy", "vocab.json")
+    
+    def __init__(self, stopwords_path: str = None, parallel: int = None):
+        try:
+            import jieba_fast as jieba  # C 加速版，接口与 jieba 一致
+        except ImportError:
+            import jieba
         self.jieba = jieba
-        self.documents: Dict[str, List[str]] = {}  # id -> tokens
+        self.stopwords = self.load_stopwords(stopwords_path or config.stopwords_path)
+        
+        # 并行模式下批量入库的分词按行分发到子进程；先加载词典，fork 出的子进程直接复用
+        jobs = config.bm25_parallel if parallel is None else parallel
+        if jobs > 1 and getattr(jieba, "pool", None) is None:
+            try:
+                jieba.initialize()
+                jieba.enable_parallel(jobs)
+                logger.info(f"jieba 并行分词已开启：{jobs} 个进程")
+            except NotImplementedError as e:
+                logger.warning(f"jieba 并行分词不可用：{e}")
+        self.vocab: Dict[str, int] = {}  # term -> 矩阵行号
+        self.terms: List[str] = []  # 矩阵行号 -> term
+        self.documents: Dict[str, Dict[int, int]] = {}  # id -> {term 行号: 词频}
         self.doc_freq: Dict[str, int] = {}  # term -> doc count
         self.doc_lengths: Dict[str, int] = {}  # id -> doc length
         self.avg_doc_length: float = 0
         self.total_docs: int = 0
+        self.total_length: int = 0  # 所有文档长度之和，增删时增量维护
         
         # BM25 参数
         self.k1 = 1.5
         self.b = 0.75
         
+        # 稀疏矩阵在文档变更后失效，下次查询时重建
+        self._matrix: Optional[csr_matrix] = None
+        self._col_ids: List[str] = []
+        self._doc_len: Optional[np.ndarray] = None
+        self._idf: Optional[np.ndarray] = None  # 与矩阵行对齐的 IDF，随矩阵一起重建
+        # load 之后 documents 为空，首次增删文档时再从矩阵还原
+        self._documents_loaded = True
+        
         logger.info("BM25Retriever 初始化完成")
     
+    @staticmethod
+    def load_stopwords(path: str) -> frozenset:
+        """加载停用词表，文件不存在时返回空集合"""
+        if not path or not os.path.exists(path):
+            return frozenset()
+        with open(path, encoding="utf-8") as f:
+            stopwords = frozenset(line.strip() for line in f if line.strip())
+        logger.info(f"加载停用词 {len(stopwords)} 个：{path}")
+        return stopwords
+    
+    def iter_tokens(self, text: str) -> Iterator[str]:
+        """中文分词，按需产出 token，不生成中间列表；过滤空白和停用词
+
+        单条文本总是用串行分词（dt.cut），短查询不值得一次进程间通信。
+        """
+        stopwords = self.stopwords
+        for token in self.jieba.dt.cut(text.lower()):
+            if token.strip() and token not in stopwords:
+                yield token
+    
     def tokenize(self, text: str) -> List[str]:
         """中文分词"""
-        return list(self.jieba.cut(text.lower()))
+        return list(self.iter_tokens(text))
     
     def add_document(self, doc_id: str, text: str):
         """添加文档到索引"""
-        tokens = self.tokenize(text)
-        self.documents[doc_id] = tokens
-        self.doc_lengths[doc_id] = len(tokens)
+        self._add_counts(doc_id, Counter(self.iter_tokens(text)))
+    
+    def add_documents(self, docs: List[Tuple[str, str]]):
+        """
+        批量添加文档
+
+        开启 jieba 并行模式时，所有文档以换行拼接后只调用一次 jieba.cut，
+        由 jieba 按行分发给子进程；文档内部的换行先替换为空格，
+        分词结果中的 "\n" 即为文档边界。
+        """
+        if getattr(self.jieba, "pool", None) is None or len(docs) < 2:
+            for doc_id, text in docs:
+                self.add_document(doc_id, text)
+            return
         
-        # 更新文档频率
-        unique_tokens = set(tokens)
-        for token in unique_tokens:
+        joined = "\n".join(
+            text.lower().replace("\r", " ").replace("\n", " ") for _, text in docs
+        )
+        stopwords = self.stopwords
+        i = 0
+        counter: Counter = Counter()
+        for token in self.jieba.cut(joined):
+            if token == "\n":
+                self._add_counts(docs[i][0], counter)
+                counter = Counter()
+                i += 1
+            elif token.strip() and token not in stopwords:
+                counter[token] += 1
+        self._add_counts(docs[i][0], counter)
+    
+    def _add_counts(self, doc_id: str, counter: Counter):
+        """按词频写入一篇文档"""
+        self._ensure_documents()
+        if doc_id in self.documents:
+            self.remove_document(doc_id)
+        
+        # 一次遍历同时得到词频、文档长度并更新文档频率，重复 token 直接合并
+        counts: Dict[int, int] = {}
+        length = 0
+        for token, tf in counter.items():
+            row = self.vocab.get(token)
+            if row is None:
+                row = self.vocab[token] = len(self.terms)
+                self.terms.append(token)
+            counts[row] = tf
+            length += tf
             self.doc_freq[token] = self.doc_freq.get(token, 0) + 1
+        self.documents[doc_id] = counts
+        self.doc_lengths[doc_id] = length
         
         # 更新平均长度
-        self.total_docs = len(self.documents)
-        total_length = sum(self.doc_lengths.values())
-        self.avg_doc_length = total_length / self.total_docs if self.total_docs > 0 else 0
+        self.total_docs += 1
+        self.total_length += length
+        self.avg_doc_length = self.total_length / self.total_docs
+        self._matrix = None
     
     def remove_document(self, doc_id: str):
         """从索引中移除文档"""
+        self._ensure_documents()
         if doc_id not in self.documents:
             return
         
-        tokens = self.documents[doc_id]
-        unique_tokens = set(tokens)
-        
         # 更新文档频率
-        for token in unique_tokens:
+        for row in self.documents[doc_id]:
+            token = self.terms[row]
             if token in self.doc_freq:
                 self.doc_freq[token] -= 1
                 if self.doc_freq[token] <= 0:
                     del self.doc_freq[token]
         
         del self.documents[doc_id]
-        del self.doc_lengths[doc_id]
+        self.total_length -= self.doc_lengths.pop(doc_id)
         
-        # 重新计算平均长度
-        self.total_docs = len(self.documents)
-        if self.total_docs > 0:
-            total_length = sum(self.doc_lengths.values())
-            self.avg_doc_length = total_length / self.total_docs
+        # 更新平均长度
+        self.total_docs -= 1
+        self.avg_doc_length = self.total_length / self.total_docs if self.total_docs > 0 else 0
+        self._matrix = None
     
-    def bm25_score(self, query_tokens: List[str], doc_id: str) -> float:
-        """计算单个文档的 BM25 分数"""
-        if doc_id not in self.documents:
-            return 0.0
+    def _build_matrix(self):
+        """由各文档词频重建 CSR 矩阵（词 × 文档）"""
+        self._col_ids = list(self.documents)
+        rows: List[int] = []
+        cols: List[int] = []
+        data: List[int] = []
+        for col, doc_id in enumerate(self._col_ids):
+            counts = self.documents[doc_id]
+            rows.extend(counts.keys())
+            cols.extend([col] * len(counts))
+            data.extend(counts.values())
+        
+        self._matrix = csr_matrix(
+            (
+                np.asarray(data, dtype=np.float32),
+                (np.asarray(rows, dtype=np.int32), np.asarray(cols, dtype=np.int32)),
+            ),
+            shape=(len(self.terms), len(self._col_ids)),
+        )
+        self._doc_len = np.asarray(
+            [self.doc_lengths[doc_id] for doc_id in self._col_ids], dtype=np.float32
+        )
+        self._compute_idf()
+    
+    def _compute_idf(self):
+        """按矩阵每行的非零元素个数（即文档频率）一次性算出全部 IDF"""
+        df = np.diff(self._matrix.indptr).astype(np.float32)
+        self._idf = np.log((self.total_docs - df + 0.5) / (df + 0.5) + 1).astype(np.float32)
+    
+    def warm_kernel(self):
+        """加载（或首次编译）BM25 Numba 内核
+
+        用空倒排表调用一次：参数类型与查询时一致（已加载索引时直接用其 doc_len，
+        可能是 mmap 只读数组），命中 cache=True 的磁盘缓存，首个查询不再等待 JIT。
+        """
+        if not USE_NUMBA:
+            return
+        doc_len = self._doc_len if self._doc_len is not None else np.ones(1, dtype=np.float32)
+        _bm25_tf_kernel(
+            np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32),
+            doc_len, np.float32(1.0), np.float32(self.k1), np.float32(self.b),
+        )
+    
+    def _score_hits(self, query_tokens: List[str]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        只对至少包含一个查询词的文档计算 BM25 分数
+
+        查询词对应的矩阵行就是它们的倒排表，命中文档由这些行的列号并集得到，
+        不再分配、扫描长度为 N 的分数数组。
+
+        Returns:
+            (命中文档列号, 分数)，没有可匹配的查询词时返回 None
+        """
+        if self.avg_doc_length <= 0:
+            return None
         
-        doc_tokens = self.documents[doc_id]
-        doc_len = self.doc_lengths[doc_id]
+        matched = [self.vocab[token] for token in query_tokens if self.doc_freq.get(token)]
+        if not matched:
+            return None
         
-        score = 0.0
-        doc_token_count = {}
-        for token in doc_tokens:
-            doc_token_count[token] = doc_token_count.get(token, 0) + 1
+        if self._matrix is None:
+            self._build_matrix()
         
-        for query_token in query_tokens:
-            if query_token not in self.doc_freq:
-                continue
-            
-            # IDF
-            idf = max(0, (
-                (self.total_docs - self.doc_freq[query_token] + 0.5) / 
-                (self.doc_freq[query_token] + 0.5) + 1
-            ))
-            
-            # TF
-            tf = doc_token_count.get(query_token, 0)
-            tf_score = (tf * (self.k1 + 1)) / (
+        # 重复的查询词按出现次数累加权重
+        rows, repeats = np.unique(np.asarray(matched, dtype=np.int32), return_counts=True)
+        row_weights = (self._idf[rows] * repeats).astype(np.float32)
+        
+        sub = self._matrix[rows]
+        weights = np.repeat(row_weights, np.diff(sub.indptr))
+        
+        # TF 部分只在非零元素上计算
+        if USE_NUMBA:
+            tf_score = _bm25_tf_kernel(
+                sub.data, sub.indices, weights, self._doc_len,
+                np.float32(self.avg_doc_length), np.float32(self.k1), np.float32(self.b),
+            )
+        else:
+            tf = sub.data
+            doc_len = self._doc_len[sub.indices]
+            tf_score = tf * (self.k1 + 1) / (
                 tf + self.k1 * (1 - self.b + self.b * doc_len / self.avg_doc_length)
-            ) if self.avg_doc_length > 0 else 0
-            
-            score += idf * tf_score
+            )
+            tf_score *= weights
         
-        return score
+        # 按命中文档聚合，数组长度只与倒排表总长有关
+        cols, inverse = np.unique(sub.indices, return_inverse=True)
+        return cols, np.bincount(inverse, weights=tf_score, minlength=len(cols))
+    
+    def bm25_score(self, query_tokens: List[str], doc_id: str) -> float:
+        """计算单个文档的 BM25 分数"""
+        if doc_id not in self.doc_lengths:
+            return 0.0
+        hits = self._score_hits(query_tokens)
+        if hits is None:
+            return 0.0
+        cols, scores = hits
+        pos = np.flatnonzero(cols == self._col_ids.index(doc_id))
+        return float(scores[pos[0]]) if len(pos) else 0.0
     
     def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
         """搜索相关文档"""
-        query_tokens = self.tokenize(query)
+        hits = self._score_hits(self.tokenize(query))
+        if hits is None:
+            return []
         
-        scores = []
-        for doc_id in self.documents:
-            score = self.bm25_score(query_tokens, doc_id)
-            if score > 0:
-                scores.append((doc_id, score))
+        cols, scores = hits
+        order = np.flatnonzero(scores > 0)
+        if len(order) > top_k:
+            order = order[np.argpartition(scores[order], -top_k)[-top_k:]]
         
         # 按分数排序
-        scores.sort(key=lambda x: x[1], reverse=True)
-        return scores[:top_k]
+        order = order[np.argsort(-scores[order], kind="stable")]
+        return [(self._col_ids[cols[i]], float(scores[i])) for i in order]
     
     def clear(self):
         """清空索引"""
+        self.vocab.clear()
+        self.terms.clear()
         self.documents.clear()
         self.doc_freq.clear()
         self.doc_lengths.clear()
         self.avg_doc_length = 0
         self.total_docs = 0
+        self.total_length = 0
+        self._matrix = None
+        self._col_ids = []
+        self._doc_len = None
+        self._idf = None
+        self._documents_loaded = True
+    
+    def _ensure_documents(self):
+        """从 mmap 加载的矩阵还原逐文档词频，供增删文档使用"""
+        if self._documents_loaded:
+            return
+        csc = self._matrix.tocsc()
+        self.documents = {
+            doc_id: dict(zip(
+                csc.indices[csc.indptr[col]:csc.indptr[col + 1]].tolist(),
+                csc.data[csc.indptr[col]:csc.indptr[col + 1]].astype(np.int64).tolist(),
+            ))
+            for col, doc_id in enumerate(self._col_ids)
+        }
+        self._documents_loaded = True
+    
+    def save(self, path: str):
+        """把索引写入目录，每个文件先写临时文件再替换，不影响正在 mmap 的旧文件"""
+        if self._matrix is None:
+            self._build_matrix()
+        os.makedirs(path, exist_ok=True)
+        
+        arrays = {
+            "indptr.npy": self._matrix.indptr.astype(np.int32, copy=False),
+            "indices.npy": self._matrix.indices.astype(np.int32, copy=False),
+            "data.npy": self._matrix.data.astype(np.float32, copy=False),
+            "doc_ids.npy": np.asarray(self._col_ids, dtype=str),
+            "doc_len.npy": self._doc_len,
+        }
+        for name, array in arrays.items():
+            tmp = os.path.join(path, name + ".tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp, os.path.join(path, name))
+        
+        tmp = os.path.join(path, "vocab.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"terms": self.terms, "k1": self.k1, "b": self.b}, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(path, "vocab.json"))
+        
+        logger.info(f"BM25 索引已保存：{path}（{self.total_docs} 个文档）")
+    
+    def load(self, path: str) -> bool:
+        """以 mmap 方式加载 save 写出的索引，文件不存在时返回 False"""
+        if not all(os.path.exists(os.path.join(path, name)) for name in self.INDEX_FILES):
+            return False
+        
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            vocab = json.load(f)
+        
+        def mmap(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, name), mmap_mode="r")
+        
+        doc_ids = mmap("doc_ids.npy").tolist()
+        doc_len = mmap("doc_len.npy")
+        indptr = mmap("indptr.npy")
+        terms = vocab["terms"]
+        
+        self.clear()
+        self.k1 = vocab.get("k1", self.k1)
+        self.b = vocab.get("b", self.b)
+        self.terms = terms
+        self.vocab = {term: row for row, term in enumerate(terms)}
+        self._col_ids = doc_ids
+        self._doc_len = doc_len
+        self._matrix = csr_matrix(
+            (mmap("data.npy"), mmap("indices.npy"), indptr),
+            shape=(len(terms), len(doc_ids)),
+        )
+        
+        # 每行非零元素个数即该词的文档频率
+        df = np.diff(indptr)
+        self.doc_freq = {terms[row]: int(df[row]) for row in np.flatnonzero(df)}
+        self.doc_lengths = dict(zip(doc_ids, doc_len.astype(np.int64).tolist()))
+        self.total_docs = len(doc_ids)
+        self.total_length = sum(self.doc_lengths.values())
+        self.avg_doc_length = self.total_length / self.total_docs if self.total_docs > 0 else 0
+        self._compute_idf()
+        self._documents_loaded = False
+        
+        logger.info(f"BM25 索引已加载：{path}（{self.total_docs} 个文档）")
+        return True
 
 
 # ==================== 向量检索器 ====================
@@ -262,9 +568,13 @@ class BM25Retriever:
 class VectorRetriever:
     """向量检索器，基于 BGE 嵌入模型"""
     
-    def __init__(self, model_path: str = None):
+    def __init__(self, model_path: str = None, device: str = None, batch_size: int = None):
         self.model_path = model_path or config.embedding_model
+        # 设备在加载模型时才确定，避免启动时导入 torch
+        self.device = device or config.embedding_device or None
+        self.batch_size = batch_size or config.embedding_batch_size
         self._model = None
+        self._load_lock = threading.Lock()
         
         # 检查模型路径
         if not check_model_path(self.model_path, "BGE 嵌入模型"):
@@ -276,35 +586,57 @@ class VectorRetriever:
     def model(self):
         """懒加载模型"""
         if self._model is None:
-            try:
-                from sentence_transformers import SentenceTransformer
-                self._model = SentenceTransformer(self.model_path)
-                logger.info(f"向量模型加载成功：{self.model_path}")
-            except Exception as e:
-                logger.error(f"加载向量模型失败：{e}")
-                raise
+            with self._load_lock:
+                if self._model is None:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                        self.device = resolve_device(self.device)
+                        self._model = SentenceTransformer(self.model_path, device=self.device)
+                        logger.info(f"向量模型加载成功：{self.model_path}（{self.device}）")
+                    except Exception as e:
+                        logger.error(f"加载向量模型失败：{e}")
+                        raise
         return self._model
     
-    def encode(self, texts: List[str], normalize: bool = True) -> List[List[float]]:
-        """编码文本为向量"""
+    def encode(self, texts: List[str], normalize: bool = True) -> np.ndarray:
+        """编码文本为向量，返回 float32 矩阵（N × D），直接交给 ChromaDB，不再转成 list"""
         embeddings = self.model.encode(
             texts,
+            batch_size=self.batch_size,
             convert_to_numpy=True,
-            normalize_embeddings=normalize
+            normalize_embeddings=normalize,
+            show_progress_bar=False
         )
-        return embeddings.tolist()
+        return embeddings.astype(np.float32, copy=False)
     
-    def similarity(self, query_vector: List[float], doc_vectors: List[List[float]]) -> List[float]:
-        """计算余弦相似度"""
-        import numpy as np
-        query_vec = np.array(query_vector)
-        doc_vecs = np.array(doc_vectors)
+    @staticmethod
+    def inverse_norms(doc_vecs: np.ndarray) -> np.ndarray:
+        """文档向量模长的倒数，未归一化的向量应在建索引时算好一次"""
+        return 1.0 / np.linalg.norm(doc_vecs, axis=1)
+    
+    def similarity(
+        self,
+        query_vec: np.ndarray,
+        doc_vecs: np.ndarray,
+        cosine: bool = False,
+        inv_norms: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        计算余弦相似度
         
-        # 余弦相似度
-        similarities = np.dot(doc_vecs, query_vec) / (
-            np.linalg.norm(doc_vecs, axis=1) * np.linalg.norm(query_vec)
-        )
-        return similarities.tolist()
+        encode 默认输出单位向量，此时余弦相似度就是一次矩阵-向量乘（BLAS GEMV）。
+        传入未归一化的向量时设置 cosine=True，并尽量带上预先算好的 inv_norms。
+        """
+        scores = doc_vecs @ query_vec
+        if not cosine:
+            assert abs(float(query_vec @ query_vec) - 1.0) < 1e-3, "查询向量未归一化，请使用 cosine=True"
+            return scores
+        
+        if inv_norms is None:
+            inv_norms = self.inverse_norms(doc_vecs)
+        scores *= inv_norms
+        scores /= np.linalg.norm(query_vec)
+        return scores
 
 
 # ==================== Reranker ====================
@@ -313,9 +645,11 @@ class VectorRetriever:
 class Reranker:
     """Rerank 重排序器，基于 BGE Reranker 模型"""
     
-    def __init__(self, model_path: str = None):
+    def __init__(self, model_path: str = None, device: str = None):
         self.model_path = model_path or config.reranker_model
+        self.device = device or config.reranker_device or None
         self._model = None
+        self._load_lock = threading.Lock()
         
         # 检查模型路径
         if not check_model_path(self.model_path, "BGE Reranker 模型"):
@@ -327,13 +661,19 @@ class Reranker:
     def model(self):
         """懒加载模型"""
         if self._model is None:
-            try:
-                from sentence_transformers import CrossEncoder
-                self._model = CrossEncoder(self.model_path)
-                logger.info(f"Reranker 模型加载成功：{self.model_path}")
-            except Exception as e:
-                logger.error(f"加载 Reranker 模型失败：{e}")
-                raise
+            with self._load_lock:
+                if self._model is None:
+                    try:
+                        from sentence_transformers import CrossEncoder
+                        self.device = resolve_device(self.device)
+                        model = CrossEncoder(self.model_path, device=self.device)
+                        if self.device.startswith("cuda"):
+                            model.model.half()
+                        self._model = model
+                        logger.info(f"Reranker 模型加载成功：{self.model_path}（{self.device}）")
+                    except Exception as e:
+                        logger.error(f"加载 Reranker 模型失败：{e}")
+                        raise
         return self._model
     
     def rerank(
@@ -359,8 +699,13 @@ class Reranker:
         # 创建句子对
         pairs = [[query, doc] for doc in documents]
         
-        # 计算分数
-        scores = self.model.predict(pairs)
+        # 计算分数，候选只有十几个，一次前向全部算完
+        scores = self.model.predict(
+            pairs,
+            batch_size=len(pairs),
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
         
         # 创建索引 - 分数对
         indexed_scores = list(enumerate(scores.tolist()))
@@ -384,12 +729,21 @@ class KnowledgeBase:
         
         # 初始化检索器
         self.bm25 = BM25Retriever()
+        self.bm25_path = os.path.join(self.persist_dir, "bm25")
+        try:
+            self.bm25.load(self.bm25_path)
+        except Exception as e:
+            logger.warning(f"加载 BM25 索引失败，将从空索引开始：{e}")
+            self.bm25.clear()
         self.vector = VectorRetriever()
         self.reranker = Reranker()
         
         # 缓存
         self.cache = LRUCache(config.cache_size) if config.use_cache else None
         
+        # 检索时与 BM25 并发执行向量查询
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="search")
+        
         logger.info(f"KnowledgeBase 初始化，持久化目录：{self.persist_dir}")
     
     @property
@@ -417,8 +771,8 @@ class KnowledgeBase:
         return self._collections[name]
     
     def _generate_id(self, text: str) -> str:
-        """生成文档 ID"""
-        return hashlib.md5(text.encode()).hexdigest()
+        """生成文档 ID（BLAKE2b-128，32 位十六进制，与原 MD5 ID 长度一致）"""
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
     
     def add_entries(
         self,
@@ -456,22 +810,38 @@ class KnowledgeBase:
             # 生成向量
             embeddings = self.vector.encode(documents)
             
-            # 添加到 ChromaDB
-            collection.upsert(
-                ids=ids,
-                embeddings=embeddings,
-                documents=documents,
-                metadatas=metadatas
-            )
-            
-            # 添加到 BM25 索引
-            for doc_id, doc in zip(ids, documents):
-                self.bm25.add_document(doc_id, doc)
+            # 分批写入 ChromaDB 和 BM25 索引，单次 upsert 不超过 chroma_batch_size 条
+            batch_size = config.chroma_batch_size
+            for start in range(0, len(ids), batch_size):
+                end = start + batch_size
+                collection.upsert(
+                    ids=ids[start:end],
+                    embeddings=embeddings[start:end],
+                    documents=documents[start:end],
+                    metadatas=metadatas[start:end]
+                )
+                self.bm25.add_documents(list(zip(ids[start:end], documents[start:end])))
+            self._save_bm25()
             
             logger.info(f"添加 {len(documents)} 个条目到集合 {collection_name}")
         
         return {"added_count": len(ids), "ids": ids}
     
+    def _save_bm25(self):
+        """持久化 BM25 索引，失败只记录日志，不影响已写入 ChromaDB 的数据"""
+        try:
+            self.bm25.save(self.bm25_path)
+        except Exception as e:
+            logger.error(f"保存 BM25 索引失败：{e}")
+    
+    def _vector_query(self, collection, query: str) -> Dict[str, Any]:
+        """向量检索"""
+        return collection.query(
+            query_embeddings=self.vector.encode([query]),
+            n_results=config.rerank_top_k * 2,
+            include=["documents", "metadatas", "distances"]
+        )
+    
     def _truncate(self, text: str, max_length: int = None) -> str:
         """截断文本"""
         max_length = max_length or config.max_content_length
@@ -504,122 +874,81 @@ class KnowledgeBase:
         collection = self.get_or_create_collection(collection_name)
         
         # 检查缓存
-        cache_key = f"{query}:{top_k}:{collection_name}:{filter_category}"
+        # 查询文本压缩成 64 位摘要，键为小元组；use_rerank 也参与区分
+        query_digest = int.from_bytes(hashlib.blake2b(query.encode(), digest_size=8).digest(), "little")
+        cache_key = (query_digest, top_k, use_rerank, collection_name, filter_category)
         if self.cache and (cached := self.cache.get(cache_key)):
             logger.info(f"使用缓存结果：{query[:50]}...")
             return cached
         
-        # 1. BM25 检索
+        # 1-2. BM25 检索与向量检索（编码 + ChromaDB 查询）并发执行，耗时取两者较大值
+        vector_future = self._executor.submit(self._vector_query, collection, query)
         bm25_results = self.bm25.search(query, top_k=config.rerank_top_k * 2)
-        bm25_scores = {doc_id: score for doc_id, score in bm25_results}
+        vector_results = vector_future.result()
         
-        # 2. 向量检索
-        query_embedding = self.vector.encode([query])[0]
-        vector_results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=config.rerank_top_k * 2,
-            include=["documents", "metadatas", "distances"]
-        )
+        # 3. 倒数排名融合 (RRF)：只看名次，不依赖两路分数的量纲
+        #    score(d) = Σ w_i / (k + rank_i(d))，rank 从 1 开始
+        fused: Dict[str, float] = {}
+        vector_ids = vector_results["ids"][0] if vector_results["ids"] else []
+        # 向量结果 id -> 下标，后续取文档内容不再做 list.index 线性查找
+        vid_to_idx = {doc_id: i for i, doc_id in enumerate(vector_ids)}
+        for weight, ranked_ids in (
+            (config.bm25_weight, [doc_id for doc_id, _ in bm25_results]),
+            (config.vector_weight, vector_ids),
+        ):
+            for rank, doc_id in enumerate(ranked_ids, 1):
+                fused[doc_id] = fused.get(doc_id, 0.0) + weight / (config.rrf_k + rank)
         
-        # 3. 合并结果 (取并集)
-        all_doc_ids = set(bm25_scores.keys())
-        if vector_results["ids"] and vector_results["ids"][0]:
-            for i, doc_id in enumerate(vector_results["ids"][0]):
-                all_doc_ids.add(doc_id)
+        # 4-5. 按混合分数取前 K 个（堆选择，不做全量排序）
+        candidate_ids = heapq.nlargest(config.rerank_top_k, fused, key=fused.__getitem__)
         
-        # 4. 计算混合分数
-        hybrid_scores = []
-        for doc_id in all_doc_ids:
-            bm25_score = bm25_scores.get(doc_id, 0)
-            
-            # 向量分数
-            vector_score = 0
-            if vector_results["ids"] and doc_id in vector_results["ids"][0]:
-                idx = vector_results["ids"][0].index(doc_id)
-                distance = vector_results["distances"][0][idx]
-                vector_score = 1 - distance  # 转换为相似度
-            
-            # 归一化 BM25 分数
-            max_bm25 = max(bm25_scores.values()) if bm25_scores else 1
-            norm_bm25 = bm25_score / max_bm25 if max_bm25 > 0 else 0
-            
-            # 混合分数
-            hybrid_score = (
-                config.bm25_weight * norm_bm25 +
-                config.vector_weight * vector_score
-            )
-            
-            hybrid_scores.append((doc_id, hybrid_score))
-        
-        # 5. 按混合分数排序，取前 K 个
-        hybrid_scores.sort(key=lambda x: x[1], reverse=True)
-        candidate_ids = [doc_id for doc_id, _ in hybrid_scores[:config.rerank_top_k]]
-        
-        # 6. 获取候选文档内容
-        candidate_docs = []
-        candidate_metas = []
-        
-        if vector_results["ids"] and vector_results["ids"][0]:
-            for i, doc_id in enumerate(vector_results["ids"][0]):
-                if doc_id in candidate_ids:
-                    candidate_docs.append(vector_results["documents"][0][i])
-                    candidate_metas.append(vector_results["metadatas"][0][i])
-        
-        # 对于 BM25 独有结果，需要从 ChromaDB 获取
-        existing_ids = set()
-        if vector_results["ids"] and vector_results["ids"][0]:
-            existing_ids = set(vector_results["ids"][0])
+        # 6. 获取候选文档内容：(id, 内容, 元数据, 融合分数)，按融合分数排序
+        #    BM25 独有结果一次批量从 ChromaDB 获取
+        missing = [doc_id for doc_id in candidate_ids if doc_id not in vid_to_idx]
+        fetched: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        if missing:
+            result = collection.get(ids=missing, include=["documents", "metadatas"])
+            metas = result["metadatas"] or [{}] * len(result["ids"])
+            fetched = {
+                doc_id: (doc, meta or {})
+                for doc_id, doc, meta in zip(result["ids"], result["documents"], metas)
+            }
         
+        candidates: List[Tuple[str, str, Dict[str, Any], float]] = []
         for doc_id in candidate_ids:
-            if doc_id not in existing_ids:
-                # 从 ChromaDB 获取
-                result = collection.get(ids=[doc_id], include=["documents", "metadatas"])
-                if result["documents"]:
-                    candidate_docs.append(result["documents"][0])
-                    candidate_metas.append(result["metadatas"][0] if result["metadatas"] else {})
-        
-        # 7. Rerank
-        if use_rerank and candidate_docs and len(candidate_docs) > 1:
+            idx = vid_to_idx.get(doc_id)
+            if idx is not None:
+                doc = vector_results["documents"][0][idx]
+                meta = vector_results["metadatas"][0][idx] if vector_results["metadatas"] else {}
+            elif doc_id in fetched:
+                doc, meta = fetched[doc_id]
+            else:
+                continue
+            candidates.append((doc_id, doc, meta, fused[doc_id]))
+        
+        # 7. Rerank，返回的下标直接对应 candidates 中的记录
+        if use_rerank and len(candidates) > 1:
             rerank_results = self.reranker.rerank(
                 query,
-                candidate_docs,
+                [doc for _, doc, _, _ in candidates],
                 top_k=top_k
             )
-            
-            # 构建最终结果
-            final_results = []
-            for idx, score in rerank_results:
-                if idx < len(candidate_docs):
-                    doc_id = candidate_ids[idx] if idx < len(candidate_ids) else f"doc_{idx}"
-                    final_results.append({
-                        "id": doc_id,
-                        "content": candidate_docs[idx],
-                        "metadata": candidate_metas[idx] if idx < len(candidate_metas) else {},
-                        "similarity": round(float(score), 4),
-                        "rerank_score": round(float(score), 4)
-                    })
-            
-            results = final_results
+            scored = [(candidates[idx], score) for idx, score in rerank_results]
         else:
             # 不使用 rerank，直接返回混合检索结果
-            results = []
-            for doc_id, score in hybrid_scores[:top_k]:
-                # 获取文档内容
-                doc_content = ""
-                doc_meta = {}
-                if doc_id in [did for did, _ in hybrid_scores]:
-                    idx = 0
-                    if vector_results["ids"] and doc_id in vector_results["ids"][0]:
-                        idx = vector_results["ids"][0].index(doc_id)
-                        doc_content = vector_results["documents"][0][idx]
-                        doc_meta = vector_results["metadatas"][0][idx] if vector_results["metadatas"] else {}
-                
-                results.append({
-                    "id": doc_id,
-                    "content": doc_content,
-                    "metadata": doc_meta,
-                    "similarity": round(float(score), 4)
-                })
+            scored = [(candidate, None) for candidate in candidates[:top_k]]
+        
+        results = []
+        for (doc_id, doc, meta, fused_score), rerank_score in scored:
+            item = {
+                "id": doc_id,
+                "content": doc,
+                "metadata": meta,
+                "similarity": round(float(fused_score if rerank_score is None else rerank_score), 4)
+            }
+            if rerank_score is not None:
+                item["rerank_score"] = round(float(rerank_score), 4)
+            results.append(item)
         
         logger.info(f"检索 '{query[:50]}...' 找到 {len(results)} 个结果")
         
@@ -645,6 +974,7 @@ class KnowledgeBase:
     def clear(self):
         """清空所有索引"""
         self.bm25.clear()
+        self._save_bm25()
         if self.cache:
             self.cache = LRUCache(config.cache_size)
 
@@ -652,6 +982,24 @@ class KnowledgeBase:
 # 全局知识库实例
 kb = KnowledgeBase()
 
+
+def warmup() -> List[Future]:
+    """后台预热 jieba 词典、BM25 内核、向量模型和 Reranker，首个查询不再承担加载延迟"""
+    pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="warmup")
+    futures = [
+        pool.submit(kb.bm25.jieba.initialize),
+        pool.submit(lambda: kb.vector.model),
+        pool.submit(lambda: kb.reranker.model),
+        pool.submit(kb.bm25.warm_kernel),
+    ]
+    for future in futures:
+        future.add_done_callback(
+            lambda f: f.exception() and logger.warning(f"预热失败：{f.exception()}")
+        )
+    pool.shutdown(wait=False)
+    return futures
+
+
 # ==================== MCP 工具 ====================
 
 
@@ -694,6 +1042,8 @@ def retrieve_knowledge(
             "results": results,
             "count": len(results),
             "search_info": {
+                "fusion": "rrf",
+                "rrf_k": config.rrf_k,
                 "bm25_weight": config.bm25_weight,
                 "vector_weight": config.vector_weight,
                 "use_rerank": use_rerank
@@ -882,6 +1232,7 @@ def clear_collection(collection_name: str = "hair_knowledge") -> Dict[str, Any]:
         if collection_name in kb._collections:
             del kb._collections[collection_name]
         kb.bm25.clear()
+        kb._save_bm25()
         logger.info(f"清空集合：{collection_name}")
         return {"success": True, "message": f"集合 {collection_name} 已清空"}
     except Exception as e:
@@ -892,4 +1243,5 @@ def clear_collection(collection_name: str = "hair_knowledge") -> Dict[str, Any]:
 # ==================== 主程序 ====================
 
 if __name__ == "__main__":
+    warmup()
     mcp.run()
@@ -31,11 +31,26 @@ s05_skill_loading.py - 技能加载模块
 
 import os
 import re
+import signal
+import sys
+import itertools
 import subprocess
+import threading
 from pathlib import Path
-from glob import glob
+from concurrent.futures import ThreadPoolExecutor
 import json
-import readline
+
+# 只有交互式终端才需要行编辑；子进程/管道场景下跳过 readline 的加载与终端初始化
+if sys.stdin.isatty():
+    import readline
+
+import yaml
+
+# 优先使用 libyaml 的 C 实现（需安装 libyaml-dev 后再装 PyYAML），不可用时退回纯 Python 版本
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
 
 from llm_config import client, MODEL  # 导入 LLM 客户端配置和模型名称
 
@@ -44,9 +59,14 @@ def js(data):
     """格式化打印 JSON 数据（用于调试）"""
     print(json.dumps(data, indent=2, ensure_ascii=False, default=str))
 
+# frontmatter 格式：---\n元数据\n---\n正文（模块加载时编译一次）
+_FM_RE = re.compile(r"^---\n(.*?)\n---\n(.*)", re.DOTALL)
+
 # 设置工作目录和技能目录
 WORKDIR = Path.cwd()  # 当前工作目录
 SKILLS_DIR = WORKDIR / "skills"  # 技能文件存储目录
+MAX_OUTPUT = 50000  # 命令输出保留的最大字符数
+CACHE_FILE = ".cache.json"  # 技能索引缓存文件（位于技能目录下）
 
 
 # -- SkillLoader 类：解析 .skills/*.md 文件（带 YAML frontmatter）--
@@ -68,28 +88,139 @@ class SkillLoader:
             skills_dir: 技能文件所在的目录路径
         """
         self.skills_dir = skills_dir  # 技能目录
-        self.skills = {}  # 存储所有已加载的技能 {name: {meta, body, path}}
+        self.skills = {}  # 存储所有已加载的技能 {name: {meta, body, path, rendered, mtime}}
         self._load_all()  # 初始化时加载所有技能
 
     def _load_all(self):
         """
         加载技能目录下的所有技能文件
         
-        遍历 skills 目录下的所有子目录，读取其中的 .md 文件
-        解析每个文件的 YAML frontmatter 和正文内容
+        遍历 skills 目录下的所有子目录，只读取其中 .md 文件开头的
+        YAML frontmatter；正文在第一次 get_content 时才读取
+        """
+        self._load_skills()
+        # 技能列表在启动后不再变化，描述字符串和名称列表只生成一次
+        self._desc_cache = self._build_descriptions()
+        self._names_joined = ', '.join(self.skills.keys())
+
+    def _load_skills(self):
         """
-        # 遍历技能目录下的所有子目录
-        for _dir in sorted(glob(f"{self.skills_dir}/*")):
-            # 遍历每个子目录下的所有 markdown 文件
-            for f in glob(f'{_dir}/*.md'):
-                # 从文件路径提取技能名称（父目录名）
-                name = Path(f.rsplit('/', 1)[0]).stem
-                # 读取文件内容
-                text = Path(f).read_text()
-                # 解析 frontmatter 和正文
-                meta, body = self._parse_frontmatter(text)
-                # 存储技能信息
-                self.skills[name] = {"meta": meta, "body": body, "path": str(f)}
+        读取技能目录，填充 self.skills
+        
+        skills/.cache.json 记录每个文件的 mtime 和元数据，mtime 未变的文件
+        直接复用缓存，只有新增或修改过的文件才重新读取、解析 YAML
+        """
+        skills_dir = Path(self.skills_dir)
+        if not skills_dir.is_dir():
+            return
+        
+        # 先收集所有技能文件：(技能名称，路径)，技能名称取子目录名
+        entries = [
+            (sub.stem, f)
+            for sub in sorted(skills_dir.iterdir())
+            if sub.is_dir()
+            for f in sub.glob("*.md")
+        ]
+        if not entries:
+            return
+        
+        cache = self._read_cache()
+        mtimes = {str(f): f.stat().st_mtime for _, f in entries}
+        metas = {
+            path: cache[path]["meta"]
+            for path, mtime in mtimes.items()
+            if path in cache and cache[path].get("mtime") == mtime
+        }
+        stale = [f for _, f in entries if str(f) not in metas]
+        
+        # 各文件的读取互不依赖，用线程池并发读取 frontmatter（文件读取会释放 GIL）
+        if stale:
+            with ThreadPoolExecutor(max_workers=min(32, len(stale))) as ex:
+                for f, meta in zip(stale, ex.map(self._read_meta, stale)):
+                    metas[str(f)] = meta
+        
+        for name, f in entries:
+            # body 为 None 表示尚未加载
+            self.skills[name] = {"meta": metas[str(f)], "body": None, "path": str(f)}
+        
+        # 有新增、修改或删除的文件时才重写缓存
+        if stale or len(cache) != len(mtimes):
+            self._write_cache({
+                path: {"mtime": mtime, "meta": metas[path]} for path, mtime in mtimes.items()
+            })
+
+    def _read_cache(self) -> dict:
+        """
+        读取技能索引缓存
+        
+        Returns:
+            dict: {文件路径: {"mtime": 修改时间, "meta": 元数据}}，缓存不可用时为空字典
+        """
+        try:
+            with open(Path(self.skills_dir) / CACHE_FILE, encoding="utf-8") as fp:
+                cache = json.load(fp)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, cache: dict):
+        """
+        写入技能索引缓存（先写临时文件再替换），目录不可写时忽略
+        
+        Args:
+            cache: {文件路径: {"mtime": 修改时间, "meta": 元数据}}
+        """
+        path = Path(self.skills_dir) / CACHE_FILE
+        tmp = path.with_suffix(".tmp")
+        try:
+            tmp.write_text(json.dumps(cache, ensure_ascii=False, default=str), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _read_meta(self, path: Path, chunk_size: int = 4096) -> dict:
+        """
+        分块读取文件开头，直到 frontmatter 的结束分隔符为止
+        
+        Args:
+            path: 技能文件路径
+            chunk_size: 每次读取的字节数
+            
+        Returns:
+            dict: 元数据字典，没有 frontmatter 时为空字典
+        """
+        with open(path, "rb") as fp:
+            head = fp.read(chunk_size)
+            if not head.startswith(b"---\n"):
+                return {}
+            # 结束分隔符 \n---\n 可能跨块，继续读到找到为止
+            while (end := head.find(b"\n---\n", 4)) < 0:
+                chunk = fp.read(chunk_size)
+                if not chunk:
+                    return {}
+                head += chunk
+        return self._parse_meta(head[4:end].decode("utf-8"))
+
+    def _parse_meta(self, block: str) -> dict:
+        """
+        解析 frontmatter 中的 YAML 文本
+        
+        Args:
+            block: 两个 --- 分隔符之间的文本
+            
+        Returns:
+            dict: 元数据字典
+        """
+        try:
+            meta = yaml.load(block, Loader=_YamlLoader)
+        except yaml.YAMLError:
+            # 不是合法 YAML 时退回逐行解析 key: value
+            meta = {}
+            for line in block.strip().splitlines():
+                if ":" in line:
+                    key, val = line.split(":", 1)
+                    meta[key.strip()] = val.strip()
+        return meta if isinstance(meta, dict) else {}
 
     def _parse_frontmatter(self, text: str) -> tuple:
         """
@@ -102,43 +233,56 @@ class SkillLoader:
             tuple: (元数据字典，正文字符串)
         """
         # 匹配 YAML frontmatter 格式：---\n内容\n---\n正文
-        match = re.match(r"^---\n(.*?)\n---\n(.*)", text, re.DOTALL)
+        match = _FM_RE.match(text)
         if not match:
             # 没有 frontmatter，返回空字典和全文
             return {}, text
         
-        meta = {}
-        # 逐行解析 YAML 键值对
-        for line in match.group(1).strip().splitlines():
-            if ":" in line:
-                key, val = line.split(":", 1)
-                meta[key.strip()] = val.strip()
-        
-        return meta, match.group(2).strip()
+        return self._parse_meta(match.group(1)), match.group(2).strip()
 
     def get_descriptions(self) -> str:
         """
         第一层：获取技能的简短描述（用于系统提示词）
         
+        描述在 _load_all 结束时生成一次，之后直接返回缓存
+        
         Returns:
             str: 格式化的技能描述列表字符串
         """
+        return self._desc_cache
+
+    def _build_descriptions(self) -> str:
+        """
+        生成技能描述列表字符串
+        
+        Returns:
+            str: 每个技能一行，格式为 "  - 名称: 描述 [标签]"
+        """
         if not self.skills:
             return "(no skills available)"
+        return "\n".join(
+            self._describe(name, skill["meta"]) for name, skill in self.skills.items()
+        )
+
+    @staticmethod
+    def _describe(name: str, meta: dict) -> str:
+        """
+        构建单个技能的描述行
         
-        lines = []
-        for name, skill in self.skills.items():
-            # 获取技能描述和标签
-            desc = skill["meta"].get("description", "No description")
-            tags = skill["meta"].get("tags", "")
+        Args:
+            name: 技能名称
+            meta: 技能元数据
             
-            # 构建描述行
-            line = f"  - {name}: {desc}"
-            if tags:
-                line += f" [{tags}]"
-            lines.append(line)
-        
-        return "\n".join(lines)
+        Returns:
+            str: 描述行
+        """
+        desc = meta.get("description", "No description")
+        tags = meta.get("tags", "")
+        if isinstance(tags, list):
+            # YAML 列表形式的标签：tags: [git, workflow]
+            tags = ", ".join(map(str, tags))
+        line = f"  - {name}: {desc}"
+        return f"{line} [{tags}]" if tags else line
 
     def get_content(self, name: str) -> str:
         """
@@ -153,10 +297,18 @@ class SkillLoader:
         skill = self.skills.get(name)
         if not skill:
             # 技能不存在时返回错误信息和可用技能列表
-            return f"Error: Unknown skill '{name}'. Available: {', '.join(self.skills.keys())}"
+            return f"Error: Unknown skill '{name}'. Available: {self._names_joined}"
         
-        # 返回 XML 格式的技能内容
-        return f"<skill name=\"{name}\">\n{skill['body']}\n</skill>"
+        # 第一次使用或文件修改后才读取正文，渲染好的 XML 缓存起来
+        # 重复加载返回完全相同的字符串，也有利于提示词缓存命中
+        mtime = os.stat(skill["path"]).st_mtime
+        if skill["body"] is None or skill.get("mtime") != mtime:
+            _, skill["body"] = self._parse_frontmatter(Path(skill["path"]).read_text(encoding="utf-8"))
+            # 返回 XML 格式的技能内容
+            skill["rendered"] = f"<skill name=\"{name}\">\n{skill['body']}\n</skill>"
+            skill["mtime"] = mtime
+        
+        return skill["rendered"]
 
 
 # 创建全局技能加载器实例
@@ -169,9 +321,17 @@ Use load_skill to access specialized knowledge before tackling unfamiliar topics
 Skills available:
 {SKILL_LOADER.get_descriptions()}"""
 
+# SYSTEM 在进程内不变，标记为可缓存的提示词前缀，后续请求按缓存命中计费
+SYSTEM_BLOCKS = ({"type": "text", "text": SYSTEM, "cache_control": {"type": "ephemeral"}},)
+
 
 # -- 工具函数实现 --
 
+# 危险命令检查列表，编译成一个正则分支，每条命令只扫描一遍
+DANGEROUS_COMMANDS = ["rm -rf /", "sudo", "shutdown", "reboot", "> /dev/"]
+_DANGER_RE = re.compile("|".join(map(re.escape, DANGEROUS_COMMANDS)))
+
+
 def safe_path(p: str) -> Path:
     """
     安全路径解析器
@@ -205,19 +365,44 @@ def run_bash(command: str) -> str:
     Returns:
         str: 命令输出或错误信息
     """
-    # 危险命令检查列表
-    dangerous = ["rm -rf /", "sudo", "shutdown", "reboot", "> /dev/"]
-    if any(d in command for d in dangerous):
+    # 危险命令检查：一次正则扫描
+    if _DANGER_RE.search(command):
         return "Error: Dangerous command blocked"
     
+    # stderr 合并到 stdout，边读边累积，超过上限的部分直接丢弃不再保存
+    # 放到独立进程组：超时时连同管道里的子进程（如 `sleep 8 | cat`）一起杀掉，
+    # 否则仍持有 stdout 的子进程会让 read() 一直阻塞
+    proc = subprocess.Popen(command, shell=True, cwd=WORKDIR,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            text=True, errors="replace", start_new_session=True)
+    timed_out = threading.Event()
+    
+    def kill():
+        timed_out.set()
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    
+    timer = threading.Timer(120, kill)
+    timer.start()
+    chunks, size = [], 0
     try:
-        r = subprocess.run(command, shell=True, cwd=WORKDIR,
-                           capture_output=True, text=True, timeout=120)
-        out = (r.stdout + r.stderr).strip()
-        # 限制输出长度
-        return out[:50000] if out else "(no output)"
-    except subprocess.TimeoutExpired:
+        while chunk := proc.stdout.read(8192):
+            # 达到上限后继续读空管道（不保存），命令照常运行到结束
+            if size < MAX_OUTPUT:
+                chunks.append(chunk)
+                size += len(chunk)
+        proc.wait()
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+    
+    if timed_out.is_set():
         return "Error: Timeout (120s)"
+    out = "".join(chunks).strip()
+    # 限制输出长度
+    return out[:MAX_OUTPUT] if out else "(no output)"
 
 
 def run_read(path: str, limit: int = None) -> str:
@@ -232,11 +417,24 @@ def run_read(path: str, limit: int = None) -> str:
         str: 文件内容或错误信息
     """
     try:
-        lines = safe_path(path).read_text().splitlines()
-        if limit and limit < len(lines):
+        fp = safe_path(path)
+        if not limit:
+            return "\n".join(fp.read_text().splitlines())[:MAX_OUTPUT]
+        
+        # 有行数限制时只读取前 limit 行，不加载、不拆分整个文件
+        with fp.open("rb") as fh:
+            lines = [line.decode().rstrip("\r\n") for line in itertools.islice(fh, limit)]
+            # 剩余行数直接在二进制块里数换行符，不解码也不保存
+            more, last = 0, b""
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                more += chunk.count(b"\n")
+                last = chunk
+            if last and not last.endswith(b"\n"):
+                more += 1
+        if more:
             # 超过限制时截断并提示剩余行数
-            lines = lines[:limit] + [f"... ({len(lines) - limit} more)"]
-        return "\n".join(lines)[:50000]
+            lines.append(f"... ({more} more)")
+        return "\n".join(lines)[:MAX_OUTPUT]
     except Exception as e:
         return f"Error: {e}"
 
@@ -277,10 +475,11 @@ def run_edit(path: str, old_text: str, new_text: str) -> str:
     try:
         fp = safe_path(path)
         content = fp.read_text()
-        if old_text not in content:
+        # 一次 find 同时完成查找和定位，只替换第一次出现
+        idx = content.find(old_text)
+        if idx < 0:
             return f"Error: Text not found in {path}"
-        # 只替换第一次出现
-        fp.write_text(content.replace(old_text, new_text, 1))
+        fp.write_text(content[:idx] + new_text + content[idx + len(old_text):])
         return f"Edited {path}"
     except Exception as e:
         return f"Error: {e}"
@@ -295,8 +494,9 @@ TOOL_HANDLERS = {
     "load_skill": lambda **kw: SKILL_LOADER.get_content(kw["name"]),
 }
 
-# 工具定义列表（用于向 LLM 声明可用工具）
-TOOLS = [
+# 工具定义（用于向 LLM 声明可用工具）
+# 用元组保存：进程内只构建一次、不可增删，保证每次请求的工具前缀完全一致，缓存才能命中
+TOOLS = (
     {"name": "bash", "description": "Run a shell command.",
      "input_schema": {"type": "object", "properties": {"command": {"type": "string"}}, "required": ["command"]}},
     {"name": "read_file", "description": "Read file contents.",
@@ -306,8 +506,10 @@ TOOLS = [
     {"name": "edit_file", "description": "Replace exact text in file.",
      "input_schema": {"type": "object", "properties": {"path": {"type": "string"}, "old_text": {"type": "string"}, "new_text": {"type": "string"}}, "required": ["path", "old_text", "new_text"]}},
     {"name": "load_skill", "description": "Load specialized knowledge by name.",
-     "input_schema": {"type": "object", "properties": {"name": {"type": "string", "description": "Skill name to load"}}, "required": ["name"]}},
-]
+     "input_schema": {"type": "object", "properties": {"name": {"type": "string", "description": "Skill name to load"}}, "required": ["name"]},
+     # 缓存断点放在最后一个工具上，整个工具列表一起缓存
+     "cache_control": {"type": "ephemeral"}},
+)
 
 
 def agent_loop(messages: list):
@@ -320,11 +522,31 @@ def agent_loop(messages: list):
         messages: 对话消息历史列表
     """
     while True:
-        # 调用 LLM API 获取响应
-        response = client.messages.create(
-            model=MODEL, system=SYSTEM, messages=messages,
+        results = []
+        log_lines = []  # 本轮的工具日志，流结束后一次性写出
+        # 流式调用 LLM API：文本边生成边输出，每个工具调用块一结束就立即执行，
+        # 不必等整条响应生成完毕
+        with client.messages.stream(
+            model=MODEL, system=SYSTEM_BLOCKS, messages=messages,
             tools=TOOLS, max_tokens=8000,
-        )
+        ) as stream:
+            for event in stream:
+                if event.type == "text":
+                    print(event.text, end="", flush=True)
+                elif event.type == "content_block_stop":
+                    block = stream.current_message_snapshot.content[event.index]
+                    if block.type == "text":
+                        print()
+                    elif block.type == "tool_use":
+                        result = run_tool(block)
+                        results.append(result)
+                        # 工具执行结果只记录前 200 字符
+                        log_lines.append(f"> {block.name}: {result['content'][:200]}\n")
+            response = stream.get_final_message()
+        
+        # 一轮的工具日志合并为一次写出，避免多次 print 的调用与刷新开销
+        if log_lines:
+            sys.stdout.write("".join(log_lines))
         
         # 将助手响应添加到消息历史
         messages.append({"role": "assistant", "content": response.content})
@@ -333,25 +555,29 @@ def agent_loop(messages: list):
         if response.stop_reason != "tool_use":
             return
         
-        # 处理所有工具调用
-        results = []
-        for block in response.content:
-            if block.type == "tool_use":
-                handler = TOOL_HANDLERS.get(block.name)
-                try:
-                    # 执行对应的工具处理函数
-                    output = handler(**block.input) if handler else f"Unknown tool: {block.name}"
-                except Exception as e:
-                    output = f"Error: {e}"
-                # 打印工具执行结果（前 200 字符）
-                print(f"> {block.name}: {str(output)[:200]}")
-                # 添加工具结果到响应列表
-                results.append({"type": "tool_result", "tool_use_id": block.id, "content": str(output)})
-        
         # 将工具结果添加到消息历史
         messages.append({"role": "user", "content": results})
 
 
+def run_tool(block) -> dict:
+    """
+    执行单个工具调用块
+    
+    Args:
+        block: LLM 响应中的 tool_use 内容块
+        
+    Returns:
+        dict: 对应的 tool_result 内容块
+    """
+    handler = TOOL_HANDLERS.get(block.name)
+    try:
+        # 执行对应的工具处理函数
+        output = handler(**block.input) if handler else f"Unknown tool: {block.name}"
+    except Exception as e:
+        output = f"Error: {e}"
+    return {"type": "tool_result", "tool_use_id": block.id, "content": str(output)}
+
+
 if __name__ == "__main__":
     # 主程序入口 - 交互式命令行界面
     history = []  # 对话历史
@@ -36,26 +36,76 @@ NOT a teaching session -- this is the "put it all together" reference.
     REPL commands: /compact /tasks /team /inbox
 """
 
+import itertools
 import json
+import mmap
 import os
 import sys
 import re
+import selectors
+import shlex
+import shutil
+import signal
 import subprocess
 import threading
 import time
 import uuid
+import weakref
+import atexit
+import functools
+import hashlib
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from queue import Queue
-from datetime import datetime, timedelta
+from queue import Empty, Queue
+from datetime import date, datetime, timedelta
 from typing import Any, Dict, List, Union
 
 from llm_config import client, MODEL
-import readline  # Enables line editing (backspace, arrow keys, history)
+# Also send the key as "Authorization: Bearer" (set once; shared by lead, subagents and teammates)
+client.auth_token = client.api_key
+# Line editing (backspace, arrow keys, history) only matters on an interactive
+# terminal; skip loading readline in piped or spawned subagent processes.
+if sys.stdin.isatty():
+    import readline
 from glob import glob
-import urllib.request
-import ssl
+import importlib.util
 import json as json_module
 
+# Optional orjson (C extension, emits UTF-8 bytes directly) for JSON on hot paths;
+# falls back to the stdlib json with equivalent compact, non-ASCII-preserving output
+try:
+    import orjson
+
+    def _dumps_bytes(data) -> bytes:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+    def _dumps(data) -> str:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def _pretty_json(data) -> str:
+        return orjson.dumps(data, default=str,
+                            option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    _loads = orjson.loads  # accepts bytes or str
+except ImportError:
+    def _dumps(data) -> str:
+        return json.dumps(data, ensure_ascii=False, default=str, separators=(",", ":"))
+
+    def _dumps_bytes(data) -> bytes:
+        return _dumps(data).encode("utf-8")
+
+    def _pretty_json(data) -> str:
+        return json.dumps(data, indent=2, ensure_ascii=False, default=str)
+
+    _loads = json.loads  # accepts bytes (UTF-8) or str
+# Optional inotify (Linux) so idle teammates also wake on inbox/task files written
+# by other processes; without it they re-check every POLL_INTERVAL seconds
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
 
 # =============================================================================
 # TAVILY SEARCH MCP CLIENT
@@ -71,6 +121,67 @@ class TavilyConfig:
         return os.getenv("TAVILY_API_KEY", "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")
 
 
+# Shared HTTP client for Tavily: keeps TCP/TLS connections alive across calls.
+# Created on first use so importing this module does not load httpx.
+_TAVILY_HTTP = None
+_TAVILY_HTTP_LOCK = threading.Lock()
+
+
+def _tavily_http():
+    """Return the process-wide Tavily HTTP client, creating it on first use."""
+    global _TAVILY_HTTP
+    if _TAVILY_HTTP is None:
+        with _TAVILY_HTTP_LOCK:
+            if _TAVILY_HTTP is None:
+                import httpx
+                _TAVILY_HTTP = httpx.Client(
+                    base_url=TavilyConfig.BASE_URL,
+                    timeout=30,
+                    # HTTP/2 needs the optional h2 package (pip install httpx[http2])
+                    http2=importlib.util.find_spec("h2") is not None,
+                )
+    return _TAVILY_HTTP
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds."""
+    
+    def __init__(self, maxsize=256, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+    
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+# Identical searches within 10 minutes are answered from memory
+_TAVILY_CACHE = TTLCache(
+    maxsize=int(os.getenv("TAVILY_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("TAVILY_CACHE_TTL", "600")),
+)
+# Requests currently on the wire: concurrent identical calls wait on one Future
+_INFLIGHT: Dict[tuple, Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
 class TavilyClient:
     """Client for interacting with Tavily Search MCP API."""
     
@@ -78,37 +189,53 @@ class TavilyClient:
         self.base_url = TavilyConfig.BASE_URL
         self.api_key = TavilyConfig.get_api_key()
         self.timeout = 30
-        
-    def _create_ssl_context(self):
-        """Create SSL context for HTTPS requests."""
-        return ssl.create_default_context()
     
     def _make_request(self, endpoint, data):
-        """Make HTTP POST request to Tavily API."""
-        url = f"{self.base_url}/{endpoint}"
+        """Make HTTP POST request to Tavily API, serving repeats from the TTL cache."""
+        key = (endpoint, json_module.dumps(data, sort_keys=True))
+        cached = _TAVILY_CACHE.get(key)
+        if cached is not None:
+            return cached
         
-        # Prepare request data
-        request_data = json_module.dumps({
-            "api_key": self.api_key,
-            **data
-        }).encode('utf-8')
+        # Single-flight: if the same request is already running, wait for its result
+        with _INFLIGHT_LOCK:
+            fut = _INFLIGHT.get(key)
+            owner = fut is None
+            if owner:
+                fut = _INFLIGHT[key] = Future()
+        if not owner:
+            return fut.result()
         
-        # Create request
-        req = urllib.request.Request(
-            url,
-            data=request_data,
-            headers={'Content-Type': 'application/json'}
-        )
+        try:
+            result = self._post(endpoint, data)
+            # Only successful responses are cached so failures get retried
+            if "error" not in result:
+                _TAVILY_CACHE.set(key, result)
+        except BaseException as e:
+            result = {"error": f"Request failed: {str(e)}"}
+            raise
+        finally:
+            with _INFLIGHT_LOCK:
+                _INFLIGHT.pop(key, None)
+            fut.set_result(result)
+        return result
+    
+    def _post(self, endpoint, data):
+        """POST to Tavily API over the shared connection pool."""
+        import httpx
         
-        # Make request
         try:
-            context = self._create_ssl_context()
-            with urllib.request.urlopen(req, context=context, timeout=self.timeout) as response:
-                return json_module.loads(response.read().decode('utf-8'))
-        except urllib.error.HTTPError as e:
-            return {"error": f"HTTP Error {e.code}: {e.reason}", "response": e.read().decode('utf-8')}
-        except urllib.error.URLError as e:
-            return {"error": f"URL Error: {e.reason}"}
+            response = _tavily_http().post(
+                f"/{endpoint}",
+                json={"api_key": self.api_key, **data},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP Error {e.response.status_code}: {e.response.reason_phrase}", "response": e.response.text}
+        except httpx.RequestError as e:
+            return {"error": f"URL Error: {e}"}
         except Exception as e:
             return {"error": f"Request failed: {str(e)}"}
     
@@ -188,6 +315,29 @@ def generate_log_filename(agent_name: str = "main") -> str:
     return LOG_DIR / f"{agent_name}_{timestamp}.jsonl"
 
 
+def iter_log_entries(path):
+    """
+    Lazily yield the raw JSON lines (bytes) of an agent log file.
+    
+    The file is memory-mapped, so scanning a large log does not read it into a Python
+    string; callers json.loads() only the entries they need.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while True:
+                nl = mm.find(b"\n", start)
+                if nl < 0:
+                    if start < len(mm):
+                        yield mm[start:]
+                    return
+                if nl > start:
+                    yield mm[start:nl]
+                start = nl + 1
+
+
 def parse_content_block(block: Any) -> Dict[str, Any]:
     """
     Parse a content block from response.content into a human-readable dict.
@@ -197,27 +347,25 @@ def parse_content_block(block: Any) -> Dict[str, Any]:
     - tool_use: Tool/function call with name and input
     - other: Any other block type
     """
-    result = {"type": getattr(block, "type", "unknown")}
-    bad_flag = False
-    if hasattr(block, "type"):
-        if block.type == "text":
-            result["text"] = getattr(block, "text", "")
-    
-        elif block.type == "tool_use":
-            result["tool_name"] = getattr(block, "name", "unknown")
-            result["tool_input"] = getattr(block, "input", {})
-            result["tool_id"] = getattr(block, "id", "")
-        else:
-            bad_flag = True
-    
-    elif bad_flag or not hasattr(block, "type"):
-        # Fallback: convert to dict or string
+    # Look the type up once; dicts and other plain objects have no .type attribute
+    block_type = getattr(block, "type", None)
+    if block_type == "text":
+        return {"type": "text", "text": getattr(block, "text", "")}
+    if block_type == "tool_use":
+        return {
+            "type": "tool_use",
+            "tool_name": getattr(block, "name", "unknown"),
+            "tool_input": getattr(block, "input", {}),
+            "tool_id": getattr(block, "id", ""),
+        }
+    if block_type is None:
+        # Fallback: convert to string
         try:
-            result["data"] = str(block)
+            return {"type": "unknown", "data": str(block)}
         except Exception as e:
-            result["data"] = f"<unparseable: {e}>"
-    
-    return result
+            return {"type": "unknown", "data": f"<unparseable: {e}>"}
+    # Other block types (e.g. thinking) are recorded by type only
+    return {"type": block_type}
 
 
 def parse_response_content(content: List[Any]) -> List[Dict[str, Any]]:
@@ -236,6 +384,35 @@ def parse_response_content(content: List[Any]) -> List[Dict[str, Any]]:
     return parsed
 
 
+def parse_response_content_full(content: List[Any]):
+    """
+    Parse response.content in a single pass, collecting everything the logger needs.
+    
+    Args:
+        content: List of content blocks from Claude API response
+    
+    Returns:
+        Tuple of (parsed block dicts, last text block, tool call dicts, all text joined by newlines)
+    """
+    parsed = []
+    texts = []
+    tool_calls = []
+    for block in content:
+        result = parse_content_block(block)
+        parsed.append(result)
+        block_type = result["type"]
+        if block_type == "text":
+            texts.append(result["text"])
+        elif block_type == "tool_use":
+            tool_calls.append({
+                "name": result["tool_name"],
+                "arguments": result["tool_input"],
+                "id": result["tool_id"],
+            })
+    plan_text = texts[-1] if texts else ""
+    return parsed, plan_text, tool_calls, "\n".join(texts)
+
+
 def parse_messages_for_log(messages: List[Dict]) -> List[Dict]:
     """
     Parse messages list for logging, handling both string and content block formats.
@@ -255,14 +432,10 @@ def parse_messages_for_log(messages: List[Dict]) -> List[Dict]:
         if isinstance(content, str):
             parsed_msg["content"] = content
         elif isinstance(content, list):
-            # Parse content blocks
-            parsed_msg["content_blocks"] = parse_response_content(content)
-            # Also extract combined text for quick viewing
-            texts = []
-            for block in content:
-                if hasattr(block, "type") and block.type == "text":
-                    texts.append(getattr(block, "text", ""))
-            parsed_msg["content_text"] = "\n".join(texts)
+            # Parse content blocks, also extracting combined text for quick viewing
+            blocks, _, _, combined_text = parse_response_content_full(content)
+            parsed_msg["content_blocks"] = blocks
+            parsed_msg["content_text"] = combined_text
         else:
             parsed_msg["content"] = str(content)
         
@@ -274,47 +447,98 @@ def parse_messages_for_log(messages: List[Dict]) -> List[Dict]:
 class AgentLogger:
     """Logger for agent interactions."""
     
-    MAX_LOG_LINES = 100000  # Maximum number of lines to keep in log file
+    MAX_LOG_BYTES = 50 * 1024 * 1024  # Rotate the log file to <name>.1 once it grows past this size
+    WRITE_BATCH = 64  # Max entries the writer thread coalesces into one write
+    MAX_TRACE_ITEMS = 5000  # Trace items kept in memory for the markdown report
+    MAX_PLAN_ITEMS = 500  # Plan summaries kept in memory for the markdown report
+    
+    # One background writer shared by all loggers: log_* calls only enqueue,
+    # serialization and file I/O happen off the agent's hot path
+    _queue = Queue()
+    _writer = None
+    _writer_lock = threading.Lock()
     
     def __init__(self, agent_name: str = "main"):
         self.agent_name = agent_name
         self.log_file = generate_log_filename(agent_name)
         self.call_count = 0
         self._lock = threading.Lock()
-        # Track execution trace for detailed reports
-        self.execution_trace = []
-        self.current_plan = []
-    
-    def _trim_log_if_needed(self, f):
-        """
-        Expert Tip: 不要直接在原本的写入句柄上进行 trim。
-        关闭写入句柄，以读写模式 ('r+') 打开文件，或者使用临时文件。
+        # Track execution trace for detailed reports (bounded: only the most recent items are kept)
+        self.execution_trace = deque(maxlen=self.MAX_TRACE_ITEMS)
+        self.current_plan = deque(maxlen=self.MAX_PLAN_ITEMS)
+        self._open_log()
+    
+    def _open_log(self):
+        """Open the persistent append-only fd and track the current file size."""
+        self._fd = os.open(self.log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = os.fstat(self._fd).st_size
+        # Close the fd when the logger is garbage-collected or at interpreter exit
+        self._finalizer = weakref.finalize(self, os.close, self._fd)
+    
+    def _write(self, payload: bytes):
+        """Append UTF-8 bytes to the log file, rotating it when it exceeds MAX_LOG_BYTES.
+        
+        Caller must hold self._lock.
         """
-        # 1. 确保写入已完成
-        f.flush()
-        file_path = f.name
-    
-        # 2. 如果文件是 append 模式，无法直接 read，必须关闭后重新打开
-        # 这里建议在外部统一管理 file_handle，或者在这里进行重新打开
-        f.close() 
+        # Unbuffered os.write: a batch normally lands in a single write syscall
+        data = memoryview(payload)
+        while data:
+            data = data[os.write(self._fd, data):]
+        self._size += len(payload)
+        if self._size > self.MAX_LOG_BYTES:
+            self._finalizer()
+            os.replace(self.log_file, self.log_file.with_name(self.log_file.name + ".1"))
+            self._open_log()
+    
+    def _enqueue(self, entry: Dict):
+        """Hand a log entry to the background writer thread."""
+        cls = type(self)
+        if cls._writer is None:
+            with cls._writer_lock:
+                if cls._writer is None:
+                    cls._writer = threading.Thread(target=cls._writer_loop, daemon=True, name="agent-log-writer")
+                    cls._writer.start()
+                    # Drain pending entries before file handles are closed at exit
+                    atexit.register(cls._queue.join)
+        cls._queue.put((self, entry))
     
-        # 3. 以读写模式打开文件
-        with open(file_path, 'r+') as file:
-            lines = file.readlines()
+    @classmethod
+    def _writer_loop(cls):
+        """Drain the queue, writing each logger's pending entries with one write call."""
+        while True:
+            batch = [cls._queue.get()]
+            try:
+                while len(batch) < cls.WRITE_BATCH:
+                    batch.append(cls._queue.get_nowait())
+            except Empty:
+                pass
             
-            # 4. 判断是否需要修剪
-            if len(lines) > self.MAX_LOG_LINES:
-                # 只保留最后 MAX_LOG_LINES 行
-                trimmed_lines = lines[-self.MAX_LOG_LINES:]
-                
-                # 5. 截断文件并重写
-                file.seek(0)
-                file.truncate()
-                file.writelines(trimmed_lines)
-                
-        # 6. 重要：函数结束前重新以 append 模式打开，以便后续继续追加
-        # 注意：这里需要你重新给 self.file_handle 赋值
-        self.file_handle = open(file_path, 'a')
+            pending = {}
+            for logger, entry in batch:
+                pending.setdefault(logger, []).append(entry)
+            for logger, entries in pending.items():
+                try:
+                    payload = b"".join(_dumps_bytes(e) + b"\n" for e in entries)
+                    with logger._lock:
+                        logger._write(payload)
+                except Exception as e:
+                    print(f"[logger] failed to write {logger.log_file}: {e}", file=sys.stderr)
+            
+            # Drop references so finished loggers can be garbage-collected
+            del pending, logger, entries
+            for _ in range(len(batch)):
+                cls._queue.task_done()
+            del batch
+    
+    def flush(self):
+        """Block until every queued log entry has been written."""
+        self._queue.join()
+    
+    def close(self):
+        """Flush pending entries and close the log file handle."""
+        self.flush()
+        with self._lock:
+            self._finalizer()
     
     def log_call(self, messages: List[Dict], response: Any, results: List = None):
         """
@@ -326,26 +550,21 @@ class AgentLogger:
             results: Optional tool execution results
         """
         self.call_count += 1
+        # One timestamp shared by every record of this call
+        ts = datetime.now().isoformat()
         
         # Extract plan/content from response
-        plan_content = ""
-        tool_calls = []
-        for block in response.content:
-            if block.type == "text":
-                plan_content = block.text
-            elif block.type == "tool_use":
-                tool_calls.append({
-                    "name": block.name,
-                    "arguments": block.input,
-                    "id": block.id,
-                })
+        content_blocks, plan_content, tool_calls, _ = parse_response_content_full(response.content)
         
-        # Add to execution trace
+        plan_preview = plan_content[:500] + "..." if len(plan_content) > 500 else plan_content
+        
+        # Add to execution trace; records share the objects used by log_entry
+        # (plan preview, tool arguments) rather than copying them
         if plan_content:
             self.current_plan.append({
                 "call_id": self.call_count,
-                "plan": plan_content[:500] + "..." if len(plan_content) > 500 else plan_content,
-                "timestamp": datetime.now().isoformat(),
+                "plan": plan_preview,
+                "timestamp": ts,
             })
         
         for tool_call in tool_calls:
@@ -354,12 +573,12 @@ class AgentLogger:
                 "call_id": self.call_count,
                 "name": tool_call["name"],
                 "arguments": tool_call["arguments"],
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": ts,
             })
         
         log_entry = {
             "call_id": self.call_count,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": ts,
             "agent": self.agent_name,
             "input": {
                 "message_count": len(messages),
@@ -367,9 +586,9 @@ class AgentLogger:
             },
             "output": {
                 "stop_reason": getattr(response, "stop_reason", "unknown"),
-                "content_blocks": parse_response_content(response.content),
+                "content_blocks": content_blocks,
                 "model": getattr(response, "model", ""),
-                "plan": plan_content[:500] + "..." if len(plan_content) > 500 else plan_content,
+                "plan": plan_preview,
                 "tool_calls": tool_calls,
             },
         }
@@ -377,16 +596,14 @@ class AgentLogger:
         if results:
             log_entry["tool_results"] = results
         
-        with self._lock:
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(json.dumps(log_entry, ensure_ascii=False, indent=2) + "\n")
-                self._trim_log_if_needed(f)
+        self._enqueue(log_entry)
     
     def log_tool_result(self, tool_name: str, result: str):
         """Log a tool execution result."""
+        ts = datetime.now().isoformat()
         entry = {
             "type": "tool_result",
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": ts,
             "tool_name": tool_name,
             "result": result,
         }
@@ -396,19 +613,17 @@ class AgentLogger:
             "type": "tool_result",
             "name": tool_name,
             "result_preview": result[:200] + "..." if len(result) > 200 else result,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": ts,
         })
         
-        with self._lock:
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-                self._trim_log_if_needed(f)
+        self._enqueue(entry)
     
     def log_skill_load(self, skill_name: str):
         """Log a skill load event."""
+        ts = datetime.now().isoformat()
         entry = {
             "type": "skill_load",
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": ts,
             "skill_name": skill_name,
         }
         
@@ -416,13 +631,10 @@ class AgentLogger:
         self.execution_trace.append({
             "type": "skill_load",
             "name": skill_name,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": ts,
         })
         
-        with self._lock:
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-                self._trim_log_if_needed(f)
+        self._enqueue(entry)
     
     def get_execution_trace_markdown(self, query: str) -> str:
         """Generate a markdown report of the execution trace."""
@@ -447,7 +659,7 @@ class AgentLogger:
                 md.append(f"### Step {action_num}: Tool Call - `{trace_item['name']}`\n")
                 md.append(f"**Timestamp**: {trace_item['timestamp']}\n")
                 if trace_item.get("arguments"):
-                    md.append(f"**Arguments**:\n```json\n{json.dumps(trace_item['arguments'], indent=2, ensure_ascii=False)}\n```\n")
+                    md.append(f"**Arguments**:\n```json\n{_pretty_json(trace_item['arguments'])}\n```\n")
             elif trace_item["type"] == "tool_result":
                 md.append(f"**Result**: `{trace_item['result_preview']}`\n")
                 md.append("")
@@ -470,8 +682,8 @@ class AgentLogger:
     
     def reset_trace(self):
         """Reset the execution trace for a new query."""
-        self.execution_trace = []
-        self.current_plan = []
+        self.execution_trace.clear()
+        self.current_plan.clear()
 
 WORKDIR = Path.cwd()
 LOG_DIR = setup_logging()
@@ -494,7 +706,7 @@ VALID_MSG_TYPES = {"message", "broadcast", "shutdown_request",
 
 
 def js(data):
-    print(json.dumps(data, indent=2, ensure_ascii=False, default=str), flush=True)
+    print(_pretty_json(data), flush=True)
 # === SECTION: base_tools ===
 def safe_path(p: str, allow_outside: bool = False) -> Path:
     """
@@ -506,21 +718,22 @@ def safe_path(p: str, allow_outside: bool = False) -> Path:
                        If False (default), restrict to WORKDIR for safety
     
     Returns:
-        Resolved Path object
+        Path object (resolved only when the workspace check applies)
     
     Raises:
         ValueError: If path escapes WORKDIR and allow_outside is False
     """
     # Handle absolute paths directly
-    if os.path.isabs(p):
-        path = Path(p).resolve()
-    else:
-        path = (WORKDIR / p).resolve()
+    path = Path(p) if os.path.isabs(p) else WORKDIR / p
+    
+    # No containment check needed: skip resolve() and its realpath() syscalls
+    if allow_outside or not WORKDIR:
+        return path
     
     # Only restrict paths if WORKDIR is set and allow_outside is False
-    if not allow_outside and WORKDIR:
-        if not path.is_relative_to(WORKDIR):
-            raise ValueError(f"Path escapes workspace: {p}")
+    path = path.resolve()
+    if not path.is_relative_to(WORKDIR):
+        raise ValueError(f"Path escapes workspace: {p}")
     return path
 
 def run_bash(command: str) -> str:
@@ -536,6 +749,31 @@ def run_bash(command: str) -> str:
         return "Error: Timeout (120s)"
 
 
+# Relative time expressions (Chinese and English), in priority order:
+# (group name, pattern, days limit, kind, day offset for kind == "date")
+#   date  -> replaced by the specific date
+#   week  -> replaced by "<Monday of this week>至今"
+#   month -> replaced by "<1st of this month>至今"
+#   range -> "<start date>至今" appended to the query
+# NOTE: No spaces around|in regex patterns!
+_TIME_PATTERNS = [
+    ("today", r'今天|今日|today|current date', 1, "date", 0),
+    ("yesterday", r'昨天|昨日|yesterday', 2, "date", 1),
+    ("day_before_yesterday", r'前天|the day before yesterday', 3, "date", 2),
+    ("last_3_days", r'最近三天|近三天|过去三天|last 3 days', 4, "range", None),
+    ("last_week", r'最近一周|近一周|过去一周|最近 7 天|近 7 天|last week|past week|recent week', 7, "week", None),
+    ("last_month", r'最近一个月|近一个月|过去一个月|最近 30 天|近 30 天|last month|past month|recent month', 30, "month", None),
+    ("recent", r'最近|近期|近来|近日|recent|recently|lately', 7, "range", None),
+    ("this_week", r'本周|这周|本星期|这个星期|this week', None, "week", None),
+    ("this_month", r'本月|这个月|当月|this month', None, "month", None),
+]
+# One combined pattern: a single scan of the query finds every expression
+_TIME_RE = re.compile("|".join(f"(?P<{name}>{rx})" for name, rx, _, _, _ in _TIME_PATTERNS), re.IGNORECASE)
+_TIME_PRIORITY = {name: i for i, (name, _, _, _, _) in enumerate(_TIME_PATTERNS)}
+_TIME_RULES = {name: (days, kind, offset) for name, _, days, kind, offset in _TIME_PATTERNS}
+_DATE_FMT = "%Y 年 %m 月 %d 日"
+
+
 def parse_relative_time(query: str) -> tuple[str, int|None]:
     """
     Parse relative time expressions in query and convert to specific dates.
@@ -559,61 +797,48 @@ def parse_relative_time(query: str) -> tuple[str, int|None]:
         - 本周/这周/this week -> days since Monday
         - 本月/这个月/this month -> days since 1st of month
     """
-    today = datetime.now()
-    days_limit = None
-    modified_query = query
-    date_str = today.strftime("%Y 年 %m 月 %d 日")
-    
-    # Patterns for relative time expressions (Chinese and English)
-    # NOTE: No spaces around|in regex patterns!
-    time_patterns = [
-        # Today - highest priority, most specific
-        (r'(今天|今日|今天|today|current date)', 1, date_str),
-        # Yesterday
-        (r'(昨天|昨日|yesterday)', 2, (today - timedelta(days=1)).strftime("%Y 年 %m 月 %d 日")),
-        # Day before yesterday
-        (r'(前天|the day before yesterday)', 3, (today - timedelta(days=2)).strftime("%Y 年 %m 月 %d 日")),
-        # Last 3 days
-        (r'(最近三天|近三天|过去三天|last 3 days)', 4, None),
-        # Last week / recent 7 days
-        (r'(最近一周|近一周|过去一周|最近 7 天|近 7 天|last week|past week|recent week)', 7, None),
-        # Last month / recent 30 days
-        (r'(最近一个月|近一个月|过去一个月|最近 30 天|近 30 天|last month|past month|recent month)', 30, None),
-        # Recent / lately (default 7 days)
-        (r'(最近|近期|近来|近日|recent|recently|lately)', 7, None),
-        # This week
-        (r'(本周|这周|本星期|这个星期|this week)', None, None),
-        # This month
-        (r'(本月|这个月|当月|this month)', None, None),
-    ]
-    
-    for pattern, days, specific_date in time_patterns:
-        match = re.search(pattern, query, re.IGNORECASE)
-        if match:
-            days_limit = days
-            if specific_date:
-                # Replace the relative time with specific date
-                modified_query = re.sub(pattern, f"{specific_date}", query, flags=re.IGNORECASE)
-            else:
-                # For week/month/recent, add date context to query
-                if 'week' in pattern or '周' in pattern or '星期' in pattern:
-                    # Calculate Monday of this week
-                    monday = today - timedelta(days=today.weekday())
-                    date_context = f"{monday.strftime('%Y 年 %m 月 %d 日')}至今"
-                    modified_query = re.sub(pattern, f"{date_context}", query, flags=re.IGNORECASE)
-                elif 'month' in pattern or '月' in pattern:
-                    # First day of this month
-                    first_day = today.replace(day=1)
-                    date_context = f"{first_day.strftime('%Y 年 %m 月 %d 日')}至今"
-                    modified_query = re.sub(pattern, f"{date_context}", query, flags=re.IGNORECASE)
-                elif days is not None:
-                    # For "recent" type queries, append date range context to query with space
-                    start_date = today - timedelta(days=days)
-                    date_context = f"{start_date.strftime('%Y 年 %m 月 %d 日')}至今"
-                    modified_query = f"{query} {date_context}"
-            break  # Use the first (highest priority) match
-    
-    return modified_query, days_limit
+    # The result only depends on the query and the calendar day, so cache per day
+    return _parse_relative_time(query, date.today())
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_relative_time(query: str, today: date) -> tuple[str, int|None]:
+    """Cached implementation of parse_relative_time for a given day."""
+    matches = list(_TIME_RE.finditer(query))
+    if not matches:
+        return query, None
+    
+    # Use the highest-priority expression found in the query
+    name = min((m.lastgroup for m in matches), key=_TIME_PRIORITY.__getitem__)
+    days_limit, kind, offset = _TIME_RULES[name]
+    
+    if kind == "range":
+        # For "recent" type queries, append date range context to query with space
+        start_date = today - timedelta(days=days_limit)
+        return f"{query} {start_date.strftime(_DATE_FMT)}至今", days_limit
+    
+    if kind == "date":
+        # Replace the relative time with specific date
+        replacement = (today - timedelta(days=offset)).strftime(_DATE_FMT)
+    elif kind == "week":
+        # Calculate Monday of this week
+        monday = today - timedelta(days=today.weekday())
+        replacement = f"{monday.strftime(_DATE_FMT)}至今"
+    else:
+        # First day of this month
+        first_day = today.replace(day=1)
+        replacement = f"{first_day.strftime(_DATE_FMT)}至今"
+    
+    # Replace every occurrence of the chosen expression, slicing around the matches
+    parts = []
+    pos = 0
+    for m in matches:
+        if m.lastgroup == name:
+            parts.append(query[pos:m.start()])
+            parts.append(replacement)
+            pos = m.end()
+    parts.append(query[pos:])
+    return "".join(parts), days_limit
 
 
 def rewrite_query(query: str) -> list[str]:
@@ -1019,7 +1244,7 @@ def run_tavily_search(query: str, search_depth: str = "basic", max_results: int
             include_answer
         )
         
-        # Format output
+        # Format output (compact JSON: fewer tokens for the model)
         output = {
             "queries_used": result["queries_used"],
             "answer": result["answers"][0] if result["answers"] else "",
@@ -1027,7 +1252,7 @@ def run_tavily_search(query: str, search_depth: str = "basic", max_results: int
             "results": result["results"]
         }
         
-        return json_module.dumps(output, indent=2, ensure_ascii=False)
+        return _dumps(output)
     except Exception as e:
         return f"Error: {str(e)}"
 
@@ -1069,7 +1294,7 @@ def run_tavily_news(query: str, max_results: int = 5, days: int = 7) -> str:
             "results": result["results"]
         }
         
-        return json_module.dumps(output, indent=2, ensure_ascii=False)
+        return _dumps(output)
     except Exception as e:
         return f"Error: {str(e)}"
 
@@ -1080,7 +1305,7 @@ def run_tavily_fact_check(claim: str) -> str:
         return "Error: claim is required"
     try:
         result = tavily_client.fact_check(claim)
-        return json_module.dumps(result, indent=2, ensure_ascii=False)
+        return _dumps(result)
     except Exception as e:
         return f"Error: {str(e)}"
 
@@ -1089,9 +1314,37 @@ def run_tavily_fact_check(claim: str) -> str:
 def run_read(path: str, limit: int = None) -> str:
     try:
         # Allow reading files outside WORKDIR (reading is safe)
-        lines = safe_path(path, allow_outside=True).read_text(encoding='utf-8').splitlines()
-        if limit and limit < len(lines):
-            lines = lines[:limit] + [f"... ({len(lines) - limit} more)"]
+        fp = safe_path(path, allow_outside=True)
+        if not limit:
+            # Read only as much as the 50000-char output needs, not the whole file
+            with open(fp, encoding='utf-8', newline='') as f:
+                text = ""
+                while True:
+                    chunk = f.read(1 << 16)
+                    text += chunk
+                    out = "\n".join(text.splitlines())
+                    if not chunk or len(out) >= 50000:
+                        return out[:50000]
+        
+        # Universal newlines: \r\n and bare \r come through as \n, like splitlines()
+        with open(fp, encoding='utf-8') as f:
+            lines = []
+            size = 0
+            for line in itertools.islice(f, limit):
+                lines.append(line.rstrip("\n"))
+                size += len(lines[-1]) + 1
+                if size > 50000:
+                    # Output is cut at 50000 chars anyway, so the "(N more)" note would not survive
+                    return "\n".join(lines)[:50000]
+            # Count the remaining lines chunk by chunk without keeping them
+            more, last = 0, ""
+            for chunk in iter(lambda: f.read(1 << 20), ""):
+                more += chunk.count("\n")
+                last = chunk
+            if last and not last.endswith("\n"):
+                more += 1
+        if more:
+            lines.append(f"... ({more} more)")
         return "\n".join(lines)[:50000]
     except Exception as e:
         return f"Error: {e}"
@@ -1214,6 +1467,44 @@ class TodoManager:
 
 
 # === SECTION: subagent (s04) ===
+# Subagent tools that only read; consecutive calls to them may run concurrently.
+# bash is excluded: a command can write, and successive ones often depend on each other
+_PARALLEL_SAFE_TOOLS = {"read_file"}
+
+
+def _run_tool_blocks(blocks: list, run_one, parallel_safe, max_workers: int = 4) -> list:
+    """
+    Apply run_one to each tool_use block and return the results in the original order.
+    
+    Each stretch of consecutive calls to tools in parallel_safe is dispatched to a
+    thread pool so its wall-clock time is the slowest call rather than the sum;
+    any other tool runs on its own and acts as an ordering barrier.
+    """
+    outputs = []
+    start = 0
+    while start < len(blocks):
+        end = start
+        while end < len(blocks) and blocks[end].name in parallel_safe:
+            end += 1
+        if end - start > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, end - start)) as ex:
+                outputs.extend(ex.map(run_one, blocks[start:end]))
+            start = end
+        else:
+            outputs.append(run_one(blocks[start]))
+            start += 1
+    return outputs
+
+
+def _run_subagent_tools(blocks: list, handlers: dict) -> List[str]:
+    """Run a subagent's tool_use blocks; read_file stretches run concurrently."""
+    def run_one(b):
+        h = handlers.get(b.name, lambda kw: "Unknown tool")
+        return str(h(b.input))[:50000]
+    
+    return _run_tool_blocks(blocks, run_one, _PARALLEL_SAFE_TOOLS)
+
+
 def run_subagent(prompt: str, agent_type: str = "Explore") -> str:
     """
     Run a subagent for isolated exploration or work.
@@ -1233,10 +1524,10 @@ def run_subagent(prompt: str, agent_type: str = "Explore") -> str:
              "input_schema": {"type": "object", "properties": {"path": {"type": "string"}, "old_text": {"type": "string"}, "new_text": {"type": "string"}}, "required": ["path", "old_text", "new_text"]}},
         ]
     sub_handlers = {
-        "bash": lambda **kw: run_bash(kw["command"]),
-        "read_file": lambda **kw: run_read(kw["path"]),
-        "write_file": lambda **kw: run_write(kw["path"], kw["content"]),
-        "edit_file": lambda **kw: run_edit(kw["path"], kw["old_text"], kw["new_text"]),
+        "bash": lambda kw: run_bash(kw["command"]),
+        "read_file": lambda kw: run_read(kw["path"]),
+        "write_file": lambda kw: run_write(kw["path"], kw["content"]),
+        "edit_file": lambda kw: run_edit(kw["path"], kw["old_text"], kw["new_text"]),
     }
     sub_msgs = [{"role": "user", "content": prompt}]
     resp = None
@@ -1253,14 +1544,13 @@ def run_subagent(prompt: str, agent_type: str = "Explore") -> str:
         if resp.stop_reason != "tool_use":
             break
         results = []
-        for b in resp.content:
-            if b.type == "tool_use":
-                h = sub_handlers.get(b.name, lambda **kw: "Unknown tool")
-                result_str = str(h(**b.input))[:50000]
-                results.append({"type": "tool_result", "tool_use_id": b.id, "content": result_str})
-                # Log tool result
-                logger.log_tool_result(b.name, result_str)
+        tool_blocks = [b for b in resp.content if b.type == "tool_use"]
+        for b, result_str in zip(tool_blocks, _run_subagent_tools(tool_blocks, sub_handlers)):
+            results.append({"type": "tool_result", "tool_use_id": b.id, "content": result_str})
+            # Log tool result
+            logger.log_tool_result(b.name, result_str)
         sub_msgs.append({"role": "user", "content": results})
+    logger.close()
     if resp:
         return "".join(b.text for b in resp.content if hasattr(b, "text")) or "(no summary)"
     return "(subagent failed)"
@@ -1269,31 +1559,59 @@ class SkillLoader:
     def __init__(self, skills_dir: Path):
         self.skills_dir = skills_dir
         self.skills = {}
+        self._descriptions = None  # memoized descriptions(); reset whenever skills are (re)loaded
         self._load_all()
 
     def _load_all(self):
+        self._descriptions = None
         #for f in sorted(self.skills_dir.glob("*.md")):
-        for _dir in sorted(glob(f"{self.skills_dir}/*")):
-            for f in glob(f'{_dir}/*.md'):
-                name = Path(f.rsplit('/', 1)[0]).stem
-                text = Path(f).read_text(encoding='utf-8')
-                meta, body = self._parse_frontmatter(text)
-                self.skills[name] = {"meta": meta, "body": body, "path": str(f)}
+        # One glob over <skills_dir>/<skill>/*.md, ordered by skill directory.
+        # Not rglob: nested reference docs (e.g. mcp-builder/reference/*.md) are not skills.
+        paths = sorted(glob(f"{self.skills_dir}/*/*.md"), key=os.path.dirname)
+        if not paths:
+            return
+        # Only the frontmatter is read here; the body is loaded on first use.
+        # The reads are independent and release the GIL, so fan them out over a thread pool.
+        with ThreadPoolExecutor(max_workers=min(8, len(paths))) as ex:
+            metas = list(ex.map(self._read_meta, paths))
+        for f, meta in zip(paths, metas):
+            name = Path(f.rsplit('/', 1)[0]).stem
+            self.skills[name] = {"meta": meta, "body": None, "path": str(f)}
+
+    def _read_meta(self, path: str, chunk_size: int = 4096) -> dict:
+        """Read the file head in chunks up to the closing --- and parse the frontmatter."""
+        with open(path, "rb") as fp:
+            head = fp.read(chunk_size)
+            if not head.startswith(b"---\n"):
+                return {}
+            # The closing \n---\n may straddle chunks; keep reading until it shows up
+            while (end := head.find(b"\n---\n", 4)) < 0:
+                chunk = fp.read(chunk_size)
+                if not chunk:
+                    return {}
+                head += chunk
+        return self._parse_meta(head[4:end].decode("utf-8"))
+
+    def _parse_meta(self, block: str) -> dict:
+        """Parse key: value lines of a frontmatter block."""
+        meta = {}
+        for line in block.strip().splitlines():
+            if ":" in line:
+                key, val = line.split(":", 1)
+                meta[key.strip()] = val.strip()
+        return meta
 
     def _parse_frontmatter(self, text: str) -> tuple:
         """Parse YAML frontmatter between --- delimiters."""
         match = re.match(r"^---\n(.*?)\n---\n(.*)", text, re.DOTALL)
         if not match:
             return {}, text
-        meta = {}
-        for line in match.group(1).strip().splitlines():
-            if ":" in line:
-                key, val = line.split(":", 1)
-                meta[key.strip()] = val.strip()
-        return meta, match.group(2).strip()
+        return self._parse_meta(match.group(1)), match.group(2).strip()
 
     def descriptions(self) -> str:
         """Layer 1: short descriptions for the system prompt."""
+        if self._descriptions is not None:
+            return self._descriptions
         if not self.skills:
             return "(no skills available)"
         lines = []
@@ -1304,40 +1622,166 @@ class SkillLoader:
             if tags:
                 line += f" [{tags}]"
             lines.append(line)
-        return "\n".join(lines)
+        self._descriptions = "\n".join(lines)
+        return self._descriptions
 
     def load(self, name: str) -> str:
         """Layer 2: full skill body returned in tool_result."""
         skill = self.skills.get(name)
         if not skill:
             return f"Error: Unknown skill '{name}'. Available: {', '.join(self.skills.keys())}"
+        if skill["body"] is None:
+            text = Path(skill["path"]).read_text(encoding='utf-8')
+            skill["body"] = self._parse_frontmatter(text)[1]
         return f"<skill name=\"{name}\">\n{skill['body']}\n</skill>"
 
 
 # === SECTION: compression (s06) ===
+# id(message) -> (message, tokens). The message itself is kept so a recycled id is
+# detected with an identity check. Messages are append-only between compactions;
+# code that edits a counted message calls _retoken() and auto_compact resets both.
+_TOKEN_CACHE: Dict[int, tuple] = {}
+# Running total for the history last passed to estimate_tokens: [list, messages counted, tokens]
+_TOKEN_RUN = [None, 0, 0.0]
+
+
 def estimate_tokens(messages: list) -> int:
-    return len(json.dumps(messages, default=str)) // 4
+    """Rough token count from a walk over the message structure.
+    
+    Sums per-string estimates directly instead of serializing the whole history to JSON.
+    Keeps a running total, so each turn only measures the newly appended messages.
+    """
+    run_list, counted, total = _TOKEN_RUN
+    if run_list is not messages or counted > len(messages):
+        counted, total = 0, 0.0
+    for msg in itertools.islice(messages, counted, None):
+        entry = _TOKEN_CACHE.get(id(msg))
+        if entry is None or entry[0] is not msg:
+            entry = _TOKEN_CACHE[id(msg)] = (msg, _message_tokens(msg))
+        total += entry[1]
+    _TOKEN_RUN[:] = [messages, len(messages), total]
+    return int(total)
+
+
+def _retoken(msg: dict):
+    """Re-measure a message edited in place and fold the change into the running total."""
+    entry = _TOKEN_CACHE.get(id(msg))
+    if entry is None or entry[0] is not msg:
+        return  # not counted yet; measured when estimate_tokens reaches it
+    tokens = _message_tokens(msg)
+    _TOKEN_CACHE[id(msg)] = (msg, tokens)
+    _TOKEN_RUN[2] += tokens - entry[1]
+
+
+def _reset_token_count():
+    _TOKEN_CACHE.clear()
+    _TOKEN_RUN[:] = [None, 0, 0.0]
+
+
+# Per-character token ratios by script: CJK ideographs 0.55, digits 0.4, other ASCII 0.25;
+# remaining non-ASCII text is counted as 0.25 per UTF-8 byte
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+_DROP_DIGITS = str.maketrans("", "", "0123456789")
+
+
+def _text_tokens(s: str) -> float:
+    # Counting through translate/sub/encode keeps the per-character work in C
+    n = len(s)
+    digits = n - len(s.translate(_DROP_DIGITS))
+    if s.isascii():
+        return n * 0.25 + digits * 0.15
+    cjk = n - len(_CJK_RE.sub("", s))
+    other_bytes = len(s.encode("utf-8")) - 3 * cjk
+    return cjk * 0.55 + other_bytes * 0.25 + digits * 0.15
+
+
+def _message_tokens(message) -> float:
+    total = 0.0
+    stack = [message]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, dict):
+            for k, v in x.items():
+                total += len(k) * 0.25 if isinstance(k, str) else 0
+                stack.append(v)
+            continue
+        if isinstance(x, (list, tuple)):
+            stack.extend(x)
+            continue
+        total += _text_tokens(x if isinstance(x, str) else str(x))
+    return total
+
+# id(message) -> message for messages already behind the newest three tool results,
+# i.e. fully handled by microcompact; reset together with the token count
+_MICROCOMPACTED: Dict[int, dict] = {}
+
 
 def microcompact(messages: list):
-    indices = []
-    for i, msg in enumerate(messages):
-        if msg["role"] == "user" and isinstance(msg.get("content"), list):
-            for part in msg["content"]:
-                if isinstance(part, dict) and part.get("type") == "tool_result":
-                    indices.append(part)
-    if len(indices) <= 3:
-        return
-    for part in indices[:-3]:
-        if isinstance(part.get("content"), str) and len(part["content"]) > 100:
-            part["content"] = "[cleared]"
+    """Clear long tool results except the newest three.
 
-def auto_compact(messages: list) -> list:
-    TRANSCRIPT_DIR.mkdir(exist_ok=True)
-    path = TRANSCRIPT_DIR / f"transcript_{int(time.time())}.jsonl"
-    with open(path, "w", encoding='utf-8') as f:
-        for msg in messages:
-            f.write(json.dumps(msg, default=str, ensure_ascii=False) + "\n")
-    conv_text = json.dumps(messages, default=str, ensure_ascii=False)[:80000]
+    Walks back from the end and stops at the first message a previous call already
+    handled; the history is append-only, so everything before it is done too.
+    """
+    seen = 0  # tool results passed so far, newest first
+    for msg in reversed(messages):
+        if _MICROCOMPACTED.get(id(msg)) is msg:
+            break
+        behind_window = seen >= 3
+        content = msg.get("content")
+        if msg["role"] == "user" and isinstance(content, list):
+            cleared = False
+            for part in reversed(content):
+                if not (isinstance(part, dict) and part.get("type") == "tool_result"):
+                    continue
+                seen += 1
+                if seen > 3 and isinstance(part.get("content"), str) and len(part["content"]) > 100:
+                    part["content"] = "[cleared]"
+                    cleared = True
+            if cleared:
+                _retoken(msg)
+        if behind_window:
+            _MICROCOMPACTED[id(msg)] = msg
+
+# auto_compact keeps up to this many recent messages verbatim, within a quarter of
+# TOKEN_THRESHOLD, and summarizes only what comes before them
+COMPACT_KEEP_RECENT = 12
+
+
+def _recent_window_start(messages: list) -> int:
+    """Index where the verbatim tail kept by auto_compact begins (len(messages) if none).
+
+    The tail must start at an assistant message: a user message there could hold
+    tool_results whose tool_use calls were summarized away.
+    """
+    budget = TOKEN_THRESHOLD // 4
+    start = len(messages)
+    while start > 0 and len(messages) - start < COMPACT_KEEP_RECENT:
+        budget -= _message_tokens(messages[start - 1])
+        if budget < 0:
+            break
+        start -= 1
+    while start < len(messages) and messages[start]["role"] != "assistant":
+        start += 1
+    return start
+
+
+def _first_user_text(messages: list, limit: int = 2000) -> str:
+    for msg in messages:
+        if msg["role"] == "user":
+            return extract_text_from_content(msg["content"])[:limit]
+    return ""
+
+
+# Summaries keyed by a hash of the summarizer input, so compacting an unchanged
+# history again (e.g. /compact right after an auto-compact) skips the LLM call
+_SUMMARY_CACHE = TTLCache(maxsize=64, ttl=3600)
+
+
+def _summarize(conv_text: str) -> str:
+    key = hashlib.sha1(f"{MODEL}\0{conv_text}".encode("utf-8")).hexdigest()
+    summary = _SUMMARY_CACHE.get(key)
+    if summary is not None:
+        return summary
     resp = client.messages.create(
         model=MODEL,
         messages=[{"role": "user", "content": f"Summarize for continuity:\n{conv_text}"}],
@@ -1347,62 +1791,229 @@ def auto_compact(messages: list) -> list:
         summary = resp.content[0].text
     else:
         summary = str(resp.content[0])
+    _SUMMARY_CACHE.set(key, summary)
+    return summary
 
-    return [
-        {"role": "user", "content": f"[Compressed. Transcript: {path}]\n{summary}"},
-        {"role": "assistant", "content": "Understood. Continuing with summary context."},
-    ]
+
+def auto_compact(messages: list):
+    """Summarize the history into one user message, in place.
+
+    The original request (the first user message) is repeated verbatim ahead of the
+    summary, and the most recent messages are kept as they are after it, so the
+    conversation resumes with its opening goal and the latest exchanges intact.
+    """
+    TRANSCRIPT_DIR.mkdir(exist_ok=True)
+    path = TRANSCRIPT_DIR / f"transcript_{int(time.time())}.jsonl"
+    keep_from = _recent_window_start(messages)
+    # Serialize each message once: the same string goes to the transcript and,
+    # until 80k chars are collected, to the summarizer's input
+    conv_parts = []
+    conv_len = 0
+    with open(path, "w", encoding='utf-8') as f:
+        for i, msg in enumerate(messages):
+            line = _dumps(msg)
+            f.write(line + "\n")
+            if i < keep_from and conv_len < 80000:
+                conv_parts.append(line)
+                conv_len += len(line) + 2
+    # Laid out like a JSON list of the messages
+    conv_text = ("[" + ", ".join(conv_parts) + "]")[:80000]
+    summary = _summarize(conv_text)
+
+    _reset_token_count()
+    _MICROCOMPACTED.clear()
+    head = {"role": "user", "content": (
+        f"[Compressed. Transcript: {path}]\n"
+        f"<original-request>\n{_first_user_text(messages)}\n</original-request>\n{summary}")}
+    # Splice the summary over the summarized prefix; the kept tail is only shifted down
+    if keep_from < len(messages):
+        messages[:keep_from] = [head]
+    else:
+        messages[:] = [head, {"role": "assistant", "content": "Understood. Continuing with summary context."}]
 
 
 # === SECTION: file_tasks (s07) ===
+def _atomic_write(path: Path, data: bytes):
+    """Replace path with data via a temp file and rename, so readers never see a torn file.
+
+    No fsync: task and team state is rewritten on every change, so the rename's
+    crash atomicity is enough and the flush cost is not worth paying per save.
+    """
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _atomic_create(path: Path, data: bytes):
+    """Like _atomic_write, but raise FileExistsError instead of replacing an existing file.
+
+    The complete temp file is hard-linked into place, which fails atomically if path exists.
+    """
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    try:
+        os.link(tmp, path)
+    finally:
+        tmp.unlink()
+
+
+def _iter_task_files():
+    """Yield (tid, DirEntry) for each task_<id>.json; DirEntry caches its stat()."""
+    with os.scandir(TASKS_DIR) as it:
+        for entry in it:
+            name = entry.name
+            if name.startswith("task_") and name.endswith(".json") and name[5:-5].isdigit():
+                yield int(name[5:-5]), entry
+
+
+def _read_file_bytes(path, size_hint: int) -> bytes:
+    """Read a small file with raw os.read calls, sized from an already known stat."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunks = []
+        while True:
+            chunk = os.read(fd, max(size_hint, 4096) + 1)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+
+
+def _extend_unique(items: list, new: list):
+    """Append the entries of new not already in items, in order, in place."""
+    seen = set(items)
+    for x in new:
+        if x not in seen:
+            seen.add(x)
+            items.append(x)
+
+
 class TaskManager:
+    LOCK_STRIPES = 16
+
     def __init__(self):
         TASKS_DIR.mkdir(exist_ok=True)
+        # Scan the directory once; afterwards ids are handed out from the counter,
+        # which is re-seeded when TASKS_DIR changes (WORKDIR switched)
+        self._id_lock = threading.Lock()
+        self._id_dir = TASKS_DIR
+        self._last_id = max((tid for tid, _ in _iter_task_files()), default=0)
+        # Parsed tasks keyed by id, revalidated by file mtime in _scan()
+        self._cache: Dict[int, tuple] = {}
+        self._cache_dir = TASKS_DIR
+        self._cache_lock = threading.Lock()
+        # blocker id -> ids of tasks listing it in blockedBy; rebuilt lazily after cache changes
+        self._rev_blocks: Dict[int, set] = None
+        # Striped locks serializing read-modify-write per task; tasks in different
+        # stripes update concurrently
+        self._task_locks = tuple(threading.Lock() for _ in range(self.LOCK_STRIPES))
+        # Called after each task write (set by TeammateManager to wake idle teammates)
+        self.on_save = None
+
+    def _task_lock(self, tid: int) -> threading.Lock:
+        return self._task_locks[tid % self.LOCK_STRIPES]
 
     def _next_id(self) -> int:
-        ids = [int(f.stem.split("_")[1]) for f in TASKS_DIR.glob("task_*.json")]
-        return max(ids, default=0) + 1
+        with self._id_lock:
+            if self._id_dir != TASKS_DIR:  # WORKDIR was switched
+                self._id_dir = TASKS_DIR
+                self._last_id = max((tid for tid, _ in _iter_task_files()), default=0)
+            self._last_id += 1
+            return self._last_id
 
     def _load(self, tid: int) -> dict:
         p = TASKS_DIR / f"task_{tid}.json"
         if not p.exists(): raise ValueError(f"Task {tid} not found")
-        return json.loads(p.read_text(encoding='utf-8'))
-
-    def _save(self, task: dict):
-        (TASKS_DIR / f"task_{task['id']}.json").write_text(json.dumps(task, indent=2, ensure_ascii=False), encoding='utf-8')
+        return _loads(p.read_bytes())
+
+    def _save(self, task: dict, create: bool = False):
+        """Write a task; with create=True raise FileExistsError rather than overwrite."""
+        p = TASKS_DIR / f"task_{task['id']}.json"
+        # Compact on disk; get() pretty-prints for display
+        (_atomic_create if create else _atomic_write)(p, _dumps_bytes(task))
+        with self._cache_lock:
+            if self._cache_dir == TASKS_DIR:
+                self._cache[task["id"]] = (p.stat().st_mtime_ns, task)
+                self._rev_blocks = None
+        if self.on_save: self.on_save()
+
+    def _scan(self) -> List[dict]:
+        """Return all tasks sorted by id, re-parsing only files whose mtime changed."""
+        with self._cache_lock:
+            if self._cache_dir != TASKS_DIR:  # WORKDIR was switched
+                self._cache.clear()
+                self._cache_dir = TASKS_DIR
+                self._rev_blocks = None
+            seen = set()
+            for tid, entry in _iter_task_files():
+                seen.add(tid)
+                st = entry.stat()
+                cached = self._cache.get(tid)
+                if cached is None or cached[0] != st.st_mtime_ns:
+                    self._cache[tid] = (st.st_mtime_ns, _loads(_read_file_bytes(entry.path, st.st_size)))
+                    self._rev_blocks = None
+            for tid in self._cache.keys() - seen:
+                del self._cache[tid]
+                self._rev_blocks = None
+            return [self._cache[tid][1] for tid in sorted(self._cache)]
+
+    def _dependents(self, tid: int) -> List[dict]:
+        """Tasks whose blockedBy contains tid, via the reverse index."""
+        self._scan()
+        with self._cache_lock:
+            if self._rev_blocks is None:
+                rev: Dict[int, set] = {}
+                for dep_id, (_, t) in self._cache.items():
+                    for blocker in t.get("blockedBy", ()):
+                        rev.setdefault(blocker, set()).add(dep_id)
+                self._rev_blocks = rev
+            return [self._cache[d][1] for d in sorted(self._rev_blocks.get(tid, ()))]
 
     def create(self, subject: str, description: str = "") -> str:
-        task = {"id": self._next_id(), "subject": subject, "description": description,
-                "status": "pending", "owner": None, "blockedBy": [], "blocks": []}
-        self._save(task)
-        return json.dumps(task, indent=2, ensure_ascii=False)
+        while True:
+            task = {"id": self._next_id(), "subject": subject, "description": description,
+                    "status": "pending", "owner": None, "blockedBy": [], "blocks": []}
+            try:
+                self._save(task, create=True)
+                break
+            except FileExistsError:
+                continue  # id already taken on disk (e.g. by another process); try the next one
+        return _dumps(task)
 
     def get(self, tid: int) -> str:
-        return json.dumps(self._load(tid), indent=2, ensure_ascii=False)
+        return _pretty_json(self._load(tid))
 
     def update(self, tid: int, status: str = None,
                add_blocked_by: list = None, add_blocks: list = None) -> str:
-        task = self._load(tid)
-        if status:
-            task["status"] = status
-            if status == "completed":
-                for f in TASKS_DIR.glob("task_*.json"):
-                    t = json.loads(f.read_text(encoding='utf-8'))
-                    if tid in t.get("blockedBy", []):
-                        t["blockedBy"].remove(tid)
-                        self._save(t)
-            if status == "deleted":
-                (TASKS_DIR / f"task_{tid}.json").unlink(missing_ok=True)
-                return f"Task {tid} deleted"
-        if add_blocked_by:
-            task["blockedBy"] = list(set(task["blockedBy"] + add_blocked_by))
-        if add_blocks:
-            task["blocks"] = list(set(task["blocks"] + add_blocks))
-        self._save(task)
-        return json.dumps(task, indent=2, ensure_ascii=False)
+        with self._task_lock(tid):
+            task = self._load(tid)
+            if status:
+                task["status"] = status
+                if status == "deleted":
+                    (TASKS_DIR / f"task_{tid}.json").unlink(missing_ok=True)
+                    with self._cache_lock:
+                        self._cache.pop(tid, None)
+                        self._rev_blocks = None
+                    return f"Task {tid} deleted"
+            if add_blocked_by:
+                _extend_unique(task["blockedBy"], add_blocked_by)
+            if add_blocks:
+                _extend_unique(task["blocks"], add_blocks)
+            self._save(task)
+        if status == "completed":
+            # One task lock at a time, and re-read under it: the cached copy may predate
+            # a concurrent claim/update of the dependent
+            for dep_id in [t["id"] for t in self._dependents(tid)]:
+                with self._task_lock(dep_id):
+                    dep = self._load(dep_id)
+                    if tid in dep.get("blockedBy", []):
+                        dep["blockedBy"].remove(tid)
+                        self._save(dep)
+        return _dumps(task)
 
     def list_all(self) -> str:
-        tasks = [json.loads(f.read_text(encoding='utf-8')) for f in sorted(TASKS_DIR.glob("task_*.json"))]
+        tasks = self._scan()
         if not tasks: return "No tasks."
         lines = []
         for t in tasks:
@@ -1412,15 +2023,125 @@ class TaskManager:
             lines.append(f"{m} #{t['id']}: {t['subject']}{owner}{blocked}")
         return "\n".join(lines)
 
+    def try_claim(self, tid: int, owner: str) -> str:
+        """Claim a pending, unowned task; return None on success, else why it was refused.
+
+        The check and the write happen under the task's lock, so of several concurrent
+        claimers exactly one wins.
+        """
+        with self._task_lock(tid):
+            task = self._load(tid)
+            if task.get("owner"):
+                return f"Task #{tid} is already owned by {task['owner']}"
+            if task.get("status") != "pending":
+                return f"Task #{tid} is {task.get('status')}, not pending"
+            task["owner"] = owner
+            task["status"] = "in_progress"
+            self._save(task)
+        return None
+
     def claim(self, tid: int, owner: str) -> str:
-        task = self._load(tid)
-        task["owner"] = owner
-        task["status"] = "in_progress"
-        self._save(task)
+        refused = self.try_claim(tid, owner)
+        if refused:
+            return f"Error: {refused}"
         return f"Claimed task #{tid} for {owner}"
 
 
 # === SECTION: background (s08) ===
+class PersistentShell:
+    """A long-lived bash that runs commands sent over stdin, avoiding a fork+exec of
+    /bin/sh per command. Each command runs in a ( ) subshell so cd/exports/exit do not
+    leak, and is followed by per-call sentinels on stdout and stderr marking its end.
+    Not thread-safe: use one instance per thread.
+
+    Output is collected up to the sentinel rather than EOF, so a background child that
+    outlives its command would write into the next command's result; such commands
+    (see _LEAVES_CHILDREN_RE) go through subprocess.run instead.
+    """
+
+    def __init__(self):
+        self.proc = None
+
+    def _start(self):
+        self.proc = subprocess.Popen(
+            ["bash", "--noprofile", "--norc"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, bufsize=0, start_new_session=True)
+
+    def _kill(self):
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.proc.wait()
+        self.proc = None
+
+    def run(self, command: str, timeout: float) -> str:
+        """Run command in cwd=WORKDIR; return stdout followed by stderr, like subprocess.run."""
+        if self.proc is None or self.proc.poll() is not None:
+            self._start()
+        sentinel = f"__END_{uuid.uuid4().hex}__"
+        # eval keeps syntax errors (e.g. an unclosed quote) inside the subshell instead of
+        # swallowing the sentinel lines that follow
+        script = (f"cd {shlex.quote(str(WORKDIR))} && ( eval {shlex.quote(command)} ) </dev/null\n"
+                  f"printf '\\n%s\\n' {sentinel}; printf '\\n%s\\n' {sentinel} >&2\n")
+        marker = f"\n{sentinel}\n".encode()
+        bufs = {self.proc.stdout.fileno(): bytearray(), self.proc.stderr.fileno(): bytearray()}
+        pending = set(bufs)
+        died = False
+        deadline = time.monotonic() + timeout
+        try:
+            self.proc.stdin.write(script.encode("utf-8"))
+        except BrokenPipeError:
+            self._kill()
+            raise
+        with selectors.DefaultSelector() as sel:
+            for fd in bufs:
+                sel.register(fd, selectors.EVENT_READ)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._kill()
+                    raise subprocess.TimeoutExpired(command, timeout)
+                for key, _ in sel.select(remaining):
+                    chunk = os.read(key.fd, 65536)
+                    buf = bufs[key.fd]
+                    if not chunk:  # shell died mid-command
+                        died = True
+                        sel.unregister(key.fd)
+                        pending.discard(key.fd)
+                        continue
+                    start = max(0, len(buf) - len(marker))
+                    buf += chunk
+                    idx = buf.find(marker, start)
+                    if idx >= 0:
+                        del buf[idx:]
+                        sel.unregister(key.fd)
+                        pending.discard(key.fd)
+        if died:
+            self._kill()
+        out, err = bufs.values()
+        return out.decode("utf-8", "replace") + err.decode("utf-8", "replace")
+
+
+HAS_BASH = shutil.which("bash") is not None
+_BG_SHELLS = threading.local()
+# Commands that may leave children holding the output pipes: a lone "&" (not &&, >&, &>,
+# |&) or nohup/setsid/disown/coproc. Errs on the side of matching (e.g. "&" in quotes).
+_LEAVES_CHILDREN_RE = re.compile(r"(?<![&|<>])&(?![&>])|\b(?:nohup|setsid|disown|coproc)\b")
+
+
+def _run_in_worker_shell(command: str, timeout: float) -> str:
+    """Run command in the calling worker thread's PersistentShell (created on first use)."""
+    sh = getattr(_BG_SHELLS, "shell", None)
+    if sh is None:
+        sh = _BG_SHELLS.shell = PersistentShell()
+    return sh.run(command, timeout)
+
+
+# Shared worker threads for background commands; extra submissions wait as "queued"
+BG_POOL = ThreadPoolExecutor(max_workers=max(4, (os.cpu_count() or 1) * 2), thread_name_prefix="bg")
+
+
 class BackgroundManager:
     def __init__(self):
         self.tasks = {}
@@ -1428,15 +2149,20 @@ class BackgroundManager:
 
     def run(self, command: str, timeout: int = 120) -> str:
         tid = str(uuid.uuid4())[:8]
-        self.tasks[tid] = {"status": "running", "command": command, "result": None}
-        threading.Thread(target=self._exec, args=(tid, command, timeout), daemon=True).start()
+        self.tasks[tid] = {"status": "queued", "command": command, "result": None}
+        BG_POOL.submit(self._exec, tid, command, timeout)
         return f"Background task {tid} started: {command[:80]}"
 
     def _exec(self, tid: str, command: str, timeout: int):
+        self.tasks[tid]["status"] = "running"
         try:
-            r = subprocess.run(command, shell=True, cwd=WORKDIR,
-                               capture_output=True, text=True, timeout=timeout)
-            output = (r.stdout + r.stderr).strip()[:50000]
+            if HAS_BASH and not _LEAVES_CHILDREN_RE.search(command):
+                output = _run_in_worker_shell(command, timeout)
+            else:
+                r = subprocess.run(command, shell=True, cwd=WORKDIR,
+                                   capture_output=True, text=True, timeout=timeout)
+                output = r.stdout + r.stderr
+            output = output.strip()[:50000]
             self.tasks[tid].update({"status": "completed", "result": output or "(no output)"})
         except Exception as e:
             self.tasks[tid].update({"status": "error", "result": str(e)})
@@ -1449,41 +2175,131 @@ class BackgroundManager:
             return f"[{t['status']}] {t.get('result', '(running)')}" if t else f"Unknown: {tid}"
         return "\n".join(f"{k}: [{v['status']}] {v['command'][:60]}" for k, v in self.tasks.items()) or "No bg tasks."
 
-    def drain(self) -> list:
-        notifs = []
-        while not self.notifications.empty():
-            notifs.append(self.notifications.get_nowait())
+    def pending(self) -> bool:
+        """Cheap unlocked check for undelivered notifications (a deque truth test)."""
+        return bool(self.notifications.queue)
+
+    def drain(self, limit: int = None) -> list:
+        # Take up to limit items under one acquire of the queue's lock instead of one get() per item
+        q = self.notifications
+        with q.mutex:
+            if limit is None or len(q.queue) <= limit:
+                notifs = list(q.queue)
+                q.queue.clear()
+            else:
+                notifs = [q.queue.popleft() for _ in range(limit)]
         return notifs
 
 
 # === SECTION: messaging (s09) ===
 class MessageBus:
+    # Once this many consumed bytes pile up and the reader has caught up, the inbox is truncated
+    TRIM_BYTES = 1 << 20
+
     def __init__(self):
         INBOX_DIR.mkdir(parents=True, exist_ok=True)
+        # Serializes appends against the occasional inbox truncation in read_inbox
+        self._lock = threading.Lock()
+        # Unbuffered O_APPEND handles kept open per inbox path, so a send is a single write()
+        self._files: Dict[Path, Any] = {}
+        # Called with the recipient's name after each append (set by TeammateManager)
+        self.on_send = None
+        # Inbox size each reader had consumed up to at its last read, for inbox_pending
+        self._consumed: Dict[str, int] = {}
+
+    def _append(self, to: str, payload: bytes):
+        """Append one encoded line to an inbox; caller holds self._lock."""
+        path = INBOX_DIR / f"{to}.jsonl"
+        f = self._files.get(path)
+        if f is None:
+            f = self._files[path] = open(path, "ab", buffering=0)
+        f.write(payload)
 
     def send(self, sender: str, to: str, content: str,
              msg_type: str = "message", extra: dict = None) -> str:
         msg = {"type": msg_type, "from": sender, "content": content,
                "timestamp": time.time()}
         if extra: msg.update(extra)
-        with open(INBOX_DIR / f"{to}.jsonl", "a", encoding='utf-8') as f:
-            f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+        with self._lock:
+            self._append(to, _dumps_bytes(msg) + b"\n")
+        if self.on_send: self.on_send(to)
         return f"Sent {msg_type} to {to}"
 
+    def inbox_pending(self, name: str) -> bool:
+        """True if the inbox may hold unread lines; one stat() instead of a full read."""
+        try:
+            size = os.stat(INBOX_DIR / f"{name}.jsonl").st_size
+        except FileNotFoundError:
+            return False
+        return size != self._consumed.get(name)
+
     def read_inbox(self, name: str) -> list:
+        """Return messages appended since the last read, parsed."""
+        return [_loads(l) for l in self._read_new_lines(name)]
+
+    def read_inbox_raw(self, name: str) -> List[str]:
+        """Like read_inbox, but return each message as its stored JSON line."""
+        return [l.decode("utf-8") for l in self._read_new_lines(name)]
+
+    def _read_new_lines(self, name: str) -> List[bytes]:
+        """Consume and return the complete lines appended since the last read.
+
+        The inbox is append-only; a sidecar {name}.offset file records how far
+        this reader has consumed, so each drain only reads the new bytes.
+        """
         path = INBOX_DIR / f"{name}.jsonl"
-        if not path.exists(): return []
-        msgs = [json.loads(l) for l in path.read_text(encoding='utf-8').strip().splitlines() if l]
-        path.write_text("", encoding='utf-8')
-        return msgs
+        offset_path = INBOX_DIR / f"{name}.offset"
+        try:
+            offset = int(offset_path.read_text())
+        except (OSError, ValueError):
+            offset = 0
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < offset:  # inbox was truncated or replaced externally
+                    offset = 0
+                if size == offset:
+                    self._consumed[name] = size
+                    return []
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        # Leave a trailing partial line (an append still in progress) for the next read
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return []
+        lines = [l for l in data.splitlines() if l]
+        if end < len(data):
+            lines.pop()
+        offset += end
+        with self._lock:
+            if offset >= self.TRIM_BYTES and path.stat().st_size == offset:
+                path.write_bytes(b"")
+                offset = 0
+        _atomic_write(offset_path, str(offset).encode())
+        if end == len(data):
+            self._consumed[name] = offset
+        return lines
 
     def broadcast(self, sender: str, content: str, names: list) -> str:
-        count = 0
-        for n in names:
-            if n != sender:
-                self.send(sender, n, content, "broadcast")
-                count += 1
-        return f"Broadcast to {count} teammates"
+        recipients = [n for n in names if n != sender]
+        # Every recipient gets the same line: encode once, append under one lock hold
+        payload = _dumps_bytes({"type": "broadcast", "from": sender, "content": content,
+                                "timestamp": time.time()}) + b"\n"
+        with self._lock:
+            for n in recipients:
+                self._append(n, payload)
+        if self.on_send:
+            for n in recipients:
+                self.on_send(n)
+        return f"Broadcast to {len(recipients)} teammates"
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
 
 
 # === SECTION: shutdown + plan tracking (s10) ===
@@ -1492,6 +2308,27 @@ plan_requests = {}
 
 
 # === SECTION: team (s09/s11) ===
+# File/shell tools available to teammates; idle, claim_task and send_message need
+# per-teammate state and are handled inline in TeammateManager._loop
+TEAM_TOOL_HANDLERS = {
+    "bash":       lambda kw: run_bash(kw["command"]),
+    "read_file":  lambda kw: run_read(kw["path"]),
+    "write_file": lambda kw: run_write(kw["path"], kw["content"]),
+    "edit_file":  lambda kw: run_edit(kw["path"], kw["old_text"], kw["new_text"]),
+}
+
+# Tool schemas sent with every teammate request; built once and shared by all teammates
+TEAM_TOOLS = (
+    {"name": "bash", "description": "Run command.", "input_schema": {"type": "object", "properties": {"command": {"type": "string"}}, "required": ["command"]}},
+    {"name": "read_file", "description": "Read file.", "input_schema": {"type": "object", "properties": {"path": {"type": "string"}}, "required": ["path"]}},
+    {"name": "write_file", "description": "Write file.", "input_schema": {"type": "object", "properties": {"path": {"type": "string"}, "content": {"type": "string"}}, "required": ["path", "content"]}},
+    {"name": "edit_file", "description": "Edit file.", "input_schema": {"type": "object", "properties": {"path": {"type": "string"}, "old_text": {"type": "string"}, "new_text": {"type": "string"}}, "required": ["path", "old_text", "new_text"]}},
+    {"name": "send_message", "description": "Send message.", "input_schema": {"type": "object", "properties": {"to": {"type": "string"}, "content": {"type": "string"}}, "required": ["to", "content"]}},
+    {"name": "idle", "description": "Signal no more work.", "input_schema": {"type": "object", "properties": {}}},
+    {"name": "claim_task", "description": "Claim task by ID.", "input_schema": {"type": "object", "properties": {"task_id": {"type": "integer"}}, "required": ["task_id"]}},
+)
+
+
 class TeammateManager:
     def __init__(self, bus: MessageBus, task_mgr: TaskManager):
         TEAM_DIR.mkdir(exist_ok=True)
@@ -1499,7 +2336,58 @@ class TeammateManager:
         self.task_mgr = task_mgr
         self.config_path = TEAM_DIR / "config.json"
         self.config = self._load()
+        # name -> member dict, sharing the dicts in config["members"] (kept for JSON order)
+        self._by_name = {m["name"]: m for m in self.config["members"]}
         self.threads = {}
+        # Per-teammate wake events for the idle phase, set on new mail or task changes
+        self._wake: Dict[str, threading.Event] = {}
+        self._wake_lock = threading.Lock()
+        self._watcher = None
+        bus.on_send = self._notify
+        task_mgr.on_save = self._notify_all
+
+    def _wake_event(self, name: str) -> threading.Event:
+        with self._wake_lock:
+            ev = self._wake.get(name)
+            if ev is None:
+                ev = self._wake[name] = threading.Event()
+            return ev
+
+    def _notify(self, name: str):
+        ev = self._wake.get(name)
+        if ev: ev.set()
+
+    def _notify_all(self):
+        for ev in list(self._wake.values()):
+            ev.set()
+
+    def _start_watcher(self) -> bool:
+        """Start the shared inotify thread once; False when inotify is unavailable."""
+        with self._wake_lock:
+            if self._watcher is None:
+                if INotify is None:
+                    self._watcher = False
+                else:
+                    try:
+                        ino = INotify()
+                        mask = inotify_flags.CREATE | inotify_flags.MODIFY | inotify_flags.MOVED_TO
+                        dirs = {ino.add_watch(INBOX_DIR, mask): "inbox",
+                                ino.add_watch(TASKS_DIR, mask): "tasks"}
+                    except OSError:
+                        self._watcher = False
+                    else:
+                        self._watcher = threading.Thread(target=self._watch, args=(ino, dirs), daemon=True)
+                        self._watcher.start()
+            return bool(self._watcher)
+
+    def _watch(self, ino, dirs: dict):
+        while True:
+            for event in ino.read():
+                kind = dirs.get(event.wd)
+                if kind == "inbox" and event.name.endswith(".jsonl"):
+                    self._notify(event.name[:-6])
+                elif kind == "tasks" and event.name.startswith("task_"):
+                    self._notify_all()
 
     def _load(self) -> dict:
         if self.config_path.exists():
@@ -1507,12 +2395,10 @@ class TeammateManager:
         return {"team_name": "default", "members": []}
 
     def _save(self):
-        self.config_path.write_text(json.dumps(self.config, indent=2, ensure_ascii=False), encoding='utf-8')
+        _atomic_write(self.config_path, _pretty_json(self.config).encode("utf-8"))
 
     def _find(self, name: str) -> dict:
-        for m in self.config["members"]:
-            if m["name"] == name: return m
-        return None
+        return self._by_name.get(name)
 
     def spawn(self, name: str, role: str, prompt: str) -> str:
         member = self._find(name)
@@ -1524,10 +2410,15 @@ class TeammateManager:
         else:
             member = {"name": name, "role": role, "status": "working"}
             self.config["members"].append(member)
+            self._by_name[name] = member
         self._save()
         threading.Thread(target=self._loop, args=(name, role, prompt), daemon=True).start()
         return f"Spawned '{name}' (role: {role})"
 
+    @staticmethod
+    def _has_shutdown(lines: List[str]) -> bool:
+        return any(_loads(l).get("type") == "shutdown_request" for l in lines)
+
     def _set_status(self, name: str, status: str):
         member = self._find(name)
         if member:
@@ -1539,28 +2430,20 @@ class TeammateManager:
         sys_prompt = (f"You are '{name}', role: {role}, team: {team_name}, at {WORKDIR}. "
                       f"Use idle when done with current work. You may auto-claim tasks.")
         messages = [{"role": "user", "content": prompt}]
-        tools = [
-            {"name": "bash", "description": "Run command.", "input_schema": {"type": "object", "properties": {"command": {"type": "string"}}, "required": ["command"]}},
-            {"name": "read_file", "description": "Read file.", "input_schema": {"type": "object", "properties": {"path": {"type": "string"}}, "required": ["path"]}},
-            {"name": "write_file", "description": "Write file.", "input_schema": {"type": "object", "properties": {"path": {"type": "string"}, "content": {"type": "string"}}, "required": ["path", "content"]}},
-            {"name": "edit_file", "description": "Edit file.", "input_schema": {"type": "object", "properties": {"path": {"type": "string"}, "old_text": {"type": "string"}, "new_text": {"type": "string"}}, "required": ["path", "old_text", "new_text"]}},
-            {"name": "send_message", "description": "Send message.", "input_schema": {"type": "object", "properties": {"to": {"type": "string"}, "content": {"type": "string"}}, "required": ["to", "content"]}},
-            {"name": "idle", "description": "Signal no more work.", "input_schema": {"type": "object", "properties": {}}},
-            {"name": "claim_task", "description": "Claim task by ID.", "input_schema": {"type": "object", "properties": {"task_id": {"type": "integer"}}, "required": ["task_id"]}},
-        ]
         while True:
             # -- WORK PHASE --
             for _ in range(50):
-                inbox = self.bus.read_inbox(name)
-                for msg in inbox:
-                    if msg.get("type") == "shutdown_request":
+                inbox = self.bus.read_inbox_raw(name)
+                if inbox:
+                    if self._has_shutdown(inbox):
                         self._set_status(name, "shutdown")
                         return
-                    messages.append({"role": "user", "content": json.dumps(msg)})
+                    # All new mail goes in one user turn, as stored (no re-encoding)
+                    messages.append({"role": "user", "content": "\n".join(inbox)})
                 try:
                     response = client.messages.create(
                         model=MODEL, system=sys_prompt, messages=messages,
-                        tools=tools, max_tokens=8000)
+                        tools=TEAM_TOOLS, max_tokens=8000)
                 except Exception:
                     self._set_status(name, "shutdown")
                     return
@@ -1584,38 +2467,44 @@ class TeammateManager:
                         elif block.name == "send_message":
                             output = self.bus.send(name, block.input["to"], block.input["content"])
                         else:
-                            dispatch = {"bash": lambda **kw: run_bash(kw["command"]),
-                                        "read_file": lambda **kw: run_read(kw["path"]),
-                                        "write_file": lambda **kw: run_write(kw["path"], kw["content"]),
-                                        "edit_file": lambda **kw: run_edit(kw["path"], kw["old_text"], kw["new_text"])}
-                            output = dispatch.get(block.name, lambda **kw: "Unknown")(**block.input)
+                            handler = TEAM_TOOL_HANDLERS.get(block.name)
+                            output = handler(block.input) if handler else "Unknown"
                         print(f"  [{name}] {block.name}: {str(output)[:120]}", flush=True)
                         results.append({"type": "tool_result", "tool_use_id": block.id, "content": str(output)})
                 messages.append({"role": "user", "content": results})
                 if idle_requested:
                     break
-            # -- IDLE PHASE: poll for messages and unclaimed tasks --
+            # -- IDLE PHASE: wait for messages and unclaimed tasks --
             self._set_status(name, "idle")
             resume = False
-            for _ in range(IDLE_TIMEOUT // max(POLL_INTERVAL, 1)):
-                time.sleep(POLL_INTERVAL)
-                inbox = self.bus.read_inbox(name)
+            wake = self._wake_event(name)
+            # With inotify every change wakes us; otherwise fall back to a periodic re-check
+            # for files written outside this process
+            wait_step = IDLE_TIMEOUT if self._start_watcher() else max(POLL_INTERVAL, 1)
+            deadline = time.monotonic() + IDLE_TIMEOUT
+            while True:
+                wake.clear()  # before checking, so a change during the check is not missed
+                inbox = self.bus.read_inbox_raw(name)
                 if inbox:
-                    for msg in inbox:
-                        if msg.get("type") == "shutdown_request":
-                            self._set_status(name, "shutdown")
-                            return
-                        messages.append({"role": "user", "content": json.dumps(msg)})
+                    if self._has_shutdown(inbox):
+                        self._set_status(name, "shutdown")
+                        return
+                    messages.append({"role": "user", "content": "\n".join(inbox)})
                     resume = True
                     break
-                unclaimed = []
-                for f in sorted(TASKS_DIR.glob("task_*.json")):
-                    t = json.loads(f.read_text(encoding='utf-8'))
-                    if t.get("status") == "pending" and not t.get("owner") and not t.get("blockedBy"):
-                        unclaimed.append(t)
-                if unclaimed:
-                    task = unclaimed[0]
-                    self.task_mgr.claim(task["id"], name)
+                unclaimed = [t for t in self.task_mgr._scan()
+                             if t.get("status") == "pending" and not t.get("owner") and not t.get("blockedBy")]
+                # Other teammates woken by the same change race for these tasks; take the
+                # first one whose claim succeeds
+                task = None
+                for candidate in unclaimed:
+                    try:
+                        if self.task_mgr.try_claim(candidate["id"], name) is None:
+                            task = candidate
+                            break
+                    except ValueError:  # deleted since the scan
+                        continue
+                if task:
                     # Identity re-injection for compressed contexts
                     if len(messages) <= 3:
                         messages.insert(0, {"role": "user", "content":
@@ -1626,6 +2515,10 @@ class TeammateManager:
                     messages.append({"role": "assistant", "content": f"Claimed task #{task['id']}. Working on it."})
                     resume = True
                     break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wake.wait(min(wait_step, remaining))
             if not resume:
                 self._set_status(name, "shutdown")
                 return
@@ -1651,6 +2544,7 @@ BUS = MessageBus()
 TEAM = TeammateManager(BUS, TASK_MGR)
 
 # === SECTION: system_prompt ===
+_skill_desc = SKILLS.descriptions()
 SYSTEM = f"""You are a coding agent at {WORKDIR}. Use tools to solve tasks.
 
 === MANDATORY WORKFLOW (ALWAYS FOLLOW THIS ORDER) ===
@@ -1666,7 +2560,7 @@ The todo list should reflect the structured plan from task-decomposer.
 Set the first actionable item to "in_progress" and others to "pending".
 
 STEP 3 - EXECUTE WITH SKILLS:
-Review available skills: {SKILLS.descriptions()}
+Review available skills: {_skill_desc}
 
 **Key Skills for Large Projects:**
 - architecture-master: Use for large-scale system design, language migration, major refactoring, multi-module projects. Combines with mcp-expert-programmer tools.
@@ -1777,7 +2671,7 @@ Need web information?
 - Internal comms, status reports → internal-comms
 - Collaborative docs → doc-coauthoring
 
-Skills: {SKILLS.descriptions()}"""
+Skills: {_skill_desc}"""
 
 # === SECTION: shutdown_protocol (s10) ===
 def handle_shutdown_request(teammate: str) -> str:
@@ -1797,11 +2691,21 @@ def handle_plan_review(request_id: str, approve: bool, feedback: str = "") -> st
 
 
 # === SECTION: save query result ===
+# ASCII characters that are neither word characters, whitespace nor '-'
+_FILENAME_DROP_ASCII = str.maketrans("", "", "".join(
+    c for c in map(chr, range(128)) if not (c.isalnum() or c in "_-" or c.isspace())))
+_FILENAME_UNSAFE_RE = re.compile(r'[^\w\s\u4e00-\u9fff-]')
+
+
 def sanitize_filename(query: str, max_len: int = 50) -> str:
     """Sanitize user query to create a valid filename."""
-    # Remove special characters and replace spaces with underscores
-    sanitized = re.sub(r'[^\w\s\u4e00-\u9fff-]', '', query)
-    sanitized = re.sub(r'\s+', '_', sanitized.strip())
+    # Remove special characters and replace spaces with underscores; the regex is
+    # only needed when non-ASCII punctuation may be present
+    if query.isascii():
+        sanitized = query.translate(_FILENAME_DROP_ASCII)
+    else:
+        sanitized = _FILENAME_UNSAFE_RE.sub('', query)
+    sanitized = "_".join(sanitized.split())
     # Limit length
     if len(sanitized) > max_len:
         sanitized = sanitized[:max_len]
@@ -1812,10 +2716,13 @@ def extract_text_from_content(content) -> str:
     if isinstance(content, list):
         texts = []
         for block in content:
-            if hasattr(block, 'type') and block.type == "text":
-                texts.append(block.text if hasattr(block, 'text') else str(block))
-            elif isinstance(block, dict) and block.get("type") == "text":
-                texts.append(block.get("text", ""))
+            if type(block) is dict:
+                texts.append(block.get("text", "") if block.get("type") == "text" else str(block))
+            elif getattr(block, "type", None) == "text":
+                try:
+                    texts.append(block.text)
+                except AttributeError:
+                    texts.append(str(block))
             else:
                 texts.append(str(block))
         return "\n".join(texts)
@@ -1861,38 +2768,43 @@ def save_query_result(query: str, result: str, logger: AgentLogger = None) -> st
         return f"Error saving result: {e}"
 
 
+# Single writer thread so the REPL prompt returns before the markdown hits disk;
+# saves still land in submission order and are finished before interpreter exit
+SAVE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="save")
+
+
 # === SECTION: tool_dispatch (s02) ===
 TOOL_HANDLERS = {
-    "bash":             lambda **kw: run_bash(kw["command"]),
-    "tavily_search":      lambda **kw: run_tavily_search(kw["query"], kw.get("search_depth", "basic"), kw.get("max_results", 5), kw.get("include_answer", False)),
-    "tavily_news":        lambda **kw: run_tavily_news(kw["query"], kw.get("max_results", 5), kw.get("days", 7)),
-    "tavily_fact_check":  lambda **kw: run_tavily_fact_check(kw["claim"]),
-    "read_file":        lambda **kw: run_read(kw["path"], kw.get("limit")),
-    "write_file":       lambda **kw: run_write(kw["path"], kw["content"]),
-    "edit_file":        lambda **kw: run_edit(kw["path"], kw["old_text"], kw["new_text"]),
-    "set_workdir":      lambda **kw: run_set_workdir(kw["path"]),
-    "TodoWrite":        lambda **kw: TODO.update(kw["items"]),
-    "task":             lambda **kw: run_subagent(kw["prompt"], kw.get("agent_type", "Explore")),
-    "load_skill":       lambda **kw: SKILLS.load(kw["name"]),
-    "compress":         lambda **kw: "Compressing...",
-    "background_run":   lambda **kw: BG.run(kw["command"], kw.get("timeout", 120)),
-    "check_background": lambda **kw: BG.check(kw.get("task_id")),
-    "task_create":      lambda **kw: TASK_MGR.create(kw["subject"], kw.get("description", "")),
-    "task_get":         lambda **kw: TASK_MGR.get(kw["task_id"]),
-    "task_update":      lambda **kw: TASK_MGR.update(kw["task_id"], kw.get("status"), kw.get("add_blocked_by"), kw.get("add_blocks")),
-    "task_list":        lambda **kw: TASK_MGR.list_all(),
-    "spawn_teammate":   lambda **kw: TEAM.spawn(kw["name"], kw["role"], kw["prompt"]),
-    "list_teammates":   lambda **kw: TEAM.list_all(),
-    "send_message":     lambda **kw: BUS.send("lead", kw["to"], kw["content"], kw.get("msg_type", "message")),
-    "read_inbox":       lambda **kw: json.dumps(BUS.read_inbox("lead"), indent=2),
-    "broadcast":        lambda **kw: BUS.broadcast("lead", kw["content"], TEAM.member_names()),
-    "shutdown_request": lambda **kw: handle_shutdown_request(kw["teammate"]),
-    "plan_approval":    lambda **kw: handle_plan_review(kw["request_id"], kw["approve"], kw.get("feedback", "")),
-    "idle":             lambda **kw: "Lead does not idle.",
-    "claim_task":       lambda **kw: TASK_MGR.claim(kw["task_id"], "lead"),
+    "bash":             lambda kw: run_bash(kw["command"]),
+    "tavily_search":      lambda kw: run_tavily_search(kw["query"], kw.get("search_depth", "basic"), kw.get("max_results", 5), kw.get("include_answer", False)),
+    "tavily_news":        lambda kw: run_tavily_news(kw["query"], kw.get("max_results", 5), kw.get("days", 7)),
+    "tavily_fact_check":  lambda kw: run_tavily_fact_check(kw["claim"]),
+    "read_file":        lambda kw: run_read(kw["path"], kw.get("limit")),
+    "write_file":       lambda kw: run_write(kw["path"], kw["content"]),
+    "edit_file":        lambda kw: run_edit(kw["path"], kw["old_text"], kw["new_text"]),
+    "set_workdir":      lambda kw: run_set_workdir(kw["path"]),
+    "TodoWrite":        lambda kw: TODO.update(kw["items"]),
+    "task":             lambda kw: run_subagent(kw["prompt"], kw.get("agent_type", "Explore")),
+    "load_skill":       lambda kw: SKILLS.load(kw["name"]),
+    "compress":         lambda kw: "Compressing...",
+    "background_run":   lambda kw: BG.run(kw["command"], kw.get("timeout", 120)),
+    "check_background": lambda kw: BG.check(kw.get("task_id")),
+    "task_create":      lambda kw: TASK_MGR.create(kw["subject"], kw.get("description", "")),
+    "task_get":         lambda kw: TASK_MGR.get(kw["task_id"]),
+    "task_update":      lambda kw: TASK_MGR.update(kw["task_id"], kw.get("status"), kw.get("add_blocked_by"), kw.get("add_blocks")),
+    "task_list":        lambda kw: TASK_MGR.list_all(),
+    "spawn_teammate":   lambda kw: TEAM.spawn(kw["name"], kw["role"], kw["prompt"]),
+    "list_teammates":   lambda kw: TEAM.list_all(),
+    "send_message":     lambda kw: BUS.send("lead", kw["to"], kw["content"], kw.get("msg_type", "message")),
+    "read_inbox":       lambda kw: _pretty_json(BUS.read_inbox("lead")),
+    "broadcast":        lambda kw: BUS.broadcast("lead", kw["content"], TEAM.member_names()),
+    "shutdown_request": lambda kw: handle_shutdown_request(kw["teammate"]),
+    "plan_approval":    lambda kw: handle_plan_review(kw["request_id"], kw["approve"], kw.get("feedback", "")),
+    "idle":             lambda kw: "Lead does not idle.",
+    "claim_task":       lambda kw: TASK_MGR.claim(kw["task_id"], "lead"),
 }
 
-TOOLS = [
+TOOLS = (
     {"name": "bash", "description": "Run a shell command.",
      "input_schema": {"type": "object", "properties": {"command": {"type": "string"}}, "required": ["command"]}},
     {"name": "read_file", "description": "Read file contents.",
@@ -1928,7 +2840,7 @@ TOOLS = [
     {"name": "list_teammates", "description": "List all teammates.",
      "input_schema": {"type": "object", "properties": {}}},
     {"name": "send_message", "description": "Send a message to a teammate.",
-     "input_schema": {"type": "object", "properties": {"to": {"type": "string"}, "content": {"type": "string"}, "msg_type": {"type": "string", "enum": list(VALID_MSG_TYPES)}}, "required": ["to", "content"]}},
+     "input_schema": {"type": "object", "properties": {"to": {"type": "string"}, "content": {"type": "string"}, "msg_type": {"type": "string", "enum": sorted(VALID_MSG_TYPES)}}, "required": ["to", "content"]}},
     {"name": "read_inbox", "description": "Read and drain the lead's inbox.",
      "input_schema": {"type": "object", "properties": {}}},
     {"name": "broadcast", "description": "Send message to all teammates.",
@@ -1948,17 +2860,172 @@ TOOLS = [
      "input_schema": {"type": "object", "properties": {"query": {"type": "string", "description": "News search query"}, "max_results": {"type": "integer", "description": "Maximum results (1-10)"}, "days": {"type": "integer", "description": "Limit to recent N days"}}, "required": ["query"]}},
     {"name": "tavily_fact_check", "description": "Fact-check claims or statements using Tavily API. Use to verify information accuracy or check specific claims.",
      "input_schema": {"type": "object", "properties": {"claim": {"type": "string", "description": "Claim or statement to verify"}}, "required": ["claim"]}}
-]
+)
+
+# Tool groups the lead can be restricted to via LEAD_TOOL_GROUPS (comma-separated);
+# "core" is always sent. Fewer tool definitions means a smaller request every turn.
+TOOL_GROUPS = {
+    "core":  ("bash", "read_file", "write_file", "edit_file", "set_workdir", "compress"),
+    "todo":  ("TodoWrite",),
+    "skill": ("task", "load_skill"),
+    "bg":    ("background_run", "check_background"),
+    "tasks": ("task_create", "task_get", "task_update", "task_list", "claim_task"),
+    "team":  ("spawn_teammate", "list_teammates", "send_message", "read_inbox", "broadcast",
+              "shutdown_request", "plan_approval", "idle"),
+    "web":   ("tavily_search", "tavily_news", "tavily_fact_check"),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def tools_for(groups: frozenset) -> tuple:
+    """Return the TOOLS entries belonging to the given groups (plus core), in TOOLS order."""
+    names = set(TOOL_GROUPS["core"])
+    for g in groups:
+        names.update(TOOL_GROUPS.get(g, ()))
+    return tuple(t for t in TOOLS if t["name"] in names)
+
+
+_lead_groups = os.getenv("LEAD_TOOL_GROUPS", "").strip()
+LEAD_TOOLS = tools_for(frozenset(g.strip() for g in _lead_groups.split(","))) if _lead_groups else TOOLS
 
 
 # === SECTION: agent_loop ===
+# Lead tools that only read state or call out over the network; consecutive calls to
+# them run concurrently. Everything else (writes, todos, subagents, messaging) runs alone.
+_LEAD_PARALLEL_SAFE_TOOLS = {"read_file", "tavily_search", "tavily_news", "tavily_fact_check",
+                             "load_skill", "task_get", "task_list", "list_teammates",
+                             "check_background"}
+
+
+def _run_lead_tool(block):
+    handler = TOOL_HANDLERS.get(block.name)
+    try:
+        return handler(block.input) if handler else f"Unknown tool: {block.name}"
+    except Exception as e:
+        return f"Error: {e}"
+
+
+def _append_user_text(messages: list, text: str):
+    """Add text to the conversation as user input without a synthetic assistant reply.
+
+    Merged into the trailing user message (e.g. the last tool results) when there is
+    one, so user/assistant turns keep alternating.
+    """
+    last = messages[-1] if messages else None
+    if last is None or last["role"] != "user":
+        messages.append({"role": "user", "content": text})
+        return
+    if isinstance(last["content"], list):
+        last["content"].append({"type": "text", "text": text})
+    else:
+        last["content"] = f"{last['content']}\n\n{text}"
+    _retoken(last)
+
+
+class RateLimiter:
+    """Keep successive LLM calls at least min_interval seconds apart.
+
+    Only spaces out calls that would otherwise come faster than the interval; a 429
+    is still retried with backoff (honouring retry-after) by the SDK / ClientPool.
+    """
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.min_interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+LLM_RATE = RateLimiter(float(os.getenv("LLM_MIN_INTERVAL", "0")))
+# Background notifications delivered per turn; any excess waits for the next turn
+BG_DRAIN_BUDGET = 16
+# AGENT_DEBUG=1 dumps every model response as JSON; otherwise only its text is shown
+DEBUG = os.getenv("AGENT_DEBUG") == "1"
+
+
+def _lead_bookkeeping(messages: list):
+    """Per-turn housekeeping before an LLM call: compaction, then pending updates.
+
+    Each part is incremental or gated (microcompact stops at handled messages, the
+    token total is a running sum, drains are skipped when nothing is pending), so
+    running it every turn costs little and updates are never delayed.
+    """
+    # s06: compression pipeline
+    microcompact(messages)
+    if estimate_tokens(messages) > TOKEN_THRESHOLD:
+        print("[auto-compact triggered]", flush=True)
+        auto_compact(messages)
+    # s08 + s10: background notifications and lead inbox, delivered together.
+    # Both sources are gated by a cheap check; the drain is bounded per turn
+    updates = []
+    notifs = BG.drain(BG_DRAIN_BUDGET) if BG.pending() else None
+    if notifs:
+        txt = "\n".join(f"[bg:{n['task_id']}] {n['status']}: {n['result']}" for n in notifs)
+        updates.append(f"<background-results>\n{txt}\n</background-results>")
+    inbox = BUS.read_inbox("lead") if BUS.inbox_pending("lead") else None
+    if inbox:
+        updates.append(f"<inbox>{_pretty_json(inbox)}</inbox>")
+    if updates:
+        _append_user_text(messages, "\n".join(updates))
+
+
+def _lead_tool_step(response, logger: AgentLogger):
+    """
+    Execute the tool calls of one response.
+
+    Consecutive read-only calls run concurrently; results keep block order.
+
+    Returns:
+        (tool_result blocks, whether TodoWrite was used, whether compress was requested)
+    """
+    results = []
+    tool_lines = []
+    used_todo = False
+    manual_compress = False
+    tool_blocks = [b for b in response.content if b.type == "tool_use"]
+    outputs = _run_tool_blocks(tool_blocks, _run_lead_tool, _LEAD_PARALLEL_SAFE_TOOLS, max_workers=8)
+    for block, output in zip(tool_blocks, outputs):
+        if block.name == "compress":
+            manual_compress = True
+        if not isinstance(output, str):
+            output = str(output)
+        tool_lines.append(f"> {block.name}: {output[:200]}\n")
+        results.append({"type": "tool_result", "tool_use_id": block.id, "content": output})
+        # Log tool result
+        logger.log_tool_result(block.name, output)
+        # Log skill load if applicable
+        if block.name == "load_skill":
+            skill_name = block.input.get("name", "unknown")
+            logger.log_skill_load(skill_name)
+        if block.name == "TodoWrite":
+            used_todo = True
+    sys.stdout.write("".join(tool_lines))
+    sys.stdout.flush()
+    return results, used_todo, manual_compress
+
+
 def agent_loop(messages: list, agent_name: str = "main"):
     """
     Main agent loop with LLM interaction and tool execution.
     
+    Each turn: bookkeeping, one LLM call, then the tool step until the model stops
+    asking for tools.
+    
     Args:
         messages: Conversation history messages
         agent_name: Name of the agent for logging purposes
+    
+    Returns:
+        Content of the final assistant message (also appended to messages)
     """
     rounds_without_todo = 0
     logger = AgentLogger(agent_name)
@@ -1966,64 +3033,33 @@ def agent_loop(messages: list, agent_name: str = "main"):
     logger.reset_trace()
     
     while True:
-        # s06: compression pipeline
-        microcompact(messages)
-        if estimate_tokens(messages) > TOKEN_THRESHOLD:
-            print("[auto-compact triggered]", flush=True)
-            messages[:] = auto_compact(messages)
-        # s08: drain background notifications
-        notifs = BG.drain()
-        if notifs:
-            txt = "\n".join(f"[bg:{n['task_id']}] {n['status']}: {n['result']}" for n in notifs)
-            messages.append({"role": "user", "content": f"<background-results>\n{txt}\n</background-results>"})
-            messages.append({"role": "assistant", "content": "Noted background results."})
-        # s10: check lead inbox
-        inbox = BUS.read_inbox("lead")
-        if inbox:
-            messages.append({"role": "user", "content": f"<inbox>{json.dumps(inbox, indent=2)}</inbox>"})
-            messages.append({"role": "assistant", "content": "Noted inbox messages."})
+        _lead_bookkeeping(messages)
         
         # LLM call - log the call after response
-        client.auth_token = client.api_key
+        LLM_RATE.wait()
         response = client.messages.create(
             model=MODEL, system=SYSTEM, messages=messages,
-            tools=TOOLS, max_tokens=8000,
+            tools=LEAD_TOOLS, max_tokens=8000,
         )
         
         # Log the LLM call (input messages and output response)
         logger.log_call(messages, response)
         
-        print('\n'*2, flush=True)
-        print('-'*40, flush=True)
-        print('模型的输出:', flush=True)
-        js(response.content)
-        time.sleep(2)
+        # One write per burst of output instead of a flushed print per line
+        if DEBUG:
+            sys.stdout.write(f"\n\n\n{'-' * 40}\n模型的输出:\n"
+                             f"{_pretty_json(response.content)}\n")
+            sys.stdout.flush()
+        else:
+            text = "\n".join(b.text for b in response.content if b.type == "text")
+            if text:
+                sys.stdout.write(f"{text}\n")
+                sys.stdout.flush()
         messages.append({"role": "assistant", "content": response.content})
         if response.stop_reason != "tool_use":
-            return  # Final response, exit loop
-        # Tool execution
-        results = []
-        used_todo = False
-        manual_compress = False
-        for block in response.content:
-            if block.type == "tool_use":
-                if block.name == "compress":
-                    manual_compress = True
-                handler = TOOL_HANDLERS.get(block.name)
-                try:
-                    output = handler(**block.input) if handler else f"Unknown tool: {block.name}"
-                except Exception as e:
-                    output = f"Error: {e}"
-                print(f"> {block.name}: {str(output)[:200]}", flush=True)
-                results.append({"type": "tool_result", "tool_use_id": block.id, "content": str(output)})
-                # Log tool result
-                logger.log_tool_result(block.name, str(output))
-                # Log skill load if applicable
-                if block.name == "load_skill":
-                    skill_name = block.input.get("name", "unknown")
-                    logger.log_skill_load(skill_name)
-                if block.name == "TodoWrite":
-                    used_todo = True
+            return response.content  # Final response, exit loop
+        
+        results, used_todo, manual_compress = _lead_tool_step(response, logger)
         # s03: nag reminder (only when todo workflow is active)
         rounds_without_todo = 0 if used_todo else rounds_without_todo + 1
         if TODO.has_open_items() and rounds_without_todo >= 3:
@@ -2032,7 +3068,7 @@ def agent_loop(messages: list, agent_name: str = "main"):
         # s06: manual compress
         if manual_compress:
             print("[manual compact]", flush=True)
-            messages[:] = auto_compact(messages)
+            auto_compact(messages)
 
 
 # === SECTION: repl ===
@@ -2056,7 +3092,7 @@ if __name__ == "__main__":
         if query.strip() == "/compact":
             if history:
                 print("[manual compact via /compact]", flush=True)
-                history[:] = auto_compact(history)
+                auto_compact(history)
             continue
         if query.strip() == "/tasks":
             print(TASK_MGR.list_all(), flush=True)
@@ -2065,18 +3101,13 @@ if __name__ == "__main__":
             print(TEAM.list_all(), flush=True)
             continue
         if query.strip() == "/inbox":
-            print(json.dumps(BUS.read_inbox("lead"), indent=2), flush=True)
+            print(_pretty_json(BUS.read_inbox("lead")), flush=True)
             continue
         history.append({"role": "user", "content": query})
-        agent_loop(history, agent_name="lead")
+        final_content = agent_loop(history, agent_name="lead")
         # Save query result to markdown file
-        # Get the last assistant response from history
-        result = ""
-        for msg in reversed(history):
-            if msg.get("role") == "assistant":
-                result = extract_text_from_content(msg.get("content", ""))
-                break
+        result = extract_text_from_content(final_content) if final_content else ""
         if result:
-            save_path = save_query_result(query, result, None)
-            print(f"\033[90m{save_path}\033[0m", flush=True)
+            fut = SAVE_POOL.submit(save_query_result, query, result, None)
+            fut.add_done_callback(lambda f: print(f"\033[90m{f.result()}\033[0m", flush=True))
         print()
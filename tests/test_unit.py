@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Unit tests for agents/s_full.py that need no LLM access.
+
+Run: python tests/test_unit.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+AGENTS_DIR = Path(__file__).resolve().parent.parent / "agents"
+s_full = None
+
+
+def setUpModule():
+    global s_full
+    # s_full creates its state directories under the current working directory
+    os.chdir(tempfile.mkdtemp(prefix="s_full_test_"))
+    sys.path.insert(0, str(AGENTS_DIR))
+    try:
+        import s_full as module
+    except (ImportError, OSError) as e:
+        raise unittest.SkipTest(f"s_full not importable here: {e}")
+    s_full = module
+
+
+class BackgroundShellTest(unittest.TestCase):
+    def test_detached_commands_are_detected(self):
+        match = s_full._LEAVES_CHILDREN_RE.search
+        for cmd in ["sleep 1 &", "(sleep 0.3; echo LATE) &", "a & b", "nohup ./srv",
+                    "setsid x", "x; disown"]:
+            self.assertTrue(match(cmd), cmd)
+        for cmd in ["make && make test", "cmd 2>&1", "echo err >&2", "cmd &> log",
+                    "a |& tee log", "echo ok"]:
+            self.assertFalse(match(cmd), cmd)
+
+    def test_late_background_output_stays_with_its_command(self):
+        if not s_full.HAS_BASH:
+            self.skipTest("needs bash")
+        # Both commands run on this thread, i.e. through the same PersistentShell
+        bg = s_full.BackgroundManager()
+        bg.tasks["a"] = {"status": "queued", "command": "", "result": None}
+        bg._exec("a", "(sleep 0.3; echo LATE) &", 5)
+        time.sleep(0.5)
+        bg.tasks["b"] = {"status": "queued", "command": "", "result": None}
+        bg._exec("b", "echo second", 5)
+        self.assertEqual(bg.tasks["a"]["result"], "LATE")
+        self.assertEqual(bg.tasks["b"]["result"], "second")
+
+
+class SubagentToolOrderTest(unittest.TestCase):
+    def test_consecutive_bash_calls_run_in_order(self):
+        from types import SimpleNamespace
+        order = []
+
+        def bash(kw):
+            if kw["command"] == "first":
+                time.sleep(0.2)
+            order.append(kw["command"])
+            return kw["command"]
+
+        blocks = [SimpleNamespace(name="bash", input={"command": c}) for c in ("first", "second")]
+        outputs = s_full._run_subagent_tools(blocks, {"bash": bash})
+        self.assertEqual(outputs, ["first", "second"])
+        self.assertEqual(order, ["first", "second"])
+
+
+class TaskClaimTest(unittest.TestCase):
+    def test_claim_refuses_owned_task(self):
+        tm = s_full.TaskManager()
+        tid = s_full.json.loads(tm.create("claim me"))["id"]
+        self.assertEqual(tm.claim(tid, "alice"), f"Claimed task #{tid} for alice")
+        self.assertTrue(tm.claim(tid, "bob").startswith("Error:"))
+        self.assertEqual(s_full.json.loads(tm.get(tid))["owner"], "alice")
+
+    def test_concurrent_claims_have_one_winner(self):
+        from concurrent.futures import ThreadPoolExecutor
+        tm = s_full.TaskManager()
+        tid = s_full.json.loads(tm.create("race"))["id"]
+        with ThreadPoolExecutor(max_workers=8) as ex:
+            refusals = list(ex.map(lambda n: tm.try_claim(tid, f"mate{n}"), range(8)))
+        self.assertEqual(refusals.count(None), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()